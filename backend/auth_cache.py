@@ -0,0 +1,159 @@
+# Importing necessary libraries
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+# Cache settings
+# Maximum number of session tokens kept in memory (the least recently used token is evicted first)
+AUTH_CACHE_SIZE = int(os.environ.get("REHABAI_AUTH_CACHE_SIZE", 10000))
+# Cached tokens are checked against the database again after this many seconds
+AUTH_CACHE_TTL_SECONDS = float(os.environ.get("REHABAI_AUTH_CACHE_TTL_SECONDS", 300))
+# Optional SQLite file shared by several uvicorn workers on the same machine, so a login or logout handled
+# by one worker is seen by the others
+AUTH_CACHE_SHARED_PATH = os.environ.get("REHABAI_AUTH_CACHE_SHARED_PATH") or None
+# With a shared store, tokens are only trusted from memory for this many seconds before the shared store is read again
+AUTH_CACHE_SHARED_REFRESH_SECONDS = float(os.environ.get("REHABAI_AUTH_CACHE_SHARED_REFRESH_SECONDS", 1))
+
+# Slim user record returned by get_current_user, enough for every authenticated endpoint
+CachedUser = namedtuple("CachedUser", ["id", "user_id", "username"])
+
+
+# Session token store shared by the workers of one machine, kept in a SQLite file
+class SharedTokenStore:
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        with self._connect() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS auth_tokens ("
+                "token TEXT PRIMARY KEY, id INTEGER, user_id TEXT, username TEXT, expires_at REAL)"
+            )
+
+    def _connect(self):
+        # One connection per thread, SQLite connections cannot be shared between threads
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            self._local.connection = connection
+        return connection
+
+    def get(self, token, now):
+        row = self._connect().execute(
+            "SELECT id, user_id, username, expires_at FROM auth_tokens WHERE token = ?", (token,)
+        ).fetchone()
+        if row is None or row[3] <= now:
+            return None, 0
+        return CachedUser(*row[:3]), row[3]
+
+    def put(self, token, user, expires_at):
+        self._connect().execute(
+            "INSERT OR REPLACE INTO auth_tokens (token, id, user_id, username, expires_at) VALUES (?, ?, ?, ?, ?)",
+            (token, user.id, user.user_id, user.username, expires_at),
+        )
+
+    def delete(self, token):
+        self._connect().execute("DELETE FROM auth_tokens WHERE token = ?", (token,))
+
+    def delete_expired(self, now):
+        self._connect().execute("DELETE FROM auth_tokens WHERE expires_at <= ?", (now,))
+
+
+# LRU cache of session tokens with a TTL, so authenticated requests do not query the database every time
+class AuthCache:
+    def __init__(
+        self,
+        max_size=AUTH_CACHE_SIZE,
+        ttl_seconds=AUTH_CACHE_TTL_SECONDS,
+        shared_path=AUTH_CACHE_SHARED_PATH,
+        shared_refresh_seconds=AUTH_CACHE_SHARED_REFRESH_SECONDS,
+    ):
+        self.max_size = max(1, max_size)
+        self.ttl_seconds = ttl_seconds
+        self.shared_store = SharedTokenStore(shared_path) if shared_path else None
+        # Tokens are trusted from memory until the TTL or, with a shared store, the refresh interval expires
+        self.local_ttl_seconds = min(ttl_seconds, shared_refresh_seconds) if self.shared_store else ttl_seconds
+        # token -> (user, time until which the memory entry is trusted, expiry time of the token)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    # Function to get the cached user of a session token, or None if the token must be looked up in the database
+    async def get(self, token):
+        # Wall clock time, so expiry times can be compared between worker processes
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is not None:
+                user, trusted_until, expires_at = entry
+                if now < trusted_until:
+                    self._entries.move_to_end(token)
+                    self.hits += 1
+                    return user
+                del self._entries[token]
+
+        if self.shared_store is not None:
+            # SQLite may wait for the lock of another worker, so the shared store is only used from a thread
+            user, expires_at = await asyncio.to_thread(self.shared_store.get, token, now)
+            if user is not None:
+                with self._lock:
+                    self._store(token, user, now, expires_at)
+                    self.shared_hits += 1
+                return user
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    # Function to cache the user (anything with id, user_id and username attributes) of a session token
+    async def put(self, token, user):
+        user = CachedUser(user.id, user.user_id, user.username)
+        now = time.time()
+        expires_at = now + self.ttl_seconds
+        with self._lock:
+            self._store(token, user, now, expires_at)
+        if self.shared_store is not None:
+            await asyncio.to_thread(self.shared_store.put, token, user, expires_at)
+        return user
+
+    def _store(self, token, user, now, expires_at):
+        self._entries[token] = (user, min(expires_at, now + self.local_ttl_seconds), expires_at)
+        self._entries.move_to_end(token)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    # Function to forget a session token, called when it is replaced at login or removed at logout
+    async def invalidate(self, token):
+        if not token:
+            return
+        with self._lock:
+            self._entries.pop(token, None)
+            self.invalidations += 1
+        if self.shared_store is not None:
+            await asyncio.to_thread(self.shared_store.delete, token)
+            await asyncio.to_thread(self.shared_store.delete_expired, time.time())
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.shared_hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl_seconds": self.ttl_seconds,
+                "shared_store": self.shared_store is not None,
+                "hits": self.hits,
+                "shared_hits": self.shared_hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits + self.shared_hits) / lookups if lookups else 0.0,
+                "invalidations": self.invalidations,
+            }
+
+
+# Cache used by get_current_user
+auth_cache = AuthCache()
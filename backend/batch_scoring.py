@@ -0,0 +1,360 @@
+# Offline scoring of archived exercise sessions (csv files in a directory or a tar archive)
+# The files are grouped by exercise into batches, which are prepared and scored by worker processes that each preload
+# the models. The scores are appended to a csv file (or a directory of Parquet files) as the batches complete, and the
+# files already in the output are skipped, so an interrupted run resumes where it stopped.
+# Usage (from the backend directory): python batch_scoring.py sessions/ scores.csv [--workers 4] [--batch-size 32]
+import argparse
+import csv
+import io
+import json
+import multiprocessing
+import os
+import re
+import tarfile
+import time
+from collections import defaultdict, namedtuple
+from concurrent.futures import ALL_COMPLETED, FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np
+import pandas as pd
+
+from metrics import get_logger
+from ml_wrapper import MAX_FRAMES, MAX_LENGTH_MAPPING, get_dataframe_cols, prepare_data, reorder_dataframe
+from model_registry import configure_tf_threads, model_registry, predict_batch
+
+# Parquet output is optional, it is only available when the pyarrow package is installed
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+logger = get_logger(__name__)
+
+# Batch scoring settings
+# Number of worker processes, each one loads every model
+BATCH_SCORING_WORKERS = int(os.environ.get("REHABAI_BATCH_SCORING_WORKERS", os.cpu_count() or 1))
+# Number of sessions of the same exercise scored by one model call
+BATCH_SCORING_BATCH_SIZE = int(os.environ.get("REHABAI_BATCH_SCORING_BATCH_SIZE", 32))
+# TensorFlow threads of each worker process, the workers already keep every core busy
+WORKER_TF_THREADS = 1
+# Number of rows written to each Parquet file
+PARQUET_ROWS_PER_FILE = 1000
+# Number of seconds between two progress logs
+PROGRESS_LOG_SECONDS = 10
+
+# Columns of the output
+OUTPUT_COLUMNS = ["source", "exercise_id", "frames", "clinical_score", "model_version", "status", "error"]
+
+# Exercise id in a file path, e.g. E_ID12_Es3.csv or Es3/session_12.csv
+EXERCISE_PATTERN = re.compile(r"(?<![A-Za-z0-9])(Es\d+)(?![0-9])")
+
+# Session csv file to score, read from path or, for the files of an archive, already read into text
+SessionFile = namedtuple("SessionFile", ["source", "exercise_id", "path", "text"])
+
+
+# Function to get the exercise of a session file from its path (the last exercise id in the path), or None
+def get_exercise_id(source):
+    matches = [match for match in EXERCISE_PATTERN.findall(source) if match in MAX_LENGTH_MAPPING]
+    return matches[-1] if matches else None
+
+
+# Function to list the session csv files of a directory or a tar archive (read one member at a time),
+# as (session file, error message or None) pairs
+def iter_session_files(input_path, exercise_id=None):
+    if os.path.isdir(input_path):
+        for root, directories, files in os.walk(input_path):
+            directories.sort()
+            for name in sorted(files):
+                if name.lower().endswith(".csv"):
+                    path = os.path.join(root, name)
+                    source = os.path.relpath(path, input_path)
+                    yield SessionFile(source, exercise_id or get_exercise_id(source), path, None), None
+    elif tarfile.is_tarfile(input_path):
+        # Streaming mode, the archive is read once from start to end
+        with tarfile.open(input_path, "r|*") as archive:
+            for member in archive:
+                if member.isfile() and member.name.lower().endswith(".csv"):
+                    session_file = SessionFile(member.name, exercise_id or get_exercise_id(member.name), None, None)
+                    try:
+                        text = archive.extractfile(member).read().decode("utf-8")
+                    except (tarfile.TarError, OSError, UnicodeDecodeError) as error:
+                        # Recorded as an error row by run_batch_scoring, the other members are still scored
+                        yield session_file, f"{type(error).__name__}: {error}"
+                        continue
+                    yield session_file._replace(text=text), None
+    else:
+        raise ValueError(f"{input_path} is neither a directory nor a tar archive")
+
+
+# Function to build an output row
+def get_row(session_file, exercise_id, frames=None, score=None, model_version=None, error=None):
+    return {
+        "source": session_file.source,
+        "exercise_id": exercise_id,
+        "frames": frames,
+        "clinical_score": score,
+        "model_version": model_version,
+        "status": "error" if error else "ok",
+        "error": error,
+    }
+
+
+# Function to load the models once in each worker process
+def initialize_worker(tf_threads=WORKER_TF_THREADS):
+    configure_tf_threads(tf_threads, tf_threads)
+    model_registry.preload()
+
+
+# Function to prepare and score a batch of session files of one exercise (runs in the worker processes)
+def score_batch(exercise_id, session_files):
+    max_length = MAX_LENGTH_MAPPING[exercise_id]
+    rows = []
+    prepared = []
+    for session_file in session_files:
+        try:
+            raw_data = pd.read_csv(session_file.path or io.StringIO(session_file.text), sep=",")
+            # The API scores missing joints as zeros, an archive is more likely to hold files of another format
+            missing_columns = [column for column in get_dataframe_cols() if column not in raw_data.columns]
+            if missing_columns:
+                raise ValueError(f"{len(missing_columns)} joint columns missing, e.g. {missing_columns[0]}")
+            data, padding_mask = prepare_data(reorder_dataframe(raw_data), max_length, exercise_id)
+        except Exception as error:
+            rows.append(get_row(session_file, exercise_id, error=f"{type(error).__name__}: {error}"))
+            continue
+        prepared.append((session_file, len(raw_data), data, padding_mask))
+    if not prepared:
+        return rows
+
+    model_version = model_registry.get_version(exercise_id)
+    try:
+        # Every prepared session of the batch is scored by a single model call
+        scores = predict_batch(
+            exercise_id,
+            np.concatenate([data for _, _, data, _ in prepared]),
+            np.concatenate([padding_mask for _, _, _, padding_mask in prepared]),
+        )
+    except Exception as error:
+        message = f"{type(error).__name__}: {error}"
+        return rows + [
+            get_row(session_file, exercise_id, frames, error=message) for session_file, frames, _, _ in prepared
+        ]
+    for (session_file, frames, _, _), score in zip(prepared, scores):
+        rows.append(get_row(session_file, exercise_id, frames, float(score[0]), model_version))
+    return rows
+
+
+# Scores written to a csv file, appended to the rows of previous runs
+class CsvResultWriter:
+    def __init__(self, path):
+        self.path = path
+        if os.path.exists(path):
+            # A run that was killed may have left a partial last line, it is dropped and scored again
+            with open(path, "rb+") as output_file:
+                content = output_file.read()
+                output_file.truncate(content.rfind(b"\n") + 1)
+        has_rows = os.path.exists(path) and os.path.getsize(path) > 0
+        self._file = open(path, "a", newline="")
+        self._writer = csv.DictWriter(self._file, fieldnames=OUTPUT_COLUMNS)
+        if not has_rows:
+            self._writer.writeheader()
+
+    @staticmethod
+    def read_rows(path):
+        if not os.path.exists(path):
+            return []
+        with open(path, newline="") as output_file:
+            return [row for row in csv.DictReader(output_file) if row.get("status") in ("ok", "error")]
+
+    def write(self, rows):
+        self._writer.writerows(rows)
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+# Scores written to a directory of Parquet files, one file per chunk of rows
+class ParquetResultWriter:
+    def __init__(self, path, rows_per_file=PARQUET_ROWS_PER_FILE):
+        if pyarrow is None:
+            raise RuntimeError("Parquet output requires the pyarrow package")
+        self.path = path
+        self.rows_per_file = rows_per_file
+        os.makedirs(path, exist_ok=True)
+        self._next_index = len(self.get_part_paths(path))
+        self._rows = []
+
+    @staticmethod
+    def get_part_paths(path):
+        if not os.path.isdir(path):
+            return []
+        return sorted(os.path.join(path, name) for name in os.listdir(path) if name.endswith(".parquet"))
+
+    @staticmethod
+    def read_rows(path):
+        part_paths = ParquetResultWriter.get_part_paths(path)
+        if not part_paths:
+            return []
+        return pd.concat([pd.read_parquet(part_path, engine="pyarrow") for part_path in part_paths]).to_dict("records")
+
+    def write(self, rows):
+        self._rows.extend(rows)
+        if len(self._rows) >= self.rows_per_file:
+            self._write_part()
+
+    def _write_part(self):
+        if not self._rows:
+            return
+        part_path = os.path.join(self.path, f"part-{self._next_index:05d}.parquet")
+        # Write to a temporary file first so a killed run never leaves a partial file behind
+        pd.DataFrame(self._rows, columns=OUTPUT_COLUMNS).to_parquet(f"{part_path}.tmp", engine="pyarrow", index=False)
+        os.replace(f"{part_path}.tmp", part_path)
+        self._next_index += 1
+        self._rows = []
+
+    def close(self):
+        self._write_part()
+
+
+# Function to open the writer of an output path (a directory of Parquet files when it ends with .parquet)
+def open_result_writer(output_path):
+    if output_path.rstrip("/").endswith(".parquet"):
+        return ParquetResultWriter(output_path)
+    return CsvResultWriter(output_path)
+
+
+# Counters and throughput of a batch scoring run
+class BatchScoringStats:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.scored = 0
+        self.errors = 0
+        self.skipped = 0
+        self.frames = 0
+        self.batches = 0
+        self.exercises = defaultdict(int)
+        self._logged_at = self.start
+
+    def add(self, rows):
+        self.batches += 1
+        for row in rows:
+            if row["status"] == "ok":
+                self.scored += 1
+                self.frames += min(row["frames"], MAX_FRAMES)
+                self.exercises[row["exercise_id"]] += 1
+            else:
+                self.errors += 1
+        now = time.perf_counter()
+        if now - self._logged_at >= PROGRESS_LOG_SECONDS:
+            self._logged_at = now
+            logger.info(
+                "%d sessions scored, %d errors (%.1f sessions/s)",
+                self.scored,
+                self.errors,
+                self.scored / (now - self.start),
+            )
+
+    def to_dict(self):
+        elapsed_seconds = time.perf_counter() - self.start
+        return {
+            "scored": self.scored,
+            "errors": self.errors,
+            "skipped": self.skipped,
+            "batches": self.batches,
+            "frames": self.frames,
+            "exercises": dict(self.exercises),
+            "elapsed_seconds": elapsed_seconds,
+            "sessions_per_second": self.scored / elapsed_seconds if elapsed_seconds else 0.0,
+            "frames_per_second": self.frames / elapsed_seconds if elapsed_seconds else 0.0,
+        }
+
+
+# Function to score every session file of a directory or tar archive, returns the run statistics
+def run_batch_scoring(
+    input_path,
+    output_path,
+    workers=BATCH_SCORING_WORKERS,
+    batch_size=BATCH_SCORING_BATCH_SIZE,
+    exercise_id=None,
+    retry_errors=False,
+):
+    writer = open_result_writer(output_path)
+    previous_rows = writer.read_rows(output_path)
+    completed = {row["source"] for row in previous_rows if row["status"] == "ok" or not retry_errors}
+    stats = BatchScoringStats()
+    workers = max(1, workers)
+
+    def collect(futures, return_when):
+        finished, not_finished = wait(futures, return_when=return_when)
+        for future in finished:
+            rows = future.result()
+            writer.write(rows)
+            stats.add(rows)
+        return not_finished
+
+    # Worker processes are spawned because forking a process that already imported TensorFlow is unsafe
+    executor = ProcessPoolExecutor(
+        max_workers=workers, mp_context=multiprocessing.get_context("spawn"), initializer=initialize_worker
+    )
+    try:
+        futures = set()
+        pending = defaultdict(list)
+
+        def submit(batch_exercise_id, session_files):
+            nonlocal futures
+            # At most two batches per worker are queued, so an archive is not read into memory at once
+            if len(futures) >= 2 * workers:
+                futures = collect(futures, FIRST_COMPLETED)
+            futures.add(executor.submit(score_batch, batch_exercise_id, session_files))
+
+        for session_file, read_error in iter_session_files(input_path, exercise_id):
+            if session_file.source in completed:
+                stats.skipped += 1
+                continue
+            if read_error is not None or session_file.exercise_id is None:
+                error = read_error or "No exercise id (e.g. Es1) in the file path"
+                rows = [get_row(session_file, session_file.exercise_id, error=error)]
+                writer.write(rows)
+                stats.add(rows)
+                continue
+            batch = pending[session_file.exercise_id]
+            batch.append(session_file)
+            if len(batch) >= batch_size:
+                submit(session_file.exercise_id, batch)
+                pending[session_file.exercise_id] = []
+        for batch_exercise_id, batch in pending.items():
+            if batch:
+                submit(batch_exercise_id, batch)
+        collect(futures, ALL_COMPLETED)
+    finally:
+        executor.shutdown(cancel_futures=True)
+        writer.close()
+    return stats.to_dict()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Score the exercise sessions of a directory or tar archive of csv files"
+    )
+    parser.add_argument("input", help="Directory or tar archive (.tar, .tar.gz, ...) of session csv files")
+    parser.add_argument("output", help="Output csv file, or directory of Parquet files if it ends with .parquet")
+    parser.add_argument("--workers", type=int, default=BATCH_SCORING_WORKERS, help="Worker processes")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SCORING_BATCH_SIZE, help="Sessions per model call")
+    parser.add_argument(
+        "--exercise", choices=list(MAX_LENGTH_MAPPING), help="Exercise of every file (default: from the file paths)"
+    )
+    parser.add_argument(
+        "--retry-errors", action="store_true", help="Score the files that failed in a previous run again"
+    )
+    parser.add_argument("--report", help="Path of the json throughput report")
+    args = parser.parse_args()
+
+    report = run_batch_scoring(args.input, args.output, args.workers, args.batch_size, args.exercise, args.retry_errors)
+    print(
+        f"scored {report['scored']} sessions ({report['errors']} errors, {report['skipped']} already scored) "
+        f"in {report['elapsed_seconds']:.1f}s: {report['sessions_per_second']:.1f} sessions/s, "
+        f"{report['frames_per_second']:.0f} frames/s"
+    )
+    if args.report:
+        with open(args.report, "w") as report_file:
+            json.dump({"settings": vars(args), **report}, report_file, indent=2)
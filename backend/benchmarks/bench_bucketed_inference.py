@@ -0,0 +1,87 @@
+# Benchmark of the bucketed inference against the full model on synthetic patient sessions
+# For every exercise and session length, checks that the bucketed scores match the full-padding scores and reports
+# the latency of both paths. Results are written to a json file (benchmarks/results by default).
+# Usage (from the backend directory): python benchmarks/bench_bucketed_inference.py [--lengths 150 300 600]
+import argparse
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from bucketed_inference import BUCKETED_PARITY_TOLERANCE, BucketedModel
+from ml_wrapper import MAX_LENGTH_MAPPING, prepare_data
+from model_registry import ModelRegistry
+
+from common import time_calls, write_results
+from synthetic_sessions import SyntheticSessions, session_to_dataframe
+
+SEQUENCE_LENGTHS = [150, 300, 600]
+REPEATS = 20
+BATCH_SIZE = 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark of the bucketed inference against the full model")
+    parser.add_argument("--lengths", type=int, nargs="+", default=SEQUENCE_LENGTHS, help="Session lengths in frames")
+    parser.add_argument("--exercises", nargs="+", default=list(MAX_LENGTH_MAPPING), help="Exercises to benchmark")
+    parser.add_argument("--repeats", type=int, default=REPEATS, help="Timed calls per benchmark")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="Sessions per prediction")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic sessions")
+    parser.add_argument("--output", help="Path of the json results file")
+    args = parser.parse_args()
+
+    generator = SyntheticSessions(args.seed)
+    # Models are loaded without bucketing, so both paths are built here from the same weights
+    registry = ModelRegistry(bucketed_inference=False)
+    results = []
+    print(
+        f"{'exercise':>8} {'frames':>7} {'windows':>8} {'full p50 (ms)':>14} {'bucketed p50 (ms)':>18} "
+        f"{'saved (ms)':>11} {'max abs diff':>13}"
+    )
+    for exercise_id in args.exercises:
+        model = registry.get(exercise_id)
+        max_length = MAX_LENGTH_MAPPING[exercise_id]
+        bucketed_model = BucketedModel(model, max_length)
+        for frames in args.lengths:
+            prepared = [
+                prepare_data(session_to_dataframe(session), max_length, exercise_id)
+                for session in generator.sessions(exercise_id, args.batch_size, num_frames=frames)
+            ]
+            data = np.concatenate([entry[0] for entry in prepared])
+            padding_masks = np.concatenate([entry[1] for entry in prepared])
+
+            expected = model.predict([data, padding_masks], batch_size=len(data), verbose=0)
+            max_difference = float(np.max(np.abs(bucketed_model.predict(data, padding_masks) - expected)))
+            full = time_calls(
+                lambda: model.predict([data, padding_masks], batch_size=len(data), verbose=0), args.repeats
+            )
+            bucketed = time_calls(lambda: bucketed_model.predict(data, padding_masks), args.repeats)
+            active_windows = bucketed_model.get_active_windows(data, padding_masks)
+
+            results.append(
+                {
+                    "exercise_id": exercise_id,
+                    "frames": frames,
+                    "batch_size": args.batch_size,
+                    "active_windows": active_windows,
+                    "num_windows": bucketed_model.num_windows,
+                    "max_abs_difference": max_difference,
+                    "parity": max_difference <= BUCKETED_PARITY_TOLERANCE,
+                    "full": full,
+                    "bucketed": bucketed,
+                    "saved_p50_ms": full["p50_ms"] - bucketed["p50_ms"],
+                }
+            )
+            print(
+                f"{exercise_id:>8} {frames:>7} {f'{active_windows}/{bucketed_model.num_windows}':>8} "
+                f"{full['p50_ms']:>14.2f} {bucketed['p50_ms']:>18.2f} "
+                f"{full['p50_ms'] - bucketed['p50_ms']:>11.2f} {max_difference:>13.2e}"
+            )
+
+    settings = {"lengths": args.lengths, "exercises": args.exercises, "repeats": args.repeats, "seed": args.seed}
+    path = write_results("bucketed_inference", {"settings": settings, "benchmarks": results}, args.output)
+    print(f"results written to {path}")
+    if not all(result["parity"] for result in results):
+        sys.exit(f"bucketed scores differ from the full model by more than {BUCKETED_PARITY_TOLERANCE}")
@@ -0,0 +1,82 @@
+# Benchmark of the vectorized joint features against the original row-by-row implementation
+# Usage (from the backend directory): python benchmarks/bench_joint_features.py
+import math
+import os
+import sys
+import timeit
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from joint_features import FEATURE_REGISTRY, get_es1_features, get_joint_array
+from ml_wrapper import get_dataframe_cols
+
+FRAME_COUNTS = [600, 1000, 1500, 2000]
+REPEATS = 5
+
+
+# Original implementation, kept here as the baseline
+def legacy_get_joint_pair(df, joint_name):
+  return [df[f"{joint_name}_x"], df[f"{joint_name}_y"]]
+
+
+def legacy_calculate_angle(first, middle, end):
+    first = np.array(first)
+    middle = np.array(middle)
+    end = np.array(end)
+
+    radians = np.arctan2(end[1]-middle[1], end[0]-middle[0]) - np.arctan2(first[1]-middle[1], first[0]-middle[0])
+    angle = np.abs(radians*180.0/np.pi)
+
+    angles = [360-a if a > 180 else a for a in angle]
+    return angles
+
+
+def legacy_calculate_distance(pair1, pair2):
+  pair1_x, pair1_y = pair1
+  pair2_x, pair2_y = pair2
+  return pd.Series([math.dist([x1, y1], [x2, y2]) for x1, y1, x2, y2 in zip(pair1_x, pair1_y, pair2_x, pair2_y)])
+
+
+def legacy_get_es1_features(df):
+  pair = legacy_get_joint_pair
+  features_df = pd.DataFrame()
+  features_df["left_arm_torso_angle"] = legacy_calculate_angle(pair(df, "left_elbow"), pair(df, "left_shoulder"), pair(df, "left_hip"))
+  features_df["right_arm_torso_angle"] = legacy_calculate_angle(pair(df, "right_elbow"), pair(df, "right_shoulder"), pair(df, "right_hip"))
+  features_df["left_elbow_extension_angle"] = legacy_calculate_angle(pair(df, "left_shoulder"), pair(df, "left_elbow"), pair(df, "left_wrist"))
+  features_df["right_elbow_extension_angle"] = legacy_calculate_angle(pair(df, "right_shoulder"), pair(df, "right_elbow"), pair(df, "right_wrist"))
+  features_df["left_knee_extension_angle"] = legacy_calculate_angle(pair(df, "left_hip"), pair(df, "left_knee"), pair(df, "left_ankle"))
+  features_df["right_knee_extension_angle"] = legacy_calculate_angle(pair(df, "right_hip"), pair(df, "right_knee"), pair(df, "right_ankle"))
+  mid_hip_point = [(pair(df, "left_hip")[0] + pair(df, "right_hip")[0])/2, (pair(df, "left_hip")[1] + pair(df, "right_hip")[1])/2]
+  features_df["hip_angle"] = legacy_calculate_angle(pair(df, "left_hip"), mid_hip_point, pair(df, "right_hip"))
+  features_df["hands_dist"] = legacy_calculate_distance(pair(df, "left_wrist"), pair(df, "right_wrist"))
+  features_df["ankle_dist"] = legacy_calculate_distance(pair(df, "left_ankle"), pair(df, "right_ankle"))
+  return features_df
+
+
+def random_session(frames, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame(rng.random((frames, 51)), columns=get_dataframe_cols())
+
+
+if __name__ == "__main__":
+    print(
+        f"{'frames':>8} {'legacy (ms)':>12} {'vectorized (ms)':>16} {'array (ms)':>11} "
+        f"{'speedup':>8} {'max abs diff':>13}"
+    )
+    for frames in FRAME_COUNTS:
+        df = random_session(frames)
+        legacy_seconds = min(timeit.repeat(lambda: legacy_get_es1_features(df), number=1, repeat=REPEATS))
+        vectorized_seconds = min(timeit.repeat(lambda: get_es1_features(df), number=1, repeat=REPEATS))
+        # Array-native path, without the dataframe conversions
+        joint_array = get_joint_array(df.to_numpy())
+        array_seconds = min(
+            timeit.repeat(lambda: FEATURE_REGISTRY["Es1"].compute(joint_array), number=1, repeat=REPEATS)
+        )
+        max_difference = np.max(np.abs(legacy_get_es1_features(df).to_numpy() - get_es1_features(df).to_numpy()))
+        print(
+            f"{frames:>8} {legacy_seconds * 1000:>12.2f} {vectorized_seconds * 1000:>16.2f} "
+            f"{array_seconds * 1000:>11.2f} {legacy_seconds / array_seconds:>7.1f}x {max_difference:>13.2e}"
+        )
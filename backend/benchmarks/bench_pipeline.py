@@ -0,0 +1,112 @@
+# Micro-benchmarks of the scoring and feedback pipeline on synthetic patient sessions
+# Times prepare_data, get_es1_features, reorder_dataframe, DTW and the model prediction across session lengths
+# and writes p50/p95/p99 latencies and throughput to a json file (benchmarks/results by default).
+# Usage (from the backend directory): python benchmarks/bench_pipeline.py [--lengths 150 300 600] [--output results.json]
+import argparse
+import os
+import sys
+
+import numpy as np
+from tslearn.metrics import dtw
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from dtw_wrapper import batch_dtw
+from feedback_session import FEEDBACK_COLUMNS
+from joint_features import get_es1_features
+from ml_wrapper import MAX_LENGTH_MAPPING, get_dataframe_cols, prepare_data, reorder_dataframe
+
+from common import time_calls, write_results
+from synthetic_sessions import SyntheticSessions, session_to_dataframe
+
+SEQUENCE_LENGTHS = [150, 300, 600, 1200]
+REPEATS = 20
+# Batch sizes of the model prediction benchmark
+PREDICT_BATCH_SIZES = [1, 8]
+
+
+# Function to print one result line and keep it in the results
+def record(results, name, exercise_id, frames, summary, **details):
+    results.append({"name": name, "exercise_id": exercise_id, "frames": frames, **details, **summary})
+    print(
+        f"{name:>18} {exercise_id:>8} {frames:>7} {summary['p50_ms']:>9.2f} {summary['p95_ms']:>9.2f} "
+        f"{summary['p99_ms']:>9.2f} {summary['throughput_per_second']:>10.1f}"
+    )
+
+
+def bench_preprocessing(generator, exercise_ids, lengths, repeats, results):
+    columns = get_dataframe_cols()
+    for frames in lengths:
+        for exercise_id in exercise_ids:
+            df = session_to_dataframe(generator.session(exercise_id, num_frames=frames))
+            max_length = MAX_LENGTH_MAPPING[exercise_id]
+            summary = time_calls(lambda: prepare_data(df, max_length, exercise_id), repeats)
+            record(results, "prepare_data", exercise_id, frames, summary)
+
+        df = session_to_dataframe(generator.session("Es1", num_frames=frames))
+        record(results, "get_es1_features", "Es1", frames, time_calls(lambda: get_es1_features(df), repeats))
+
+        # The client sends the columns in its own order
+        shuffled = df[list(np.random.default_rng(frames).permutation(columns))]
+        record(results, "reorder_dataframe", "-", frames, time_calls(lambda: reorder_dataframe(shuffled), repeats))
+
+
+def bench_dtw(generator, exercise_ids, lengths, repeats, results, legacy):
+    indices = [get_dataframe_cols().index(column) for column in FEEDBACK_COLUMNS]
+    for frames in lengths:
+        for exercise_id in exercise_ids:
+            reference = generator.reference_cache.get(exercise_id)[:frames, indices]
+            current = generator.session(exercise_id, num_frames=len(reference))[:, indices]
+            summary = time_calls(lambda: batch_dtw(current, reference), repeats)
+            record(results, "batch_dtw", exercise_id, frames, summary, columns=len(indices))
+            if legacy:
+                # One tslearn call per column, like the original feedback endpoint
+                summary = time_calls(
+                    lambda: [dtw(current[:, c], reference[:, c]) for c in range(len(indices))], max(1, repeats // 4)
+                )
+                record(results, "tslearn_dtw", exercise_id, frames, summary, columns=len(indices))
+
+
+def bench_predict(generator, exercise_ids, lengths, repeats, results):
+    from model_registry import model_registry, predict_batch
+
+    for exercise_id in exercise_ids:
+        try:
+            model_registry.get(exercise_id)
+        except Exception as error:
+            print(f"skipping the {exercise_id} model: {error}")
+            continue
+        max_length = MAX_LENGTH_MAPPING[exercise_id]
+        for frames in lengths:
+            data, padding_mask = prepare_data(
+                session_to_dataframe(generator.session(exercise_id, num_frames=frames)), max_length, exercise_id
+            )
+            for batch_size in PREDICT_BATCH_SIZES:
+                batch_data = np.repeat(data, batch_size, axis=0)
+                batch_mask = np.repeat(padding_mask, batch_size, axis=0)
+                summary = time_calls(lambda: predict_batch(exercise_id, batch_data, batch_mask), repeats)
+                record(results, f"predict (batch {batch_size})", exercise_id, frames, summary, batch_size=batch_size)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Micro-benchmarks of the scoring and feedback pipeline")
+    parser.add_argument("--lengths", type=int, nargs="+", default=SEQUENCE_LENGTHS, help="Session lengths in frames")
+    parser.add_argument("--exercises", nargs="+", default=list(MAX_LENGTH_MAPPING), help="Exercises to benchmark")
+    parser.add_argument("--repeats", type=int, default=REPEATS, help="Timed calls per benchmark")
+    parser.add_argument("--skip-models", action="store_true", help="Do not benchmark the model predictions")
+    parser.add_argument("--legacy-dtw", action="store_true", help="Also time the per-column tslearn DTW")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic sessions")
+    parser.add_argument("--output", help="Path of the json results file")
+    args = parser.parse_args()
+
+    generator = SyntheticSessions(args.seed)
+    results = []
+    print(f"{'benchmark':>18} {'exercise':>8} {'frames':>7} {'p50 (ms)':>9} {'p95 (ms)':>9} {'p99 (ms)':>9} {'calls/s':>10}")
+    bench_preprocessing(generator, args.exercises, args.lengths, args.repeats, results)
+    bench_dtw(generator, args.exercises, args.lengths, args.repeats, results, args.legacy_dtw)
+    if not args.skip_models:
+        bench_predict(generator, args.exercises, args.lengths, args.repeats, results)
+
+    settings = {"lengths": args.lengths, "exercises": args.exercises, "repeats": args.repeats, "seed": args.seed}
+    path = write_results("pipeline", {"settings": settings, "benchmarks": results}, args.output)
+    print(f"results written to {path}")
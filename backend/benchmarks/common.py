@@ -0,0 +1,62 @@
+# Helpers shared by the benchmarks: latency statistics and result files
+import json
+import os
+import platform
+import time
+from datetime import datetime
+
+import numpy as np
+
+# Directory the benchmark results are written to
+RESULTS_DIRECTORY = os.environ.get(
+    "REHABAI_BENCHMARK_RESULTS_DIR", os.path.join(os.path.dirname(__file__), "results")
+)
+
+
+# Function to summarise a list of latencies (in seconds) as milliseconds percentiles
+def summarize_latencies(latencies, elapsed_seconds=None):
+    latencies = np.asarray(latencies, dtype=np.float64) * 1000
+    if len(latencies) == 0:
+        return {"count": 0}
+    summary = {
+        "count": int(len(latencies)),
+        "mean_ms": float(latencies.mean()),
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+        "max_ms": float(latencies.max()),
+    }
+    if elapsed_seconds:
+        summary["throughput_per_second"] = len(latencies) / elapsed_seconds
+    return summary
+
+
+# Function to time a function a number of times and summarise the latencies
+def time_calls(fn, repeats, warmup=1):
+    for _ in range(warmup):
+        fn()
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(repeats):
+        call_start = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - call_start)
+    return summarize_latencies(latencies, time.perf_counter() - start)
+
+
+# Function to write the results of a benchmark to a json file, returns the path of the file
+def write_results(name, results, path=None):
+    if path is None:
+        os.makedirs(RESULTS_DIRECTORY, exist_ok=True)
+        path = os.path.join(RESULTS_DIRECTORY, f"{name}-{datetime.now():%Y%m%d-%H%M%S}.json")
+    document = {
+        "benchmark": name,
+        "date": datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "results": results,
+    }
+    with open(path, "w") as results_file:
+        json.dump(document, results_file, indent=2)
+    return path
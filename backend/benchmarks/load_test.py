@@ -0,0 +1,248 @@
+# Load test replaying the traffic of patients doing exercises against the FastAPI app in-process
+# Every patient signs up, logs in and performs a synthetic session of an exercise: each second of exercise (30 frames)
+# sends the live feedback requests (16 per second with the original per-column client), and the session ends with a
+# clinical score submission. Latency percentiles and throughput of every endpoint are written to a json file.
+# Usage (from the backend directory): python benchmarks/load_test.py --patients 10 [--feedback batch] [--output results.json]
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from uuid import uuid4
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from common import summarize_latencies, write_results
+
+# Frames recorded per second by the frontend
+FRAMES_PER_SECOND = 30
+# How the live feedback is requested:
+#   legacy: one /api/feedback call per compared column every second (16 calls/sec/patient, the original client)
+#   batch: one /api/feedback/{exercise_id}/batch call every second (the current client)
+#   session: one incremental /api/feedback_sessions call every second
+FEEDBACK_MODES = ["legacy", "batch", "session"]
+# How the clinical score is submitted:
+#   frames: the whole session is uploaded once at the end
+#   session: the frames are uploaded every second to a scoring session, which is closed at the end
+SCORING_MODES = ["frames", "session"]
+
+
+# Latencies of every endpoint and errors of the load test
+class LoadStats:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    async def request(self, client, name, method, url, **kwargs):
+        start = time.perf_counter()
+        response = await client.request(method, url, **kwargs)
+        self.latencies[name].append(time.perf_counter() - start)
+        if response.status_code >= 400:
+            self.errors[f"{name} {response.status_code}"] += 1
+        return response
+
+    def summary(self, elapsed_seconds):
+        endpoints = {
+            name: summarize_latencies(latencies, elapsed_seconds) for name, latencies in sorted(self.latencies.items())
+        }
+        requests = sum(len(latencies) for latencies in self.latencies.values())
+        return {
+            "elapsed_seconds": elapsed_seconds,
+            "requests": requests,
+            "throughput_per_second": requests / elapsed_seconds if elapsed_seconds else 0.0,
+            "errors": dict(self.errors),
+            "endpoints": endpoints,
+        }
+
+
+# Function to sign up and log in a new patient, returns a client carrying the session cookie
+async def create_patient(app, stats, run_id, index):
+    import httpx
+
+    client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://loadtest")
+    credentials = {"username": f"load-{run_id}-{index}", "password": f"password-{index}"}
+    await stats.request(client, "signup", "POST", "/api/signup/", json=credentials)
+    response = await stats.request(client, "login", "POST", "/api/login/", json=credentials)
+    response.raise_for_status()
+    return client
+
+
+# Function to replay the exercise session of one patient
+async def run_patient(client, stats, exercise_id, session, reference, feedback_mode, scoring_mode, time_scale):
+    from feedback_session import FEEDBACK_COLUMNS
+    from frame_codec import encode_frames
+    from ml_wrapper import get_dataframe_cols
+
+    indices = [get_dataframe_cols().index(column) for column in FEEDBACK_COLUMNS]
+    binary_headers = {"Content-Type": "application/octet-stream"}
+
+    feedback_session_id = None
+    if feedback_mode == "session":
+        response = await stats.request(client, "feedback_session_create", "POST", f"/api/feedback_sessions/{exercise_id}", json={})
+        feedback_session_id = response.json()["session_id"]
+    scoring_session_id = None
+    if scoring_mode == "session":
+        response = await stats.request(client, "scoring_session_create", "POST", f"/api/scoring_sessions/{exercise_id}")
+        scoring_session_id = response.json()["session_id"]
+
+    start = time.perf_counter()
+    for second, end in enumerate(range(FRAMES_PER_SECOND, len(session) + 1, FRAMES_PER_SECOND), start=1):
+        # Wait until this second of the exercise has been recorded
+        delay = start + second * time_scale - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        current = session[:end]
+        new_frames = session[end - FRAMES_PER_SECOND : end]
+        if feedback_mode == "legacy":
+            # The original client compares every column of the frames so far with the reference, one request each
+            for column, index in zip(FEEDBACK_COLUMNS, indices):
+                await stats.request(
+                    client,
+                    "feedback",
+                    "POST",
+                    f"/api/feedback/{exercise_id}",
+                    json={
+                        "currentJointValues": current[:, index].tolist(),
+                        "referenceJointValues": reference[:end, index].tolist(),
+                    },
+                )
+        elif feedback_mode == "batch":
+            await stats.request(
+                client,
+                "feedback_batch",
+                "POST",
+                f"/api/feedback/{exercise_id}/batch",
+                json={"columns": FEEDBACK_COLUMNS, "currentFrames": current[:, indices].tolist()},
+            )
+        else:
+            await stats.request(
+                client,
+                "feedback_session_frames",
+                "POST",
+                f"/api/feedback_sessions/{feedback_session_id}/frames",
+                json={
+                    "currentJointValues": {
+                        column: new_frames[:, index].tolist() for column, index in zip(FEEDBACK_COLUMNS, indices)
+                    }
+                },
+            )
+
+        if scoring_session_id is not None:
+            await stats.request(
+                client,
+                "scoring_session_frames",
+                "POST",
+                f"/api/scoring_sessions/{scoring_session_id}/frames",
+                content=encode_frames(new_frames),
+                headers=binary_headers,
+            )
+
+    if feedback_session_id is not None:
+        await stats.request(client, "feedback_session_close", "DELETE", f"/api/feedback_sessions/{feedback_session_id}")
+    if scoring_session_id is not None:
+        await stats.request(client, "scoring_session_close", "POST", f"/api/scoring_sessions/{scoring_session_id}/close")
+    else:
+        await stats.request(
+            client,
+            "clinical_score_frames",
+            "POST",
+            f"/api/clinical_score/{exercise_id}/frames",
+            content=encode_frames(session),
+            headers=binary_headers,
+        )
+
+
+async def run_load_test(args):
+    from main import app
+    from synthetic_sessions import SyntheticSessions
+
+    generator = SyntheticSessions(args.seed)
+    exercise_ids = args.exercises or generator.exercise_ids
+    run_id = uuid4().hex[:8]
+
+    await app.router.startup()
+    try:
+        setup_stats = LoadStats()
+        clients = [await create_patient(app, setup_stats, run_id, index) for index in range(args.patients)]
+
+        # Every patient does one exercise, the exercises are shared out in turn
+        sessions = []
+        for index in range(args.patients):
+            exercise_id = exercise_ids[index % len(exercise_ids)]
+            session = generator.session(exercise_id)
+            if args.max_seconds:
+                session = session[: args.max_seconds * FRAMES_PER_SECOND]
+            sessions.append((exercise_id, session, generator.reference_cache.get(exercise_id)))
+
+        stats = LoadStats()
+        start = time.perf_counter()
+        await asyncio.gather(
+            *[
+                run_patient(
+                    client, stats, exercise_id, session, reference, args.feedback, args.scoring, args.time_scale
+                )
+                for client, (exercise_id, session, reference) in zip(clients, sessions)
+            ]
+        )
+        elapsed = time.perf_counter() - start
+        for client in clients:
+            await client.aclose()
+    finally:
+        await app.router.shutdown()
+
+    return {
+        "settings": vars(args),
+        "session_frames": [len(session) for _, session, _ in sessions],
+        "setup": setup_stats.summary(None),
+        "load": stats.summary(elapsed),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay the traffic of patients doing exercises against the app")
+    parser.add_argument("--patients", type=int, default=10, help="Number of concurrent patients")
+    parser.add_argument("--exercises", nargs="+", help="Exercises done by the patients (default: all)")
+    parser.add_argument("--feedback", choices=FEEDBACK_MODES, default="legacy", help="How the live feedback is requested")
+    parser.add_argument("--scoring", choices=SCORING_MODES, default="frames", help="How the clinical score is submitted")
+    parser.add_argument(
+        "--time-scale", type=float, default=1.0,
+        help="Wall-clock seconds per second of exercise (1 replays in real time, 0 sends as fast as possible)",
+    )
+    parser.add_argument("--max-seconds", type=int, help="Cut the sessions after this many seconds of exercise")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic sessions")
+    parser.add_argument(
+        "--database-url",
+        help="Database used by the app (default: a new sqlite database in a temporary directory)",
+    )
+    parser.add_argument("--output", help="Path of the json results file")
+    args = parser.parse_args()
+
+    # The app settings are read when it is imported, so they are set before
+    temporary_directory = None
+    if args.database_url:
+        os.environ["REHABAI_DATABASE_URL"] = args.database_url
+    else:
+        temporary_directory = tempfile.TemporaryDirectory()
+        os.environ["REHABAI_DATABASE_URL"] = f"sqlite:///{temporary_directory.name}/loadtest.db"
+    # Patients are created with a cheap password hash, the signups are not what is measured
+    os.environ.setdefault("REHABAI_BCRYPT_ROUNDS", "4")
+
+    results = asyncio.run(run_load_test(args))
+    load = results["load"]
+    print(f"{load['requests']} requests in {load['elapsed_seconds']:.1f}s ({load['throughput_per_second']:.1f} requests/s)")
+    print(f"{'endpoint':>24} {'count':>7} {'p50 (ms)':>9} {'p95 (ms)':>9} {'p99 (ms)':>9} {'requests/s':>11}")
+    for name, summary in load["endpoints"].items():
+        print(
+            f"{name:>24} {summary['count']:>7} {summary['p50_ms']:>9.2f} {summary['p95_ms']:>9.2f} "
+            f"{summary['p99_ms']:>9.2f} {summary['throughput_per_second']:>11.1f}"
+        )
+    if load["errors"]:
+        print(f"errors: {load['errors']}")
+
+    path = write_results("load", results, args.output)
+    print(f"results written to {path}")
+    if temporary_directory is not None:
+        temporary_directory.cleanup()
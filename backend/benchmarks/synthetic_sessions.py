@@ -0,0 +1,101 @@
+# Synthetic patient sessions generated from the reference joint positions of each exercise
+# The reference trajectory is time-warped (the patient is faster, slower or uneven) and noise is added to the keypoints,
+# giving sessions with realistic lengths and motion for the benchmarks.
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from ml_wrapper import get_dataframe_cols
+from reference_cache import ReferenceCache
+
+# Default generation settings
+# Range of the overall speed of the patient relative to the reference (0.8 = 25% more frames)
+SPEED_RANGE = (0.8, 1.25)
+# Maximum relative speed change within a session (0 gives a constant speed)
+WARP_STRENGTH = 0.3
+# Standard deviation of the noise added to the x and y coordinates (coordinates are normalized to [0, 1])
+POSITION_NOISE = 0.01
+# Standard deviation of the noise added to the keypoint confidences
+CONFIDENCE_NOISE = 0.05
+
+
+# Function to get a random monotonic time warp, the positions in the reference of each of the num_frames session frames
+def random_time_warp(rng, reference_frames, num_frames, warp_strength=WARP_STRENGTH):
+    progress = np.linspace(0.0, 1.0, num_frames)
+    # Three sine waves whose slopes add up to at most warp_strength (< 1), so the warp keeps increasing
+    warp = progress.copy()
+    for k in range(1, 4):
+        amplitude = rng.uniform(-warp_strength, warp_strength) / (2 * np.pi * k * 3)
+        warp += amplitude * np.sin(2 * np.pi * k * progress)
+    return np.clip(warp, 0.0, 1.0) * (reference_frames - 1)
+
+
+# Function to generate a synthetic session from reference frames (array of shape (frames, 51) ordered like get_dataframe_cols)
+# Returns a float32 array of shape (frames, 51). The number of frames is num_frames if given, otherwise the
+# reference length divided by the speed (random in SPEED_RANGE by default).
+def synthesize_session(
+    reference,
+    rng,
+    speed=None,
+    num_frames=None,
+    warp_strength=WARP_STRENGTH,
+    position_noise=POSITION_NOISE,
+    confidence_noise=CONFIDENCE_NOISE,
+):
+    if num_frames is None:
+        if speed is None:
+            speed = rng.uniform(*SPEED_RANGE)
+        num_frames = max(2, int(round(len(reference) / speed)))
+    positions = random_time_warp(rng, len(reference), num_frames, warp_strength)
+
+    # Linear interpolation of every column at the warped positions
+    lower = np.floor(positions).astype(np.int64)
+    upper = np.minimum(lower + 1, len(reference) - 1)
+    weights = (positions - lower)[:, None]
+    session = reference[lower] * (1 - weights) + reference[upper] * weights
+
+    # Columns are (y, x, confidence) for each keypoint
+    session[:, 0::3] += rng.normal(0.0, position_noise, (num_frames, session.shape[1] // 3))
+    session[:, 1::3] += rng.normal(0.0, position_noise, (num_frames, session.shape[1] // 3))
+    session[:, 2::3] = np.clip(
+        session[:, 2::3] + rng.normal(0.0, confidence_noise, (num_frames, session.shape[1] // 3)), 0.0, 1.0
+    )
+    return session.astype(np.float32)
+
+
+# Function to convert a synthetic session to a dataframe, like the dataframe built by the frontend
+def session_to_dataframe(session):
+    return pd.DataFrame(session, columns=get_dataframe_cols())
+
+
+# Generator of synthetic sessions for every exercise
+class SyntheticSessions:
+    def __init__(self, seed=0, reference_cache=None):
+        self.rng = np.random.default_rng(seed)
+        self.reference_cache = reference_cache or ReferenceCache()
+
+    @property
+    def exercise_ids(self):
+        return list(self.reference_cache.reference_paths)
+
+    def session(self, exercise_id, **settings):
+        return synthesize_session(self.reference_cache.get(exercise_id), self.rng, **settings)
+
+    def sessions(self, exercise_id, count, **settings):
+        return [self.session(exercise_id, **settings) for _ in range(count)]
+
+
+if __name__ == "__main__":
+    generator = SyntheticSessions()
+    print(f"{'exercise':>8} {'reference frames':>17} {'session frames':>15} {'mean abs diff':>14}")
+    for exercise_id in generator.exercise_ids:
+        reference = generator.reference_cache.get(exercise_id)
+        session = generator.session(exercise_id, num_frames=len(reference))
+        print(
+            f"{exercise_id:>8} {len(reference):>17} {len(generator.session(exercise_id)):>15} "
+            f"{np.abs(session - reference).mean():>14.4f}"
+        )
@@ -0,0 +1,204 @@
+# Importing necessary libraries
+import math
+import os
+import threading
+
+import numpy as np
+
+from lazy_imports import lazy_import
+from metrics import get_logger
+from ml_wrapper import MAX_FRAMES
+
+logger = get_logger(__name__)
+
+tf = lazy_import("tensorflow")
+keras_nlp = lazy_import("keras_nlp")
+
+# Bucketed inference settings
+# The clinical score models split their input into fixed windows that share one transformer encoder.
+# Sessions are at most MAX_FRAMES long, so the last windows of the longer inputs only hold padding: their encodings
+# are the same for every session and are computed once. Each request only runs the encoder on the windows that hold
+# frames, with one compiled graph per number of active windows (bucket). Set to 0 to always run the whole model.
+BUCKETED_INFERENCE = os.environ.get("REHABAI_BUCKETED_INFERENCE", "1") != "0"
+# Maximum difference between the bucketed and the full model scores accepted by the parity check run at load time
+BUCKETED_PARITY_TOLERANCE = float(os.environ.get("REHABAI_BUCKETED_PARITY_TOLERANCE", 1e-4))
+
+
+# Raised when a model does not have the windowed encoder architecture needed for bucketed inference
+class UnsupportedModelError(ValueError):
+    pass
+
+
+# Function to find the layers of a windowed encoder model: the layers applied to every window (ending with the
+# shared transformer encoder) and the head layers applied to the flattened window encodings
+def get_windowed_layers(model):
+    encoders = [layer for layer in model.layers if isinstance(layer, keras_nlp.layers.TransformerEncoder)]
+    if len(encoders) != 1:
+        raise UnsupportedModelError("The model must have exactly one transformer encoder")
+    encoder = encoders[0]
+    num_windows = len(encoder.inbound_nodes)
+
+    encoder_index = model.layers.index(encoder)
+    window_layers = [
+        layer
+        for layer in model.layers[:encoder_index]
+        if isinstance(layer, tf.keras.layers.Dense) and len(layer.inbound_nodes) == num_windows
+    ]
+    flatten_layers = [layer for layer in model.layers if isinstance(layer, tf.keras.layers.Flatten)]
+    if not window_layers or len(flatten_layers) != 1:
+        raise UnsupportedModelError("The model must embed every window with dense layers and flatten the encodings")
+    head_layers = model.layers[model.layers.index(flatten_layers[0]) + 1 :]
+    if not all(isinstance(layer, tf.keras.layers.Dense) for layer in head_layers):
+        raise UnsupportedModelError("The model head must only have dense layers")
+    return window_layers, encoder, head_layers, num_windows
+
+
+# Function to get the number of input windows holding frames in a batch of prepared inputs, or None if the padding
+# is not made of the zero frames at the end of the input written by the data preparation
+def get_active_windows(data, padding_masks, window_size):
+    live_frames = int(np.max(np.sum(padding_masks == 0, axis=1)))
+    active_windows = max(1, math.ceil(live_frames / window_size))
+    start = active_windows * window_size
+    if not (np.all(padding_masks[:, start:] == 1) and not np.any(data[:, start:])):
+        return None
+    return active_windows
+
+
+# Clinical score model that only runs the transformer encoder on the windows holding frames
+class BucketedModel:
+    def __init__(self, model, max_length, max_frames=MAX_FRAMES):
+        self.model = model
+        self.window_layers, self.encoder, self.head_layers, self.num_windows = get_windowed_layers(model)
+        if max_length % self.num_windows:
+            raise UnsupportedModelError(f"The input length {max_length} is not a multiple of {self.num_windows} windows")
+        self.max_length = max_length
+        self.max_frames = max_frames
+        self.window_size = max_length // self.num_windows
+        self.num_features = model.inputs[0].shape[-1]
+        # Largest number of active windows of a prepared session
+        self.max_active_windows = min(self.num_windows, math.ceil(max_frames / self.window_size))
+
+        # Encoding of a window that only holds padding (zero frames, padding mask set to 1)
+        padded_window = self._encode_windows(
+            tf.zeros((1, self.window_size, self.num_features)), tf.ones((1, self.window_size))
+        )
+        self.padded_encodings = [
+            tf.tile(padded_window, [1, self.num_windows - active_windows, 1])
+            for active_windows in range(self.num_windows + 1)
+        ]
+        self._functions = {}
+        self._lock = threading.Lock()
+        self.bucket_calls = {}
+        self.full_calls = 0
+
+    def _encode_windows(self, windows, window_masks):
+        # windows has shape (windows, window_size, features), the encoder runs on all of them as one batch
+        embeddings = windows
+        for layer in self.window_layers:
+            embeddings = layer(embeddings)
+        return self.encoder(embeddings, window_masks)
+
+    def _get_function(self, active_windows):
+        # One graph per number of active windows, traced on first use
+        function = self._functions.get(active_windows)
+        if function is None:
+            with self._lock:
+                function = self._functions.get(active_windows)
+                if function is None:
+                    function = self._functions[active_windows] = self._build_function(active_windows)
+        return function
+
+    def _build_function(self, active_windows):
+        active_length = active_windows * self.window_size
+        padded_encoding = self.padded_encodings[active_windows]
+
+        @tf.function(
+            input_signature=[
+                tf.TensorSpec((None, active_length, self.num_features), tf.float32),
+                tf.TensorSpec((None, active_length), tf.float32),
+            ]
+        )
+        # Function to predict the scores of a batch of prepared inputs of shape (batch, max_length, features)
+        def predict(data, padding_masks):
+            batch_size = tf.shape(data)[0]
+            # Encode the active windows of every session in one batch
+            windows = tf.reshape(data, (-1, self.window_size, self.num_features))
+            window_masks = tf.reshape(padding_masks, (-1, self.window_size))
+            encoded = self._encode_windows(windows, window_masks)
+            encoded = tf.reshape(encoded, (batch_size, active_length, -1))
+            # The padding windows have the same encoding for every session
+            encoded = tf.concat([encoded, tf.tile(padded_encoding, [batch_size, 1, 1])], axis=1)
+            outputs = tf.reshape(encoded, (batch_size, -1))
+            for layer in self.head_layers:
+                outputs = layer(outputs)
+            return outputs
+
+        return predict
+
+    def get_active_windows(self, data, padding_masks):
+        return get_active_windows(data, padding_masks, self.window_size)
+
+    def predict(self, data, padding_masks):
+        active_windows = self.get_active_windows(data, padding_masks)
+        if active_windows is None or active_windows == self.num_windows:
+            self.full_calls += 1
+            return self.model.predict([data, padding_masks], batch_size=len(data), verbose=0)
+
+        self.bucket_calls[active_windows] = self.bucket_calls.get(active_windows, 0) + 1
+        active_length = active_windows * self.window_size
+        outputs = self._get_function(active_windows)(
+            tf.constant(data[:, :active_length], dtype=tf.float32),
+            tf.constant(padding_masks[:, :active_length], dtype=tf.float32),
+        )
+        return outputs.numpy()
+
+    # Function to compare the bucketed and full model scores on random sessions filling every bucket (this also
+    # traces every bucket). Returns the largest difference, raises AssertionError above the tolerance.
+    def check_parity(self, tolerance=BUCKETED_PARITY_TOLERANCE, seed=0):
+        rng = np.random.default_rng(seed)
+        max_difference = 0.0
+        for active_windows in range(1, self.max_active_windows + 1):
+            # Sessions ending at the start and at the end of the last active window
+            low = (active_windows - 1) * self.window_size + 1
+            high = min(active_windows * self.window_size, self.max_frames)
+            data = np.zeros((2, self.max_length, self.num_features), dtype=np.float32)
+            padding_masks = np.ones((2, self.max_length), dtype=np.float32)
+            for row, live_frames in enumerate((low, high)):
+                data[row, :live_frames] = rng.normal(size=(live_frames, self.num_features))
+                padding_masks[row, :live_frames] = 0
+
+            expected = self.model([data, padding_masks], training=False).numpy()
+            difference = float(np.max(np.abs(self.predict(data, padding_masks) - expected)))
+            max_difference = max(max_difference, difference)
+            if difference > tolerance:
+                raise AssertionError(
+                    f"Bucketed scores with {active_windows} active windows differ by {difference:.2e} "
+                    f"(tolerance {tolerance:.0e})"
+                )
+        return max_difference
+
+    def stats(self):
+        return {
+            "num_windows": self.num_windows,
+            "window_size": self.window_size,
+            "bucket_calls": dict(self.bucket_calls),
+            "full_calls": self.full_calls,
+        }
+
+
+# Function to wrap a loaded model for bucketed inference, returns None if the model cannot be bucketed
+def load_bucketed_model(model, exercise_id, max_length):
+    try:
+        bucketed_model = BucketedModel(model, max_length)
+        max_difference = bucketed_model.check_parity()
+    except (UnsupportedModelError, AssertionError) as error:
+        logger.warning("bucketed inference disabled for %s: %s", exercise_id, error)
+        return None
+    logger.info(
+        "bucketed inference enabled for %s (%d windows of %d frames, parity max difference %.2e)",
+        exercise_id,
+        bucketed_model.num_windows,
+        bucketed_model.window_size,
+        max_difference,
+    )
+    return bucketed_model
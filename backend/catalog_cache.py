@@ -0,0 +1,128 @@
+# Importing necessary libraries
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict, namedtuple
+from datetime import timezone
+from email.utils import format_datetime, parsedate_to_datetime
+
+from sqlalchemy import select
+
+import models
+
+# Maximum number of users whose exercise catalog is kept in memory (the least recently used user is evicted first)
+CATALOG_CACHE_SIZE = int(os.environ.get("REHABAI_CATALOG_CACHE_SIZE", 10000))
+
+# Exercise columns returned by the catalog
+CATALOG_COLUMNS = ["id", "exercise_id", "name", "description", "image_url", "video_url", "csv"]
+
+# Serialized catalog of one user with its validators
+CatalogEntry = namedtuple("CatalogEntry", ["body", "etag", "last_modified"])
+
+
+# Function to load the exercises assigned to a user with a single joined query
+async def load_catalog(db, user_id):
+    rows = (
+        await db.execute(
+            select(models.Exercise, models.AssignedExercise.date)
+            .join(
+                models.AssignedExercise,
+                models.AssignedExercise.exercise_id == models.Exercise.exercise_id,
+            )
+            .where(models.AssignedExercise.user_id == user_id)
+            .order_by(models.AssignedExercise.id)
+        )
+    ).all()
+    exercises = [
+        {column: getattr(exercise, column) for column in CATALOG_COLUMNS} for exercise, _ in rows
+    ]
+    body = json.dumps(exercises, separators=(",", ":")).encode()
+    etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+    # The catalog changes when exercises are assigned, so the latest assignment date is its modification time
+    assignment_dates = [date for _, date in rows if date is not None]
+    last_modified = None
+    if assignment_dates:
+        # Assignment dates are stored in local time, HTTP dates are in GMT with a precision of one second
+        last_modified = max(assignment_dates).replace(microsecond=0).astimezone(timezone.utc)
+    return CatalogEntry(body, etag, last_modified)
+
+
+# Function to check whether the client's cached catalog is still valid (If-None-Match / If-Modified-Since)
+def is_not_modified(entry, if_none_match, if_modified_since):
+    if if_none_match is not None:
+        return entry.etag in [tag.strip() for tag in if_none_match.split(",")] or if_none_match.strip() == "*"
+    if if_modified_since is not None and entry.last_modified is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if since.tzinfo is None:
+            since = since.replace(tzinfo=timezone.utc)
+        return entry.last_modified <= since
+    return False
+
+
+# Function to get the response headers of a catalog entry
+def get_catalog_headers(entry):
+    headers = {"ETag": entry.etag, "Cache-Control": "private, no-cache"}
+    if entry.last_modified is not None:
+        headers["Last-Modified"] = format_datetime(entry.last_modified, usegmt=True)
+    return headers
+
+
+# Per-user cache of the serialized exercise catalog
+class CatalogCache:
+    def __init__(self, max_size=CATALOG_CACHE_SIZE):
+        self.max_size = max(1, max_size)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        # Incremented by every invalidation, so a catalog loaded while assignments changed is not cached
+        self._generation = 0
+
+    # Function to get the catalog entry of a user, loading it from the database on a miss
+    async def get(self, db, user_id):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None:
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                return entry
+            self.misses += 1
+            generation = self._generation
+
+        entry = await load_catalog(db, user_id)
+        with self._lock:
+            if generation != self._generation:
+                return entry
+            self._entries[user_id] = entry
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return entry
+
+    # Function to forget the catalog of a user (or of every user), called whenever exercise assignments change
+    def invalidate(self, user_id=None):
+        with self._lock:
+            if user_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(user_id, None)
+            self._generation += 1
+            self.invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+            }
+
+
+# Cache used by the exercises endpoint
+catalog_cache = CatalogCache()
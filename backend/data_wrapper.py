@@ -1,6 +1,21 @@
-from sqlalchemy import exists
+import os
+import time
+
+from sqlalchemy import exists, func, inspect, select, text
+from sqlalchemy.exc import DBAPIError, IntegrityError, OperationalError
 from database import SessionLocal, Base, engine
+from metrics import get_logger
 from models import Exercise
+from migrations import MIGRATIONS, run_migrations
+
+logger = get_logger(__name__)
+
+# Database bootstrap (tables, migrations and exercises) when the server starts:
+#   startup: bootstrap in the startup hook, skipped with a single check when the database is already up to date
+#   skip: never bootstrap at startup, the deployment runs "python data_wrapper.py" once before starting the workers
+DB_BOOTSTRAP = os.environ.get("REHABAI_DB_BOOTSTRAP", "startup")
+# Number of bootstrap attempts of a worker racing with the other workers of a deployment
+DB_BOOTSTRAP_ATTEMPTS = 5
 
 
 def get_exercises_data():
@@ -58,6 +73,8 @@ def get_exercises_data():
 def initialize_db():
     # Create tables if they don't exist
     Base.metadata.create_all(bind=engine)
+    # Bring existing databases up to the current schema
+    run_migrations(engine)
 
     # Start a new session
     session = SessionLocal()
@@ -83,5 +100,43 @@ def initialize_db():
     session.close()
 
 
+# Function to check whether the database has every table, the latest schema version and every exercise
+def is_db_initialized(bind=engine):
+    exercise_ids = [exercise["exercise_id"] for exercise in get_exercises_data()]
+    try:
+        with bind.connect() as connection:
+            if not set(Base.metadata.tables) <= set(inspect(connection).get_table_names()):
+                return False
+            version = connection.execute(text("SELECT MAX(version) FROM schema_version")).scalar()
+            seeded = connection.execute(
+                select(func.count()).select_from(Exercise).where(Exercise.exercise_id.in_(exercise_ids))
+            ).scalar()
+    except DBAPIError:
+        # The schema_version table does not exist yet
+        return False
+    return version == MIGRATIONS[-1][0] and seeded == len(exercise_ids)
+
+
+# Function to bootstrap the database unless it is already up to date, returns whether it was bootstrapped
+# Every worker of a deployment runs it when it starts, only the first one finds work to do
+def bootstrap_db():
+    for attempt in range(1, DB_BOOTSTRAP_ATTEMPTS + 1):
+        if is_db_initialized():
+            logger.debug("database already initialized, skipping bootstrap")
+            return False
+        try:
+            initialize_db()
+        except (IntegrityError, OperationalError) as error:
+            # Another worker created a table, applied a migration or seeded the exercises at the same time
+            # (or holds the database lock), check again once it is done
+            if attempt == DB_BOOTSTRAP_ATTEMPTS:
+                raise
+            logger.info("database bootstrap raced with another worker (%s), checking again", error.orig)
+            time.sleep(0.5 * attempt)
+            continue
+        logger.info("database bootstrapped")
+        return True
+
+
 if __name__ == "__main__":
     initialize_db()
@@ -0,0 +1,152 @@
+# Importing necessary libraries
+import numpy as np
+from numba import njit
+
+
+@njit(cache=True, nogil=True)
+def _extend_cost_frontier(sources, num_sources, targets, start, end, frontier, edge, radius):
+    # Add the cost matrix cells of targets[start:end] against sources[:num_sources] for every channel.
+    # frontier[c, s] holds the accumulated cost of (source s, last target) and is updated in place,
+    # edge[c, k] receives the accumulated cost of (last source, target k).
+    # Cells further than radius from the diagonal are skipped (Sakoe-Chiba band), radius < 0 disables the band.
+    for channel in range(sources.shape[0]):
+        for k in range(start, end):
+            low = 0
+            high = num_sources
+            if radius >= 0:
+                low = max(0, k - radius)
+                high = min(num_sources, k + radius + 1)
+
+            # Accumulated cost of the diagonal neighbour of the first cell in the band
+            if low == 0:
+                diagonal = 0.0 if k == 0 else np.inf
+            else:
+                diagonal = frontier[channel, low - 1] if k > 0 else np.inf
+            up = np.inf
+
+            for s in range(low, high):
+                left = frontier[channel, s] if k > 0 else np.inf
+                distance = sources[channel, s] - targets[channel, k]
+                cost = distance * distance + min(diagonal, up, left)
+                diagonal = left
+                frontier[channel, s] = cost
+                up = cost
+
+            if num_sources > 0:
+                # The last source is only aligned with target k if it lies inside the band
+                in_band = low < high and high == num_sources
+                edge[channel, k] = frontier[channel, num_sources - 1] if in_band else np.inf
+
+
+@njit(cache=True, nogil=True)
+def _dtw_costs(queries, references, radius):
+    # Accumulated DTW cost of every channel, queries has shape (n, channels) and references (m, channels).
+    # Channels are the innermost loop so the same recurrence runs for all channels side by side (SIMD friendly).
+    num_queries, num_channels = queries.shape
+    num_references = references.shape[0]
+    # Rows of the cost matrix, shifted by one so index 0 is the virtual column before the first reference frame
+    previous = np.full((num_references + 1, num_channels), np.inf)
+    current = np.full((num_references + 1, num_channels), np.inf)
+    previous[0, :] = 0.0
+
+    for i in range(num_queries):
+        low = 0
+        high = num_references
+        if radius >= 0:
+            low = max(0, i - radius)
+            high = min(num_references, i + radius + 1)
+
+        # Cells just outside the band have no alignment
+        current[low, :] = np.inf
+        if high < num_references:
+            current[high + 1, :] = np.inf
+
+        for j in range(low, high):
+            for c in range(num_channels):
+                distance = queries[i, c] - references[j, c]
+                current[j + 1, c] = distance * distance + min(
+                    previous[j, c], previous[j + 1, c], current[j, c]
+                )
+        previous, current = current, previous
+
+    return previous[num_references]
+
+
+# Function to compute the DTW cost of every channel of two frame matrices in one pass
+# queries and references have shape (frames, channels), returns the cost of each channel (inf where the band
+# leaves no alignment). Costs match tslearn.metrics.dtw per channel.
+def batch_dtw(queries, references, sakoe_chiba_radius=None):
+    queries = np.ascontiguousarray(queries, dtype=np.float64)
+    references = np.ascontiguousarray(references, dtype=np.float64)
+    if len(queries) == 0 or len(references) == 0:
+        return np.full(queries.shape[1], np.inf)
+    radius = -1 if sakoe_chiba_radius is None else sakoe_chiba_radius
+    return np.sqrt(_dtw_costs(queries, references, radius))
+
+
+# Dynamic Time Warping between growing query and reference series (one series per channel)
+# Only the last row and last column of each channel's cost matrix are kept, so adding new frames costs
+# O(frames) per new frame (O(radius) with a Sakoe-Chiba band) instead of recomputing the whole matrix.
+# Costs match tslearn.metrics.dtw.
+class IncrementalDTW:
+    def __init__(self, num_channels, sakoe_chiba_radius=None, capacity=256):
+        self.num_channels = num_channels
+        self.radius = -1 if sakoe_chiba_radius is None else sakoe_chiba_radius
+        self.query_length = 0
+        self.reference_length = 0
+        self._query = np.empty((num_channels, capacity))
+        self._reference = np.empty((num_channels, capacity))
+        # Accumulated costs of the last query frame against every reference frame
+        self._last_row = np.full((num_channels, capacity), np.inf)
+        # Accumulated costs of every query frame against the last reference frame
+        self._last_column = np.full((num_channels, capacity), np.inf)
+
+    @staticmethod
+    def _grow(array, length, fill_value):
+        if length <= array.shape[1]:
+            return array
+        grown = np.full((array.shape[0], max(length, 2 * array.shape[1])), fill_value)
+        grown[:, : array.shape[1]] = array
+        return grown
+
+    # Function to append new query and reference frames, arrays of shape (num_channels, new_frames)
+    def extend(self, query_values, reference_values):
+        query_values = np.asarray(query_values, dtype=np.float64).reshape(self.num_channels, -1)
+        reference_values = np.asarray(reference_values, dtype=np.float64).reshape(self.num_channels, -1)
+
+        query_start = self.query_length
+        query_end = query_start + query_values.shape[1]
+        reference_start = self.reference_length
+        reference_end = reference_start + reference_values.shape[1]
+
+        self._query = self._grow(self._query, query_end, 0.0)
+        self._last_column = self._grow(self._last_column, query_end, np.inf)
+        self._reference = self._grow(self._reference, reference_end, 0.0)
+        self._last_row = self._grow(self._last_row, reference_end, np.inf)
+
+        self._query[:, query_start:query_end] = query_values
+        self._reference[:, reference_start:reference_end] = reference_values
+
+        # New reference frames against the existing query frames (new columns)
+        _extend_cost_frontier(
+            self._query, query_start, self._reference, reference_start, reference_end,
+            self._last_column, self._last_row, self.radius,
+        )
+        # New query frames against all reference frames (new rows)
+        _extend_cost_frontier(
+            self._reference, reference_end, self._query, query_start, query_end,
+            self._last_row, self._last_column, self.radius,
+        )
+
+        self.query_length = query_end
+        self.reference_length = reference_end
+        return self.costs()
+
+    # Function to get the DTW cost of each channel for the frames seen so far (inf if there is no alignment yet)
+    def costs(self):
+        if self.query_length == 0 or self.reference_length == 0:
+            return np.full(self.num_channels, np.inf)
+        # The last cell is outside the Sakoe-Chiba band, so there is no alignment
+        if self.radius >= 0 and abs(self.query_length - self.reference_length) > self.radius:
+            return np.full(self.num_channels, np.inf)
+        return np.sqrt(self._last_row[:, self.reference_length - 1])
@@ -0,0 +1,73 @@
+# Importing necessary libraries
+import os
+import threading
+import time
+from uuid import uuid4
+
+import numpy as np
+
+from dtw_wrapper import IncrementalDTW
+from reference_cache import reference_cache
+from session_store import SessionStore
+
+# Joints compared with the reference during the exercise (shoulders, elbows, wrists and hips)
+FEEDBACK_JOINTS = [
+    "left_shoulder",
+    "right_shoulder",
+    "left_elbow",
+    "right_elbow",
+    "left_wrist",
+    "right_wrist",
+    "left_hip",
+    "right_hip",
+]
+# Columns compared by default, the x and y coordinates of every feedback joint
+FEEDBACK_COLUMNS = [f"{joint}_{axis}" for joint in FEEDBACK_JOINTS for axis in ("x", "y")]
+
+# Session settings
+# Sessions that receive no frames for this many seconds are evicted
+FEEDBACK_SESSION_IDLE_SECONDS = float(os.environ.get("REHABAI_FEEDBACK_SESSION_IDLE_SECONDS", 300))
+# Maximum number of open sessions (the least recently used session is evicted first)
+FEEDBACK_SESSION_MAX = int(os.environ.get("REHABAI_FEEDBACK_SESSION_MAX", 1000))
+
+
+# Function to stack the values sent for each column into an array of shape (len(columns), frames)
+def stack_columns(values_by_column, columns):
+    missing = [column for column in columns if column not in values_by_column]
+    if missing:
+        raise ValueError(f"Missing values for columns: {', '.join(missing)}")
+    lengths = {len(values_by_column[column]) for column in columns}
+    if len(lengths) > 1:
+        raise ValueError("All columns must have the same number of frames")
+    return np.array([values_by_column[column] for column in columns], dtype=np.float64).reshape(len(columns), -1)
+
+
+# Live feedback session of one user, keeping the DTW state of every compared column between calls
+class FeedbackSession:
+    def __init__(self, user_id, exercise_id, columns, sakoe_chiba_radius=None):
+        self.session_id = str(uuid4())
+        self.user_id = user_id
+        self.exercise_id = exercise_id
+        self.columns = columns
+        self.dtw = IncrementalDTW(len(columns), sakoe_chiba_radius)
+        self.last_access = time.monotonic()
+        # Frames of one session are appended one batch at a time
+        self._lock = threading.Lock()
+
+    # Function to append new frames, arrays of shape (len(columns), new_frames), and return the cost of each
+    # column. Without reference values the matching frames of the server-side reference are used.
+    def append(self, current_values, reference_values=None):
+        with self._lock:
+            if reference_values is None:
+                start = self.dtw.reference_length
+                end = start + current_values.shape[1]
+                reference_values = reference_cache.get_columns(self.exercise_id, self.columns, start, end).T
+            costs = self.dtw.extend(current_values, reference_values)
+        return {
+            column: float(cost) if np.isfinite(cost) else None
+            for column, cost in zip(self.columns, costs)
+        }
+
+
+# Store shared by the feedback endpoints
+feedback_sessions = SessionStore(FeedbackSession, FEEDBACK_SESSION_IDLE_SECONDS, FEEDBACK_SESSION_MAX)
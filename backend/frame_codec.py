@@ -0,0 +1,143 @@
+# Importing necessary libraries
+import io
+import os
+import struct
+import zlib
+
+import numpy as np
+
+from metrics import span
+from ml_wrapper import MAX_FRAMES, get_dataframe_cols, prepare_array
+
+# zstd compression is optional, it is only available when the zstandard package is installed
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Binary frame buffer format (all values little-endian):
+#   magic "RHAI" | version uint8 | dtype uint8 (1 = float32) | reserved uint16 |
+#   number of frames uint32 | number of columns uint16 | reserved uint16 |
+#   frames x columns float32 values, one frame after the other, columns ordered like get_dataframe_cols
+FRAME_BUFFER_MAGIC = b"RHAI"
+FRAME_BUFFER_VERSION = 1
+FRAME_BUFFER_FLOAT32 = 1
+FRAME_BUFFER_HEADER = struct.Struct("<4sBBHIHH")
+
+# .npy files start with this magic string
+NPY_MAGIC = b"\x93NUMPY"
+
+# Maximum size of a decoded upload, protects against oversized or maliciously compressed bodies
+MAX_UPLOAD_BYTES = int(os.environ.get("REHABAI_MAX_UPLOAD_BYTES", 16 * 1024 * 1024))
+
+NUM_COLUMNS = len(get_dataframe_cols())
+
+
+# Raised when an upload cannot be decoded
+class FrameDecodeError(ValueError):
+    pass
+
+
+# Raised when an upload uses a compression that is not supported
+class UnsupportedEncodingError(FrameDecodeError):
+    pass
+
+
+# Function to encode frames (array of shape (frames, 51)) into a binary frame buffer
+def encode_frames(frames):
+    frames = np.ascontiguousarray(frames, dtype="<f4")
+    header = FRAME_BUFFER_HEADER.pack(
+        FRAME_BUFFER_MAGIC, FRAME_BUFFER_VERSION, FRAME_BUFFER_FLOAT32, 0, frames.shape[0], frames.shape[1], 0
+    )
+    return header + frames.tobytes()
+
+
+# Function to undo the Content-Encoding of an upload (at most max_bytes once decoded)
+def decompress(body, content_encoding, max_bytes=MAX_UPLOAD_BYTES):
+    content_encoding = (content_encoding or "identity").strip().lower()
+    if content_encoding == "identity":
+        data = body
+    elif content_encoding == "gzip":
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        try:
+            data = decompressor.decompress(body, max_bytes + 1)
+        except zlib.error as error:
+            raise FrameDecodeError(f"Invalid gzip body: {error}")
+        # A body longer than the limit stops before the end of the stream, it is rejected below
+        if not decompressor.eof and len(data) <= max_bytes:
+            raise FrameDecodeError("Truncated gzip body")
+    elif content_encoding == "zstd":
+        if zstandard is None:
+            raise UnsupportedEncodingError("zstd uploads require the zstandard package")
+        reader = zstandard.ZstdDecompressor().stream_reader(io.BytesIO(body))
+        try:
+            data = reader.read(max_bytes + 1)
+        except zstandard.ZstdError as error:
+            raise FrameDecodeError(f"Invalid zstd body: {error}")
+    else:
+        raise UnsupportedEncodingError(f"Unsupported content encoding: {content_encoding}")
+
+    if len(data) > max_bytes:
+        raise FrameDecodeError("Upload is too large")
+    return data
+
+
+# Function to read the frames of a binary frame buffer without copying them
+def decode_frame_buffer(data):
+    if len(data) < FRAME_BUFFER_HEADER.size:
+        raise FrameDecodeError("Frame buffer is shorter than its header")
+    magic, version, dtype, _, num_frames, num_columns, _ = FRAME_BUFFER_HEADER.unpack_from(data)
+    if magic != FRAME_BUFFER_MAGIC or version != FRAME_BUFFER_VERSION:
+        raise FrameDecodeError("Unknown frame buffer format")
+    if dtype != FRAME_BUFFER_FLOAT32:
+        raise FrameDecodeError("Frame buffer values must be float32")
+    if len(data) != FRAME_BUFFER_HEADER.size + num_frames * num_columns * 4:
+        raise FrameDecodeError("Frame buffer size does not match its header")
+    frames = np.frombuffer(data, dtype="<f4", offset=FRAME_BUFFER_HEADER.size)
+    return frames.reshape(num_frames, num_columns)
+
+
+# Function to read the frames of a .npy file without copying them
+def decode_npy(data):
+    stream = io.BytesIO(data)
+    try:
+        version = np.lib.format.read_magic(stream)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(stream)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(stream)
+    except ValueError as error:
+        raise FrameDecodeError(f"Invalid .npy file: {error}")
+    if dtype.kind != "f" or len(shape) != 2:
+        raise FrameDecodeError(".npy uploads must be 2D float arrays")
+    if len(data) - stream.tell() != int(np.prod(shape)) * dtype.itemsize:
+        raise FrameDecodeError(".npy size does not match its header")
+    frames = np.frombuffer(data, dtype=dtype, offset=stream.tell())
+    # Fortran-ordered arrays (e.g. saved from DataFrame.to_numpy()) are read as a transposed view
+    frames = frames.reshape(shape[::-1]).T if fortran_order else frames.reshape(shape)
+    return frames if dtype == np.float32 else frames.astype(np.float32)
+
+
+# Function to decode an upload into an array of shape (frames, 51) ordered like get_dataframe_cols
+def decode_frames(body, content_encoding=None, max_bytes=MAX_UPLOAD_BYTES):
+    data = decompress(body, content_encoding, max_bytes)
+    if data.startswith(NPY_MAGIC):
+        frames = decode_npy(data)
+    else:
+        frames = decode_frame_buffer(data)
+    if frames.shape[1] != NUM_COLUMNS:
+        raise FrameDecodeError(f"Frames must have {NUM_COLUMNS} columns")
+    return frames
+
+
+# Function to decode the frames used by the model (at most MAX_FRAMES) from an encoded upload
+def load_encoded_frames(body, content_encoding, exercise_id):
+    with span("decode_frames", exercise_id):
+        return decode_frames(body, content_encoding)[:MAX_FRAMES]
+
+
+# Function to prepare the data for the model from an encoded upload
+def prepare_encoded_data(body, content_encoding, max_length, exercise_id):
+    frames = load_encoded_frames(body, content_encoding, exercise_id)
+    with span("prepare_data", exercise_id):
+        return prepare_array(frames, exercise_id, max_length)
@@ -1,9 +1,19 @@
+import os
+
 # Import CryptContext from passlib.context. CryptContext is a simple wrapper for hashing passwords.
 from passlib.context import CryptContext
 
+# bcrypt cost factor of new hashes, hashes with a lower cost factor are replaced at the next login
+BCRYPT_ROUNDS = int(os.environ.get("REHABAI_BCRYPT_ROUNDS", 12))
+
 # Create a CryptContext instance and specify the hashing scheme as bcrypt.
 # The deprecated parameter is set to "auto" to automatically handle deprecated hashes.
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+)
 
 
 # Function to hash a password
@@ -16,3 +26,8 @@ def get_hashed_password(password):
 def verify_password(plain_password, hashed_password):
     # Use the CryptContext instance to verify the plain password against the hashed password
     return pwd_context.verify(plain_password, hashed_password)
+
+
+# Function to verify a password and get a new hash when the stored hash is deprecated (None otherwise)
+def verify_and_update_password(plain_password, hashed_password):
+    return pwd_context.verify_and_update(plain_password, hashed_password)
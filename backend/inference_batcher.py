@@ -0,0 +1,99 @@
+# Importing necessary libraries
+import asyncio
+import os
+
+import numpy as np
+
+from metrics import current_profile
+from model_registry import predict_batch
+from worker_pool import scoring_pool
+
+# Batching settings
+# Maximum number of requests for the same exercise that are run in one forward pass
+BATCH_MAX_SIZE = int(os.environ.get("REHABAI_BATCH_MAX_SIZE", 8))
+# Maximum time a request waits for other requests to join its batch
+BATCH_MAX_WAIT_MS = float(os.environ.get("REHABAI_BATCH_MAX_WAIT_MS", 10))
+
+
+# Micro-batching scheduler that coalesces concurrent predictions for the same exercise
+class InferenceBatcher:
+    def __init__(
+        self,
+        predict_fn=predict_batch,
+        pool=scoring_pool,
+        max_batch_size=BATCH_MAX_SIZE,
+        max_wait_ms=BATCH_MAX_WAIT_MS,
+    ):
+        self.predict_fn = predict_fn
+        # Pool the forward passes run in, so they do not block the event loop
+        self.pool = pool
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait_seconds = max_wait_ms / 1000
+        # Pending (data, padding_mask, future) entries for each exercise
+        self._pending = {}
+        # Timers that flush a partially filled batch once max_wait_ms has passed
+        self._timers = {}
+        self.batches = 0
+        self.batched_requests = 0
+
+    # Function to queue one prepared input of shape (1, max_length, num_features) and wait for its prediction
+    async def predict(self, exercise_id, data, padding_mask):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        pending = self._pending.setdefault(exercise_id, [])
+        pending.append((data, padding_mask, future))
+
+        if len(pending) >= self.max_batch_size:
+            self._flush(exercise_id)
+        elif exercise_id not in self._timers:
+            self._timers[exercise_id] = loop.call_later(
+                self.max_wait_seconds, self._flush, exercise_id
+            )
+
+        return await future
+
+    def _flush(self, exercise_id):
+        timer = self._timers.pop(exercise_id, None)
+        if timer is not None:
+            timer.cancel()
+
+        batch = self._pending.pop(exercise_id, [])
+        if batch:
+            asyncio.ensure_future(self._run_batch(exercise_id, batch))
+
+    async def _run_batch(self, exercise_id, batch):
+        # The batch is shared by several requests, so its stages are not added to the profile of the first one
+        current_profile.set(None)
+        # Stack the inputs of every request into a single batch
+        data = np.concatenate([entry[0] for entry in batch])
+        padding_masks = np.concatenate([entry[1] for entry in batch])
+
+        self.batches += 1
+        self.batched_requests += len(batch)
+
+        try:
+            predictions = await self.pool.run(self.predict_fn, exercise_id, data, padding_masks)
+        except Exception as error:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(error)
+            return
+
+        # Hand each request its own row of the batch prediction
+        for index, (_, _, future) in enumerate(batch):
+            if not future.done():
+                future.set_result(predictions[index : index + 1])
+
+    def stats(self):
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait_seconds * 1000,
+            "pending": {exercise_id: len(batch) for exercise_id, batch in self._pending.items()},
+            "batches": self.batches,
+            "batched_requests": self.batched_requests,
+        }
+
+
+# Batcher shared by the scoring endpoint
+inference_batcher = InferenceBatcher()
@@ -1,7 +1,47 @@
 import pandas as pd
-import os
 import numpy as np
-import math
+
+# Keypoints in the order of the joint positions columns (y, x and confidence columns for each keypoint)
+KEYPOINT_NAMES = [
+  "nose",
+  "left_eye",
+  "right_eye",
+  "left_ear",
+  "right_ear",
+  "left_shoulder",
+  "right_shoulder",
+  "left_elbow",
+  "right_elbow",
+  "left_wrist",
+  "right_wrist",
+  "left_hip",
+  "right_hip",
+  "left_knee",
+  "right_knee",
+  "left_ankle",
+  "right_ankle",
+]
+JOINT_POSITION_COLS = [f"{name}_{value}" for name in KEYPOINT_NAMES for value in ("y", "x", "confidence")]
+
+# Points derived from keypoints, defined as the midpoint of two keypoints
+DERIVED_POINTS = {
+  "mid_hip": ("left_hip", "right_hip"),
+}
+
+# Es1 features: (feature name, feature type, points)
+# "angle" features are the angle at the middle point between the first and end points,
+# "distance" features are the euclidean distance between two points
+ES1_FEATURES = [
+  ("left_arm_torso_angle", "angle", ("left_elbow", "left_shoulder", "left_hip")),
+  ("right_arm_torso_angle", "angle", ("right_elbow", "right_shoulder", "right_hip")),
+  ("left_elbow_extension_angle", "angle", ("left_shoulder", "left_elbow", "left_wrist")),
+  ("right_elbow_extension_angle", "angle", ("right_shoulder", "right_elbow", "right_wrist")),
+  ("left_knee_extension_angle", "angle", ("left_hip", "left_knee", "left_ankle")),
+  ("right_knee_extension_angle", "angle", ("right_hip", "right_knee", "right_ankle")),
+  ("hip_angle", "angle", ("left_hip", "mid_hip", "right_hip")),
+  ("hands_dist", "distance", ("left_wrist", "right_wrist")),
+  ("ankle_dist", "distance", ("left_ankle", "right_ankle")),
+]
 
 
 def get_joint_pair(df, joint_name):
@@ -9,57 +49,97 @@ def get_joint_pair(df, joint_name):
 
 
 def calculate_angle(first, middle, end):
-    first = np.array(first)
-    middle = np.array(middle)
-    end = np.array(end)
+    first = np.asarray(first)
+    middle = np.asarray(middle)
+    end = np.asarray(end)
 
     radians = np.arctan2(end[1]-middle[1], end[0]-middle[0]) - np.arctan2(first[1]-middle[1], first[0]-middle[0])
     angle = np.abs(radians*180.0/np.pi)
 
-    angles = [360-a if a > 180 else a for a in angle]
-    return angles
+    return np.where(angle > 180, 360-angle, angle)
 
 
 def calculate_distance(pair1, pair2):
-  pair1_x, pair1_y = pair1
-  pair2_x, pair2_y = pair2
-  return pd.Series([math.dist([x1, y1], [x2, y2]) for x1, y1, x2, y2 in zip(pair1_x, pair1_y, pair2_x, pair2_y)])
+  pair1_x, pair1_y = np.asarray(pair1[0]), np.asarray(pair1[1])
+  pair2_x, pair2_y = np.asarray(pair2[0]), np.asarray(pair2[1])
+  return np.hypot(pair1_x - pair2_x, pair1_y - pair2_y)
+
+
+# Function to get the joint positions as an array of shape (frames, 17, 3) with (y, x, confidence) on the last axis
+def get_joint_array(joint_positions):
+  if isinstance(joint_positions, pd.DataFrame):
+    joint_positions = joint_positions[JOINT_POSITION_COLS].to_numpy(dtype=np.float64)
+  joint_positions = np.asarray(joint_positions, dtype=np.float64)
+  return joint_positions.reshape(len(joint_positions), len(KEYPOINT_NAMES), 3)
+
+
+# Feature set compiled into index arrays so all features are computed with a few vectorized operations
+class FeatureSet:
+  def __init__(self, features):
+    self.names = [name for name, _, _ in features]
+    point_indices = {name: index for index, name in enumerate(KEYPOINT_NAMES)}
+    for derived_index, derived_name in enumerate(DERIVED_POINTS):
+      point_indices[derived_name] = len(KEYPOINT_NAMES) + derived_index
+    self.derived_points = np.array(
+      [[point_indices[a], point_indices[b]] for a, b in DERIVED_POINTS.values()], dtype=np.intp
+    ).reshape(-1, 2)
+
+    # Position of each feature in the output and the indices of its points
+    self.angle_positions = [i for i, (_, kind, _) in enumerate(features) if kind == "angle"]
+    self.angle_points = np.array(
+      [[point_indices[p] for p in features[i][2]] for i in self.angle_positions], dtype=np.intp
+    ).reshape(-1, 3)
+    self.distance_positions = [i for i, (_, kind, _) in enumerate(features) if kind == "distance"]
+    self.distance_points = np.array(
+      [[point_indices[p] for p in features[i][2]] for i in self.distance_positions], dtype=np.intp
+    ).reshape(-1, 2)
+
+  # Function to compute the features of a (frames, 17, 3) joint array, returns an array of shape
+  # (frames, num_features)
+  def compute(self, joint_array):
+    # (x, y) of every keypoint followed by the derived points, shape (frames, points, 2)
+    points = joint_array[:, :, [1, 0]]
+    if len(self.derived_points):
+      derived = (points[:, self.derived_points[:, 0]] + points[:, self.derived_points[:, 1]]) / 2
+      points = np.concatenate([points, derived], axis=1)
+
+    features = np.empty((len(joint_array), len(self.names)))
+
+    if len(self.angle_points):
+      first = points[:, self.angle_points[:, 0]]
+      middle = points[:, self.angle_points[:, 1]]
+      end = points[:, self.angle_points[:, 2]]
+      to_end = end - middle
+      to_first = first - middle
+      radians = np.arctan2(to_end[..., 1], to_end[..., 0]) - np.arctan2(to_first[..., 1], to_first[..., 0])
+      angles = np.abs(radians*180.0/np.pi)
+      features[:, self.angle_positions] = np.where(angles > 180, 360-angles, angles)
+
+    if len(self.distance_points):
+      difference = points[:, self.distance_points[:, 0]] - points[:, self.distance_points[:, 1]]
+      features[:, self.distance_positions] = np.hypot(difference[..., 0], difference[..., 1])
+
+    return features
+
+  def to_dataframe(self, joint_positions):
+    return pd.DataFrame(self.compute(get_joint_array(joint_positions)), columns=self.names)
+
+
+# Feature set of each exercise whose model uses joint features
+FEATURE_REGISTRY = {
+  "Es1": FeatureSet(ES1_FEATURES),
+}
+
+
+# Function to register the feature set of an exercise
+def register_feature_set(exercise_id, features):
+  FEATURE_REGISTRY[exercise_id] = FeatureSet(features)
+
+
+# Function to get the joint features of an exercise as a dataframe
+def get_exercise_features(df, exercise_id):
+  return FEATURE_REGISTRY[exercise_id].to_dataframe(df)
 
 
 def get_es1_features(df):
-  features_df = pd.DataFrame()
-
-  features_df["left_arm_torso_angle"] = calculate_angle(get_joint_pair(df, "left_elbow"),
-                                                   get_joint_pair(df, "left_shoulder"),
-                                                   get_joint_pair(df, "left_hip"))
-
-  features_df["right_arm_torso_angle"] = calculate_angle(get_joint_pair(df, "right_elbow"),
-                                                   get_joint_pair(df, "right_shoulder"),
-                                                   get_joint_pair(df, "right_hip"))
-
-  features_df["left_elbow_extension_angle"] = calculate_angle(get_joint_pair(df, "left_shoulder"),
-                                                     get_joint_pair(df, "left_elbow"),
-                                                     get_joint_pair(df, "left_wrist"))
-
-  features_df["right_elbow_extension_angle"] = calculate_angle(get_joint_pair(df, "right_shoulder"),
-                                                     get_joint_pair(df, "right_elbow"),
-                                                     get_joint_pair(df, "right_wrist"))
-
-  features_df["left_knee_extension_angle"] = calculate_angle(get_joint_pair(df, "left_hip"),
-                                                    get_joint_pair(df, "left_knee"),
-                                                    get_joint_pair(df, "left_ankle"))
-
-  features_df["right_knee_extension_angle"] = calculate_angle(get_joint_pair(df, "right_hip"),
-                                                    get_joint_pair(df, "right_knee"),
-                                                    get_joint_pair(df, "right_ankle"))
-
-  mid_hip_point = [(get_joint_pair(df, "left_hip")[0] + get_joint_pair(df, "right_hip")[0])/2, (get_joint_pair(df, "left_hip")[1] + get_joint_pair(df, "right_hip")[1])/2]
-  features_df["hip_angle"] = calculate_angle(get_joint_pair(df, "left_hip"),
-                                        mid_hip_point,
-                                        get_joint_pair(df, "right_hip"))
-
-  features_df["hands_dist"] = calculate_distance(get_joint_pair(df, "left_wrist"), get_joint_pair(df, "right_wrist"))
-
-  features_df["ankle_dist"] = calculate_distance(get_joint_pair(df, "left_ankle"), get_joint_pair(df, "right_ankle"))
-
-  return features_df
\ No newline at end of file
+  return get_exercise_features(df, "Es1")
@@ -0,0 +1,52 @@
+# Importing necessary libraries
+import importlib
+import sys
+import threading
+import time
+
+from metrics import get_logger
+
+logger = get_logger(__name__)
+
+
+# Module imported on the first access to one of its attributes
+# TensorFlow, keras_nlp and tslearn take seconds to import, so the modules that use them only import them when a
+# model is loaded or a legacy feedback request comes in, and the API starts without waiting for them
+class LazyModule:
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    # Only the first import of a module is timed, it may already have been imported by another module
+                    already_imported = self._name in sys.modules
+                    start = time.perf_counter()
+                    module = importlib.import_module(self._name)
+                    if not already_imported:
+                        import_seconds[self._name] = time.perf_counter() - start
+                        logger.info("imported %s in %.2fs", self._name, import_seconds[self._name])
+                    self._module = module
+        return self._module
+
+    @property
+    def is_loaded(self):
+        return self._module is not None
+
+    def __getattr__(self, name):
+        return getattr(self._load(), name)
+
+    def __repr__(self):
+        return f"<lazy module {self._name!r}{' (loaded)' if self.is_loaded else ''}>"
+
+
+# Time taken by the import of each lazily imported module, in seconds
+import_seconds = {}
+
+
+# Function to get a module that is only imported when it is first used
+def lazy_import(name):
+    return LazyModule(name)
@@ -1,12 +1,17 @@
 # Importing the necessary libraries
+import time
+
+# Start of the application imports, to report how long the imports and the startup take
+IMPORT_START = time.perf_counter()
+
+import secrets
+import threading
+from contextlib import asynccontextmanager, contextmanager
 from datetime import datetime
 from typing import Annotated
 from uuid import uuid4, UUID
 
-import pandas as pd
-import os
-import tensorflow as tf
-from tslearn.metrics import dtw
+import numpy as np
 from fastapi import (
     FastAPI,
     UploadFile,
@@ -16,24 +21,157 @@ from fastapi import (
     Response,
     Request,
     Cookie,
+    Query,
 )
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from keras_nlp.layers import TransformerEncoder
+from fastapi.responses import JSONResponse, PlainTextResponse
 from pydantic import BaseModel
-from sqlalchemy.orm import Session
-
-from database import SessionLocal, engine
-from hashing import get_hashed_password, verify_password
-from ml_wrapper import prepare_data, reorder_dataframe
-from data_wrapper import initialize_db
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import AsyncSessionLocal, async_engine
+from hashing import get_hashed_password, verify_and_update_password
+from ml_wrapper import MAX_FRAMES, MAX_LENGTH_MAPPING, get_dataframe_cols, load_csv_frames, prepare_array
+from feedback_session import FEEDBACK_COLUMNS, feedback_sessions, stack_columns
+from dtw_wrapper import batch_dtw
+from reference_cache import reference_cache
+from frame_codec import (
+    MAX_UPLOAD_BYTES,
+    FrameDecodeError,
+    UnsupportedEncodingError,
+    load_encoded_frames,
+)
+from scoring_session import SCORING_CHUNK_MAX_BYTES, load_chunk_frames, scoring_sessions
+from auth_cache import CachedUser, auth_cache
+from progress_recorder import progress_recorder
+from progress_history import (
+    MAX_PAGE_SIZE,
+    InvalidCursor,
+    get_progress_history,
+    get_progress_rollups,
+    get_progress_summaries,
+)
+from progress_rollups import ROLLUP_PERIODS
+from provisioning import (
+    ADMIN_TOKEN,
+    get_assign_exercises_statement,
+    get_assign_user_ids_statement,
+    provision_roster,
+    read_roster,
+)
+from catalog_cache import catalog_cache, get_catalog_headers, is_not_modified
+from score_cache import MAX_IDEMPOTENCY_KEY_LENGTH, IdempotencyKeyReused, get_content_key, score_cache
+from model_registry import MODEL_LOADING, model_registry
+from lazy_imports import import_seconds, lazy_import
+from inference_batcher import inference_batcher
+from worker_pool import (
+    SCORING_POOL_MODE,
+    PoolSaturated,
+    feedback_pool,
+    hashing_pool,
+    scoring_pool,
+)
+from metrics import (
+    PROFILING_ENABLED,
+    STATUS_TOKEN,
+    RequestProfile,
+    current_profile,
+    get_logger,
+    metrics_registry,
+    span,
+)
+from data_wrapper import DB_BOOTSTRAP, bootstrap_db
 import models
 from utils import is_exercise_assigned_to_user
-from typing import List, Optional
-from io import StringIO
+from typing import Dict, List, Optional
+
+logger = get_logger(__name__)
+
+# tslearn is only used by the legacy feedback endpoint and takes seconds to import
+tslearn_metrics = lazy_import("tslearn.metrics")
+
+# Durations of the import and startup phases of the server process, in seconds
+startup_timings = {"imports": time.perf_counter() - IMPORT_START}
+
+
+# Context manager timing a startup phase
+@contextmanager
+def startup_phase(phase):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        startup_timings[phase] = time.perf_counter() - start
+
+
+# Function to create the tables, apply the migrations and add the exercises when the application starts
+# (instead of when it is imported), unless the database is already up to date
+def bootstrap_database():
+    if DB_BOOTSTRAP == "startup":
+        with startup_phase("db_bootstrap"):
+            bootstrap_db()
+
+
+# Function to load the clinical score models, timed as a startup phase
+def preload_models():
+    with startup_phase("model_preload"):
+        model_registry.preload()
+
+
+# Function to load the clinical score models and the exercise references once when the application starts
+def preload_resources():
+    if SCORING_POOL_MODE == "process":
+        # Each worker process preloads its own models
+        scoring_pool.start()
+    elif MODEL_LOADING == "eager":
+        preload_models()
+    elif MODEL_LOADING == "background":
+        # The API serves requests while the models load, a scoring request for a model that is not loaded yet
+        # waits for it (or loads it) through the registry
+        threading.Thread(target=preload_models, name="model-preload", daemon=True).start()
+    # Load the reference joint positions used for live feedback
+    with startup_phase("reference_preload"):
+        reference_cache.preload()
+
+
+# Function to report how long the server took to be ready
+def report_startup():
+    startup_timings["ready"] = time.perf_counter() - IMPORT_START
+    logger.info(
+        "ready in %.2fs (imports %.2fs, model loading: %s)",
+        startup_timings["ready"],
+        startup_timings["imports"],
+        MODEL_LOADING,
+    )
+
+
+# Function to stop the worker pools, write the queued clinical scores and close the database connections
+# when the application shuts down
+async def shutdown_resources():
+    scoring_pool.shutdown()
+    feedback_pool.shutdown()
+    hashing_pool.shutdown()
+    await progress_recorder.stop()
+    await async_engine.dispose()
+
+
+# Start up and shut down the application: the database bootstrap, the model and reference preloading and the
+# clinical score writer run once the server process starts, before the first request is served
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    bootstrap_database()
+    preload_resources()
+    # Start writing the queued clinical scores in the background
+    progress_recorder.start()
+    report_startup()
+    yield
+    await shutdown_resources()
+
 
 # Create an instance of the FastAPI class
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 
 # Define the SessionData model
@@ -52,9 +190,52 @@ app.add_middleware(
     allow_credentials=True,  # Allow cookies to be included in the requests
     allow_methods=["*"],  # Allow all HTTP methods
     allow_headers=["*"],  # Allow all headers
+    # Let the frontend read the stage timings of profiled requests and whether a score was replayed
+    expose_headers=["Server-Timing", "Idempotent-Replayed"],
+)
+
+# Duration of every request by endpoint, method, status code and exercise
+request_duration = metrics_registry.histogram(
+    "rehabai_request_duration_seconds",
+    "Duration of the requests by endpoint",
+    ("endpoint", "method", "status", "exercise_id"),
 )
 
 
+# Function to get the exercise_id label of a metric: only known exercises are used as labels, so clients cannot
+# create new series with made up exercise ids
+def get_exercise_label(exercise_id):
+    return exercise_id if exercise_id in MAX_LENGTH_MAPPING else ""
+
+
+# Measure the duration of every request, and return the stage timings of requests sent with the X-Profile: 1 header
+@app.middleware("http")
+async def instrument_requests(request: Request, call_next):
+    profile = None
+    if PROFILING_ENABLED and request.headers.get("x-profile") == "1":
+        profile = RequestProfile()
+        current_profile.set(profile)
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+    finally:
+        # The route template and path parameters are known once the request has been routed
+        route = request.scope.get("route")
+        exercise_id = request.scope.get("path_params", {}).get("exercise_id", "")
+        request_duration.observe(
+            time.perf_counter() - start,
+            endpoint=route.path if route is not None else "unmatched",
+            method=request.method,
+            status=status,
+            exercise_id=get_exercise_label(exercise_id),
+        )
+    if profile is not None:
+        response.headers["Server-Timing"] = profile.server_timing()
+    return response
+
+
 # Define the UserCreateBase model
 class UserCreateBase(BaseModel):
     username: str
@@ -88,21 +269,49 @@ class CsvStringModel(BaseModel):
     csvString: Optional[str]
 
 
+# Define the FeedbackSessionCreateModel model
+class FeedbackSessionCreateModel(BaseModel):
+    columns: Optional[List[str]] = None  # Columns to compare (defaults to the x and y of the feedback joints)
+    sakoeChibaRadius: Optional[int] = None  # Optional Sakoe-Chiba band radius in frames
+
+
+# Define the FeedbackFramesModel model
+class FeedbackFramesModel(BaseModel):
+    currentJointValues: Dict[str, List[float]]  # New frames of the patient for each column
+    # New frames of the reference for each column (defaults to the matching frames of the server-side reference)
+    referenceJointValues: Optional[Dict[str, List[float]]] = None
+
+
+# Define the FeedbackBatchModel model
+class FeedbackBatchModel(BaseModel):
+    columns: List[str]  # Columns of the frame matrices
+    currentFrames: List[List[float]]  # Frames of the patient, one row per frame and one value per column
+    # Frames of the reference, one row per frame and one value per column
+    # (defaults to frames referenceStart to referenceEnd of the server-side reference)
+    referenceFrames: Optional[List[List[float]]] = None
+    referenceStart: int = 0  # First server-side reference frame to compare against
+    referenceEnd: Optional[int] = None  # End of the server-side reference frames (defaults to the number of current frames)
+    sakoeChibaRadius: Optional[int] = None  # Optional Sakoe-Chiba band radius in frames
+
+
 # Define a database dependency
-def get_db():
-    db = SessionLocal()  # Create a new database session
-    try:
+async def get_db():
+    # Create a new async database session, closed when the request is done
+    async with AsyncSessionLocal() as db:
         yield db  # Yield the database session to the dependency
-    finally:
-        db.close()  # Close the database session
 
 
-db_dependency = Annotated[Session, Depends(get_db)]
+db_dependency = Annotated[AsyncSession, Depends(get_db)]
 
-# Create all the tables in the database
-models.Base.metadata.create_all(bind=engine)
 
-initialize_db()
+# Answer with 429 Too Many Requests when a worker pool is full
+@app.exception_handler(PoolSaturated)
+async def pool_saturated_handler(request: Request, exc: PoolSaturated):
+    return JSONResponse(
+        status_code=429,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
 
 
 # Function to get the current user from the authentication token
@@ -115,19 +324,35 @@ async def get_current_user(request: Request, db: db_dependency):
         raise HTTPException(
             status_code=401, detail="Not authenticated. Session token not found."
         )
+    # Use the cached user of the session token when available
+    user = await auth_cache.get(str(session_id))
+    if user is not None:
+        return user
+
     # Retrieve the user with the matching session token
-    user = (
-        db.query(models.User)
-        .filter(models.User.session_token == str(session_id))
-        .first()
+    user = await db.scalar(
+        select(models.User).where(models.User.session_token == str(session_id))
     )
     # If there is no user with the matching session token, raise an exception
     if not user:
-        print(session_id)
+        logger.debug("rejected an unknown session token")
         raise HTTPException(
             status_code=401, detail="Not authenticated. Invalid session token."
         )
-    return user
+    return await auth_cache.put(str(session_id), user)
+
+
+# Function to check the token of the status endpoints and /metrics, sent in the X-Status-Token header or as a bearer
+# token (e.g. the authorization of a Prometheus scrape job). They expose model paths, queue depths and cache
+# statistics, so they are not open to the patients either.
+def require_status_token(request: Request):
+    authorization = request.headers.get("authorization", "")
+    token = request.headers.get("x-status-token") or (
+        authorization[len("bearer ") :] if authorization.lower().startswith("bearer ") else ""
+    )
+    valid_tokens = [valid_token for valid_token in (STATUS_TOKEN, ADMIN_TOKEN) if valid_token]
+    if not any(secrets.compare_digest(token.encode(), valid_token.encode()) for valid_token in valid_tokens):
+        raise HTTPException(status_code=403, detail="Invalid status token")
 
 
 # Endpoints
@@ -136,39 +361,36 @@ async def get_current_user(request: Request, db: db_dependency):
 @app.post("/api/signup/", response_model=UserCreateModel)
 async def signup(user: UserCreateBase, db: db_dependency):
     # Check if the username already exists
-    existing_user = (
-        db.query(models.User).filter(models.User.username == user.username).first()
+    existing_user = await db.scalar(
+        select(models.User).where(models.User.username == user.username)
     )
     # If the username already exists, raise an exception
     if existing_user:
         raise HTTPException(status_code=400, detail="Username already registered")
 
-    # Hash the password
-    hashed_password = get_hashed_password(user.password)
-
-    # Generate a unique user ID
-    user_count = db.query(models.User).count() + 1
-    u_id = f"U{user_count}"
+    # Hash the password (in the hashing pool, so bcrypt does not block the event loop)
+    hashed_password = await hashing_pool.run(get_hashed_password, user.password)
 
     # Create a new user
-    db_user = models.User(
-        user_id=u_id, username=user.username, password=hashed_password
-    )
+    db_user = models.User(username=user.username, password=hashed_password)
+    db.add(db_user)
+    try:
+        await db.flush()
+    except IntegrityError:
+        # The username was registered by a concurrent signup
+        raise HTTPException(status_code=400, detail="Username already registered")
+
+    # Generate a unique user ID from the primary key, so concurrent signups never get the same ID
+    await db.execute(get_assign_user_ids_statement([db_user.id]))
 
     # Assigning all exercises to the new user
-    exercises = db.query(models.Exercise).all()
-    for exercise in exercises:
-        db_assigned_exercise = models.AssignedExercise(
-            user_id=db_user.user_id,
-            exercise_id=exercise.exercise_id,
-            date=datetime.now(),
-        )
-        db.add(db_assigned_exercise)
+    await db.execute(get_assign_exercises_statement([db_user.id], datetime.now()))
 
     # Add the new user to the database
-    db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
+    await db.refresh(db_user)
+    # The exercises assigned to the user changed
+    catalog_cache.invalidate(db_user.user_id)
 
     return db_user
 
@@ -176,21 +398,28 @@ async def signup(user: UserCreateBase, db: db_dependency):
 @app.post("/api/login/")
 async def login(user: UserLoginBase, db: db_dependency, response: Response):
     # Check if the username exists in the database
-    db_user = (
-        db.query(models.User).filter(models.User.username == user.username).first()
+    db_user = await db.scalar(
+        select(models.User).where(models.User.username == user.username)
     )
     # If the username does not exist, raise an exception
     if not db_user:
         raise HTTPException(status_code=404, detail="User not found")
     # If the password is incorrect, raise an exception
-    if not verify_password(user.password, db_user.password):
+    password_valid, new_hashed_password = await hashing_pool.run(
+        verify_and_update_password, user.password, db_user.password
+    )
+    if not password_valid:
         raise HTTPException(status_code=401, detail="Incorrect password")
+    # Replace the stored hash if it uses a deprecated scheme or cost factor
+    if new_hashed_password:
+        db_user.password = new_hashed_password
 
     # Set the session token in the response cookie
     session = uuid4()
+    # The previous session token of the user is no longer valid
+    await auth_cache.invalidate(db_user.session_token)
     db_user.session_token = str(session)
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
 
     response.set_cookie(key="session_token", value=session, httponly=True)
     return {"message": "Login successful", "session_id": str(session)}
@@ -198,25 +427,23 @@ async def login(user: UserLoginBase, db: db_dependency, response: Response):
 
 @app.get("/api/exercises/")
 async def get_exercises(
-    db: db_dependency, current_user: models.User = Depends(get_current_user)
+    request: Request,
+    db: db_dependency,
+    current_user: CachedUser = Depends(get_current_user),
 ):
-    # Get the user's assigned exercises
-    assigned_exercises = (
-        db.query(models.AssignedExercise)
-        .filter(models.AssignedExercise.user_id == current_user.user_id)
-        .all()
-    )
-    # Get the exercise data for each assigned exercise
-    exercises = []
-    for assigned_exercise in assigned_exercises:
-        exercise = (
-            db.query(models.Exercise)
-            .filter(models.Exercise.exercise_id == assigned_exercise.exercise_id)
-            .first()
-        )
-        exercises.append(exercise)
+    # Get the user's assigned exercises (loaded with a single query and cached until the assignments change)
+    catalog = await catalog_cache.get(db, current_user.user_id)
+    headers = get_catalog_headers(catalog)
 
-    return exercises
+    # The client already has the current catalog
+    if is_not_modified(
+        catalog,
+        request.headers.get("if-none-match"),
+        request.headers.get("if-modified-since"),
+    ):
+        return Response(status_code=304, headers=headers)
+
+    return Response(content=catalog.body, media_type="application/json", headers=headers)
 
 
 @app.post("/api/feedback/{exercise_id}")
@@ -225,110 +452,594 @@ async def get_feedback(
     db: db_dependency,
     referenceJointValues: List[float],
     currentJointValues: List[float],
-    current_user: models.User = Depends(get_current_user),
+    current_user: CachedUser = Depends(get_current_user),
 ):
     # Calculating the Dynamic Time Warping (DTW) distance between the current and reference joint values
-    dtw_value = dtw(currentJointValues, referenceJointValues)
+    with span("feedback_dtw", get_exercise_label(exercise_id)):
+        dtw_value = await feedback_pool.run(tslearn_metrics.dtw, currentJointValues, referenceJointValues)
     # Preparing the result
     result = {"feedback_dtw": [dtw_value]}
-    print(result["feedback_dtw"])
+    logger.debug("feedback dtw for %s: %s", exercise_id, dtw_value)
     return JSONResponse(content=result)
 
 
+@app.post("/api/feedback/{exercise_id}/batch")
+async def get_batch_feedback(
+    exercise_id: str,
+    frames: FeedbackBatchModel,
+    current_user: CachedUser = Depends(get_current_user),
+):
+    # Check the frame matrices
+    unknown_columns = [column for column in frames.columns if column not in get_dataframe_cols()]
+    if unknown_columns:
+        raise HTTPException(
+            status_code=400, detail=f"Unknown columns: {', '.join(unknown_columns)}"
+        )
+    num_columns = len(frames.columns)
+    if any(len(frame) != num_columns for frame in frames.currentFrames + (frames.referenceFrames or [])):
+        raise HTTPException(
+            status_code=400, detail="Every frame must have one value per column"
+        )
+    if frames.sakoeChibaRadius is not None and frames.sakoeChibaRadius < 0:
+        raise HTTPException(status_code=400, detail="sakoeChibaRadius must not be negative")
+    if frames.referenceStart < 0:
+        raise HTTPException(status_code=400, detail="referenceStart must not be negative")
+
+    current_frames = np.array(frames.currentFrames, dtype=np.float64).reshape(-1, num_columns)
+    if frames.referenceFrames is not None:
+        reference_frames = np.array(frames.referenceFrames, dtype=np.float64).reshape(-1, num_columns)
+    else:
+        # Use the reference frames cached on the server
+        reference_end = frames.referenceEnd
+        if reference_end is None:
+            reference_end = frames.referenceStart + len(current_frames)
+        try:
+            reference_frames = reference_cache.get_columns(
+                exercise_id, frames.columns, frames.referenceStart, reference_end
+            )
+        except KeyError:
+            raise HTTPException(status_code=404, detail="Exercise reference not found")
+
+    # Calculating the DTW distance of every column in one pass
+    with span("feedback_dtw", get_exercise_label(exercise_id)):
+        costs = await feedback_pool.run(
+            batch_dtw, current_frames, reference_frames, frames.sakoeChibaRadius
+        )
+    result = {
+        "feedback_dtw": {
+            column: float(cost) if np.isfinite(cost) else None
+            for column, cost in zip(frames.columns, costs)
+        }
+    }
+    return JSONResponse(content=result)
+
+
+@app.post("/api/feedback_sessions/{exercise_id}")
+async def create_feedback_session(
+    exercise_id: str,
+    settings: FeedbackSessionCreateModel,
+    current_user: CachedUser = Depends(get_current_user),
+):
+    # Check the requested columns and band radius
+    columns = settings.columns or FEEDBACK_COLUMNS
+    unknown_columns = [column for column in columns if column not in get_dataframe_cols()]
+    if unknown_columns:
+        raise HTTPException(
+            status_code=400, detail=f"Unknown columns: {', '.join(unknown_columns)}"
+        )
+    if settings.sakoeChibaRadius is not None and settings.sakoeChibaRadius < 0:
+        raise HTTPException(status_code=400, detail="sakoeChibaRadius must not be negative")
+
+    if exercise_id not in reference_cache.reference_paths:
+        raise HTTPException(status_code=404, detail="Exercise not found")
+
+    # Open a session that keeps the DTW state between calls
+    session = feedback_sessions.create(
+        current_user.user_id, exercise_id, columns, settings.sakoeChibaRadius
+    )
+    return {"session_id": session.session_id, "columns": columns}
+
+
+@app.post("/api/feedback_sessions/{session_id}/frames")
+async def append_feedback_frames(
+    session_id: str,
+    frames: FeedbackFramesModel,
+    current_user: CachedUser = Depends(get_current_user),
+):
+    session = feedback_sessions.get(session_id, current_user.user_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Feedback session not found")
+
+    try:
+        current_values = stack_columns(frames.currentJointValues, session.columns)
+        reference_values = None
+        if frames.referenceJointValues is not None:
+            reference_values = stack_columns(frames.referenceJointValues, session.columns)
+    except ValueError as error:
+        raise HTTPException(status_code=400, detail=str(error))
+
+    # Update the DTW costs with the new frames only
+    with span("feedback_dtw", session.exercise_id):
+        feedback = await feedback_pool.run(session.append, current_values, reference_values)
+    return {"feedback_dtw": feedback, "frames": session.dtw.query_length}
+
+
+@app.delete("/api/feedback_sessions/{session_id}")
+async def close_feedback_session(
+    session_id: str,
+    current_user: CachedUser = Depends(get_current_user),
+):
+    if not feedback_sessions.close(session_id, current_user.user_id):
+        raise HTTPException(status_code=404, detail="Feedback session not found")
+    return {"message": "Feedback session closed"}
+
+
+# Function to check that an exercise can be scored for the current user and return its model input length
+async def get_scoring_max_length(db, current_user, exercise_id):
+    # Get the user's assigned exercises and check if the chosen exercise is among the exercises assigned to the user
+    if not await is_exercise_assigned_to_user(db, current_user.user_id, exercise_id):
+        raise HTTPException(status_code=403, detail="Exercise not assigned to user")
+
+    if exercise_id not in MAX_LENGTH_MAPPING:
+        raise HTTPException(status_code=404, detail="Exercise not found")
+
+    return MAX_LENGTH_MAPPING[exercise_id]
+
+
+# Function to get the Idempotency-Key header of a clinical score submission
+def get_idempotency_key(request):
+    idempotency_key = request.headers.get("idempotency-key")
+    if idempotency_key is not None and not 0 < len(idempotency_key) <= MAX_IDEMPOTENCY_KEY_LENGTH:
+        raise HTTPException(
+            status_code=400, detail=f"Idempotency-Key must have 1 to {MAX_IDEMPOTENCY_KEY_LENGTH} characters"
+        )
+    return idempotency_key
+
+
+# Function to read the body of an upload of at most max_bytes, streamed so an oversized body is rejected with 413
+# before it is held in memory
+async def read_upload(request, max_bytes):
+    content_length = request.headers.get("content-length", "")
+    if content_length.isdigit() and int(content_length) > max_bytes:
+        raise HTTPException(status_code=413, detail=f"Uploads are limited to {max_bytes} bytes")
+    # The Content-Length header may be missing (chunked uploads) or wrong, so the received bytes are counted too
+    chunks = []
+    size = 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > max_bytes:
+            raise HTTPException(status_code=413, detail=f"Uploads are limited to {max_bytes} bytes")
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+# Function to score an exercise session of the current user and store the clinical score
+async def score_exercise(exercise_id, db, current_user, idempotency_key, load_fn, *load_args):
+    max_length = await get_scoring_max_length(db, current_user, exercise_id)
+
+    # Read the frames used by the model (the decoding stages are timed in the scoring pool)
+    frames = await scoring_pool.run(load_fn, *load_args, exercise_id)
+
+    # The frames are only prepared if their score is not cached
+    async def prepare():
+        return await scoring_pool.run(prepare_array, frames, exercise_id, max_length)
+
+    return await store_clinical_score(exercise_id, current_user, frames, prepare, idempotency_key)
+
+
+# Function to predict the clinical score of a session and store it
+# frames are the joint positions used by the model, prepare is awaited to get the model input when the score
+# of the frames is not cached. An idempotency key is tied to the content of the submission, or to submission_key
+# when given (scoring sessions use their id, so a retried close is checked after the session is gone)
+async def store_clinical_score(exercise_id, current_user, frames, prepare, idempotency_key=None, submission_key=None):
+    content_key = get_content_key(exercise_id, model_registry.get_version(exercise_id), frames)
+    submission_key = submission_key or content_key
+    if idempotency_key is None:
+        return JSONResponse(content=await score_and_record(exercise_id, current_user, content_key, prepare))
+
+    # Concurrent retries with the same key wait for the first one, then get its response
+    async with score_cache.idempotency_guard(current_user.user_id, idempotency_key):
+        try:
+            result = await score_cache.get_response(current_user.user_id, idempotency_key, submission_key)
+        except IdempotencyKeyReused as error:
+            raise HTTPException(status_code=422, detail=str(error))
+        if result is not None:
+            # Already scored and stored, the score is not stored a second time
+            return JSONResponse(content=result, headers={"Idempotent-Replayed": "true"})
+
+        result = await score_and_record(exercise_id, current_user, content_key, prepare)
+        await score_cache.put_response(current_user.user_id, idempotency_key, submission_key, result)
+    return JSONResponse(content=result)
+
+
+# Function to get the clinical score of a session (from the score cache or the model) and store it
+async def score_and_record(exercise_id, current_user, content_key, prepare):
+    score = await score_cache.get(content_key)
+    if score is None:
+        prepared_data = await prepare()
+        # Make a prediction (batched together with concurrent requests for the same exercise)
+        with span("inference", exercise_id):
+            prediction = await inference_batcher.predict(
+                exercise_id, prepared_data[0], prepared_data[1]
+            )
+        score = prediction.tolist()
+        await score_cache.put(content_key, score)
+
+    # Store the clinical score (queued and written in batches together with concurrent scores)
+    with span("progress_record", exercise_id):
+        await progress_recorder.record(current_user.user_id, exercise_id, score[0][0])
+
+    return {"clinical_score": score}
+
+
 @app.post("/api/clinical_score/{exercise_id}")
 async def clinical_score(
     exercise_id: str,
+    request: Request,
     db: db_dependency,
     csv_data: CsvStringModel,
-    current_user: models.User = Depends(get_current_user),
+    current_user: CachedUser = Depends(get_current_user),
 ):
-    # Get the user's assigned exercises and check if the chosen exercise is among the exercises assigned to the user
-    if not is_exercise_assigned_to_user(db, current_user.user_id, exercise_id):
-        raise HTTPException(status_code=403, detail="Exercise not assigned to user")
+    # csvString is the string containing the csv file
+    return await score_exercise(
+        exercise_id, db, current_user, get_idempotency_key(request), load_csv_frames, csv_data.csvString
+    )
 
-    # Define the directory and paths for the models
-    models_directory = "models/"
 
-    model_paths = {
-        "Es1": "ml_model_Es1.h5",
-        "Es2": "ml_model_Es2.h5",
-        "Es3": "ml_model_Es3.h5",
-        "Es4": "ml_model_Es4.h5",
-        "Es5": "ml_model_Es5.h5",
-    }
+@app.post("/api/clinical_score/{exercise_id}/frames")
+async def clinical_score_frames(
+    exercise_id: str,
+    request: Request,
+    db: db_dependency,
+    current_user: CachedUser = Depends(get_current_user),
+):
+    # The body is a binary frame buffer or a .npy file, optionally compressed (Content-Encoding: gzip or zstd)
+    body = await read_upload(request, MAX_UPLOAD_BYTES)
+    try:
+        return await score_exercise(
+            exercise_id,
+            db,
+            current_user,
+            get_idempotency_key(request),
+            load_encoded_frames,
+            body,
+            request.headers.get("content-encoding"),
+        )
+    except UnsupportedEncodingError as error:
+        raise HTTPException(status_code=415, detail=str(error))
+    except FrameDecodeError as error:
+        raise HTTPException(status_code=400, detail=str(error))
 
-    max_length_mapping = {
-        "Es1": 1515,
-        "Es2": 1668,
-        "Es3": 1518,
-        "Es4": 1988,
-        "Es5": 1022,
-    }
-    # Load the model
-    path = os.path.join(models_directory, model_paths[exercise_id])
-    max_length = max_length_mapping.get(exercise_id, 0)
-    print("starting model load")
-    model = tf.keras.models.load_model(path, compile=False)
-    print("finished model load")
-
-    # Prepare the data
-    csvStringIO = StringIO(
-        csv_data.csvString
-    )  # csvString is the string containing the csv file
-    raw_data = pd.read_csv(csvStringIO, sep=",")
-    raw_data_ordered = reorder_dataframe(raw_data)
-    print("starting prepare data")
-    prepared_data = prepare_data(raw_data_ordered, max_length, exercise_id)
-    print("ending prepare data")
-
-    # Make a prediction
-    prediction = model.predict([prepared_data[0], prepared_data[1]])
-
-    # Checking if there are previous entries for the same user and exercise
-    previous_entry = (
-        db.query(models.ProgressTracker)
-        .filter(
-            models.ProgressTracker.user_id == current_user.user_id,
-            models.ProgressTracker.exercise_id == exercise_id,
+
+@app.post("/api/scoring_sessions/{exercise_id}")
+async def create_scoring_session(
+    exercise_id: str,
+    db: db_dependency,
+    current_user: CachedUser = Depends(get_current_user),
+):
+    max_length = await get_scoring_max_length(db, current_user, exercise_id)
+    # Open a session that prepares the frames as they are uploaded during the exercise
+    session = scoring_sessions.create(current_user.user_id, exercise_id, max_length)
+    return {"session_id": session.session_id, "max_frames": MAX_FRAMES}
+
+
+@app.post("/api/scoring_sessions/{session_id}/frames")
+async def append_scoring_frames(
+    session_id: str,
+    request: Request,
+    current_user: CachedUser = Depends(get_current_user),
+):
+    session = scoring_sessions.get(session_id, current_user.user_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Scoring session not found")
+
+    # The body is a chunk of frames in the same formats as /api/clinical_score/{exercise_id}/frames,
+    # decoded in the scoring pool like the other uploads
+    body = await read_upload(request, SCORING_CHUNK_MAX_BYTES)
+    try:
+        frames = await scoring_pool.run(
+            load_chunk_frames, body, request.headers.get("content-encoding"), session.exercise_id
         )
-        .order_by(models.ProgressTracker.date.desc())
-        .first()
+    except UnsupportedEncodingError as error:
+        raise HTTPException(status_code=415, detail=str(error))
+    except FrameDecodeError as error:
+        raise HTTPException(status_code=400, detail=str(error))
+    # The session lives in this process (the scoring pool may run in worker processes), so the chunk is
+    # appended and prepared in a thread
+    with span("prepare_data", session.exercise_id):
+        frames_used = await run_in_threadpool(session.append, frames)
+    return {"frames": session.received_frames, "frames_used": frames_used}
+
+
+# Function to get the key tying an idempotency key to a scoring session
+def get_session_submission_key(session_id):
+    return f"scoring_session:{session_id}"
+
+
+@app.post("/api/scoring_sessions/{session_id}/close")
+async def close_scoring_session(
+    session_id: str,
+    request: Request,
+    current_user: CachedUser = Depends(get_current_user),
+):
+    idempotency_key = get_idempotency_key(request)
+    if idempotency_key:
+        # A retry of a close that succeeded gets the stored response, and a key used for another submission is
+        # rejected before the session is closed
+        try:
+            result = await score_cache.get_response(
+                current_user.user_id, idempotency_key, get_session_submission_key(session_id)
+            )
+        except IdempotencyKeyReused as error:
+            raise HTTPException(status_code=422, detail=str(error))
+        if result is not None:
+            return JSONResponse(content=result, headers={"Idempotent-Replayed": "true"})
+
+    session = scoring_sessions.pop(session_id, current_user.user_id)
+    if session is None:
+        if idempotency_key:
+            # A concurrent close with the same key may still be scoring the session, its response is replayed
+            async with score_cache.idempotency_guard(current_user.user_id, idempotency_key):
+                result = await score_cache.get_response(
+                    current_user.user_id, idempotency_key, get_session_submission_key(session_id)
+                )
+            if result is not None:
+                return JSONResponse(content=result, headers={"Idempotent-Replayed": "true"})
+        raise HTTPException(status_code=404, detail="Scoring session not found")
+    if session.num_frames == 0:
+        raise HTTPException(status_code=400, detail="Scoring session has no frames")
+
+    # The frames are already prepared, so only the prediction is left
+    async def prepare():
+        return session.prepared_data()
+
+    return await store_clinical_score(
+        session.exercise_id,
+        current_user,
+        session.frames[: session.num_frames],
+        prepare,
+        idempotency_key,
+        get_session_submission_key(session_id),
     )
 
-    # Update the performance count
-    if previous_entry:
-        performance_count = previous_entry.performance_count + 1
-    else:
-        performance_count = 1
-
-    # Store the clinical score in the database
-    new_clinical_score = models.ProgressTracker(
-        user_id=current_user.user_id,
-        exercise_id=exercise_id,
-        date=datetime.now(),
-        score=prediction[0],
-        performance_count=performance_count,
-    )
-    db.add(new_clinical_score)
-    db.commit()
-    db.refresh(new_clinical_score)
 
-    result = {"clinical_score": prediction.tolist()}
+@app.get("/api/progress/")
+async def progress_summary(
+    db: db_dependency,
+    current_user: CachedUser = Depends(get_current_user),
+):
+    # Count, last, best and mean score of every exercise the user performed
+    return {"exercises": await get_progress_summaries(db, current_user.user_id)}
 
-    return JSONResponse(content=result)
+
+@app.get("/api/progress/{exercise_id}/history")
+async def progress_history(
+    exercise_id: str,
+    db: db_dependency,
+    limit: int = Query(50, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    current_user: CachedUser = Depends(get_current_user),
+):
+    # Scores of the exercise, newest first; pass next_cursor back as cursor to get the next page
+    try:
+        return await get_progress_history(db, current_user.user_id, exercise_id, limit, cursor)
+    except InvalidCursor as error:
+        raise HTTPException(status_code=400, detail=str(error))
+
+
+@app.get("/api/progress/{exercise_id}/rollups")
+async def progress_rollups(
+    exercise_id: str,
+    db: db_dependency,
+    period: str = "day",
+    limit: int = Query(50, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    current_user: CachedUser = Depends(get_current_user),
+):
+    # Daily or weekly score statistics of the exercise, newest first
+    if period not in ROLLUP_PERIODS:
+        raise HTTPException(
+            status_code=400, detail=f"period must be one of: {', '.join(ROLLUP_PERIODS)}"
+        )
+    try:
+        return await get_progress_rollups(
+            db, current_user.user_id, exercise_id, period, limit, cursor
+        )
+    except InvalidCursor as error:
+        raise HTTPException(status_code=400, detail=str(error))
+
+
+@app.post("/api/admin/provision")
+async def provision_users(request: Request):
+    # Create the users of a roster csv file (username,password columns), requires the admin token
+    if ADMIN_TOKEN is None or not secrets.compare_digest(
+        request.headers.get("x-admin-token", ""), ADMIN_TOKEN
+    ):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+    try:
+        roster = read_roster((await request.body()).decode())
+    except (UnicodeDecodeError, ValueError) as error:
+        raise HTTPException(status_code=400, detail=str(error))
+
+    # Passwords are hashed by the provisioning threads and users are inserted in chunked transactions
+    return await run_in_threadpool(provision_roster, roster)
+
+
+@app.get("/api/status/models", dependencies=[Depends(require_status_token)])
+async def models_status():
+    # Load time and memory footprint of the loaded clinical score models
+    return model_registry.stats()
+
+
+@app.get("/api/status/batching", dependencies=[Depends(require_status_token)])
+async def batching_status():
+    # Pending requests and batch counts of the inference batcher
+    return inference_batcher.stats()
+
+
+@app.get("/api/status/pools", dependencies=[Depends(require_status_token)])
+async def pools_status():
+    # Queue depth and per-task timings of the worker pools
+    return {
+        "scoring": scoring_pool.stats(),
+        "feedback": feedback_pool.stats(),
+        "hashing": hashing_pool.stats(),
+    }
+
+
+@app.get("/api/status/feedback_sessions", dependencies=[Depends(require_status_token)])
+async def feedback_sessions_status():
+    # Number of open live feedback sessions
+    return feedback_sessions.stats()
+
+
+@app.get("/api/status/scoring_sessions", dependencies=[Depends(require_status_token)])
+async def scoring_sessions_status():
+    # Number of open scoring sessions
+    return scoring_sessions.stats()
+
+
+@app.get("/api/status/auth_cache", dependencies=[Depends(require_status_token)])
+async def auth_cache_status():
+    # Size and hit rate of the session token cache
+    return auth_cache.stats()
+
+
+@app.get("/api/status/catalog_cache", dependencies=[Depends(require_status_token)])
+async def catalog_cache_status():
+    # Size and hit counts of the exercise catalog cache
+    return catalog_cache.stats()
+
+
+@app.get("/api/status/score_cache", dependencies=[Depends(require_status_token)])
+async def score_cache_status():
+    # Size and hit counts of the clinical score cache, and replayed idempotent submissions
+    return score_cache.stats()
+
+
+@app.get("/api/status/progress", dependencies=[Depends(require_status_token)])
+async def progress_status():
+    # Queue depth and batch sizes of the clinical score writer
+    return progress_recorder.stats()
+
+
+@app.get("/api/status/references", dependencies=[Depends(require_status_token)])
+async def references_status():
+    # Frames and memory of the cached reference joint positions
+    return reference_cache.stats()
+
+
+@app.get("/api/status/startup", dependencies=[Depends(require_status_token)])
+async def startup_status():
+    # Durations of the startup phases and of the deferred imports
+    return {
+        "model_loading": MODEL_LOADING,
+        "db_bootstrap": DB_BOOTSTRAP,
+        "timings_seconds": dict(startup_timings),
+        "lazy_import_seconds": dict(import_seconds),
+    }
+
+
+# Queue and cache gauges, read from the status of each component when the metrics are collected
+metrics_registry.gauge(
+    "rehabai_pool_in_flight",
+    "Tasks running or waiting in each worker pool",
+    lambda: {(pool.name,): pool.in_flight for pool in (scoring_pool, feedback_pool, hashing_pool)},
+    ("pool",),
+)
+metrics_registry.gauge(
+    "rehabai_pool_rejected_total",
+    "Tasks rejected because a worker pool was full",
+    lambda: {(pool.name,): pool.rejected for pool in (scoring_pool, feedback_pool, hashing_pool)},
+    ("pool",),
+    kind="counter",
+)
+metrics_registry.gauge(
+    "rehabai_batcher_pending",
+    "Clinical score requests waiting to join a batch",
+    lambda: sum(inference_batcher.stats()["pending"].values()),
+)
+metrics_registry.gauge(
+    "rehabai_open_sessions",
+    "Open live feedback and scoring sessions",
+    lambda: {
+        ("feedback",): feedback_sessions.stats()["open_sessions"],
+        ("scoring",): scoring_sessions.stats()["open_sessions"],
+    },
+    ("kind",),
+)
+metrics_registry.gauge(
+    "rehabai_cache_entries",
+    "Entries of the session token, exercise catalog and clinical score caches",
+    lambda: {
+        ("auth",): auth_cache.stats()["size"],
+        ("catalog",): catalog_cache.stats()["size"],
+        ("score",): score_cache.stats()["size"],
+    },
+    ("cache",),
+)
+metrics_registry.gauge(
+    "rehabai_cache_hits_total",
+    "Hits of the session token, exercise catalog and clinical score caches",
+    lambda: {
+        ("auth",): auth_cache.stats()["hits"] + auth_cache.stats()["shared_hits"],
+        ("catalog",): catalog_cache.stats()["hits"],
+        ("score",): score_cache.stats()["hits"] + score_cache.stats()["disk_hits"],
+    },
+    ("cache",),
+    kind="counter",
+)
+metrics_registry.gauge(
+    "rehabai_cache_misses_total",
+    "Misses of the session token, exercise catalog and clinical score caches",
+    lambda: {
+        ("auth",): auth_cache.stats()["misses"],
+        ("catalog",): catalog_cache.stats()["misses"],
+        ("score",): score_cache.stats()["misses"],
+    },
+    ("cache",),
+    kind="counter",
+)
+metrics_registry.gauge(
+    "rehabai_progress_pending",
+    "Clinical scores waiting to be written",
+    lambda: progress_recorder.stats()["pending"],
+)
+metrics_registry.gauge(
+    "rehabai_startup_seconds",
+    "Duration of the import and startup phases of the server process",
+    lambda: {(phase,): seconds for phase, seconds in dict(startup_timings).items()},
+    ("phase",),
+)
+metrics_registry.gauge(
+    "rehabai_models_loaded",
+    "Clinical score models loaded in the server process",
+    lambda: len(model_registry.stats()["models"]),
+)
+
+
+# Metrics of the server in the Prometheus text format
+@app.get("/metrics", dependencies=[Depends(require_status_token)])
+async def metrics():
+    return PlainTextResponse(
+        metrics_registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
 
 
 @app.post("/api/logout/")
-def logout(
+async def logout(
     response: Response,
     db: db_dependency,
-    current_user: models.User = Depends(get_current_user),
+    current_user: CachedUser = Depends(get_current_user),
 ):
     # Delete the session token from the response cookie
     response.delete_cookie("session_token")
 
     # Remove the session token from the user
-    current_user.session_token = None
-    db.commit()
+    db_user = await db.get(models.User, current_user.id)
+    await auth_cache.invalidate(db_user.session_token)
+    db_user.session_token = None
+    await db.commit()
 
     return {"message": "Logout successful"}
@@ -0,0 +1,230 @@
+# Importing necessary libraries
+import bisect
+import contextvars
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Instrumentation settings
+# Level of the backend logs (DEBUG, INFO, WARNING, ERROR), messages below the level are not formatted at all
+LOG_LEVEL = os.environ.get("REHABAI_LOG_LEVEL", "INFO").upper()
+# Allow clients to ask for the stage timings of a request with the X-Profile: 1 header
+PROFILING_ENABLED = os.environ.get("REHABAI_PROFILING", "1") != "0"
+# Token required by the status endpoints and /metrics (the admin token is also accepted, they are disabled without both)
+STATUS_TOKEN = os.environ.get("REHABAI_STATUS_TOKEN") or None
+
+# Upper bounds (in seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Parent logger of every backend module
+LOGGER_NAME = "rehabai"
+
+
+# Function to set up the backend logs once per process
+def configure_logging(level=LOG_LEVEL):
+    logger = logging.getLogger(LOGGER_NAME)
+    if not logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+        logger.addHandler(handler)
+        logger.propagate = False
+    logger.setLevel(level)
+    return logger
+
+
+# Function to get the logger of a backend module
+def get_logger(name):
+    return logging.getLogger(f"{LOGGER_NAME}.{name}")
+
+
+# Function to format label values for the Prometheus text format
+def format_labels(label_names, label_values):
+    if not label_names:
+        return ""
+    pairs = []
+    for name, value in zip(label_names, label_values):
+        value = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+# Counter metric, one value per combination of labels
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, description, label_names=()):
+        self.name = name
+        self.description = description
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1.0, **labels):
+        key = tuple(labels.get(name, "") for name in self.label_names)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, key, value) for key, value in self._values.items()]
+
+    def sample_label_names(self, sample_name):
+        return self.label_names
+
+
+# Histogram metric with fixed buckets, one histogram per combination of labels
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, description, label_names=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.description = description
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets))
+        # Bucket counts (not cumulative), sum and count for each combination of labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, "") for name in self.label_names)
+        # Index of the first bucket whose upper bound is at least the value (the last bucket is +Inf)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def samples(self):
+        with self._lock:
+            values = [(key, list(counts), total, count) for key, (counts, total, count) in self._values.items()]
+        samples = []
+        for key, counts, total, count in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                samples.append((f"{self.name}_bucket", key + (le,), cumulative))
+            samples.append((f"{self.name}_sum", key, total))
+            samples.append((f"{self.name}_count", key, count))
+        return samples
+
+    def sample_label_names(self, sample_name):
+        return self.label_names + ("le",) if sample_name.endswith("_bucket") else self.label_names
+
+
+# Metric read from a function when the metrics are collected, a gauge or a counter kept by another object
+class Gauge:
+    def __init__(self, name, description, read_fn, label_names=(), kind="gauge"):
+        self.kind = kind
+        self.name = name
+        self.description = description
+        self.label_names = tuple(label_names)
+        # read_fn returns a number, or a dict of {label values tuple: number} when the gauge has labels
+        self.read_fn = read_fn
+
+    def samples(self):
+        values = self.read_fn()
+        if not isinstance(values, dict):
+            values = {(): values}
+        return [(self.name, key, value) for key, value in values.items()]
+
+    def sample_label_names(self, sample_name):
+        return self.label_names
+
+
+# Registry of every metric of the process, rendered in the Prometheus text format
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, description, label_names=()):
+        return self._register(Counter(name, description, label_names))
+
+    def histogram(self, name, description, label_names=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(name, description, label_names, buckets))
+
+    def gauge(self, name, description, read_fn, label_names=(), kind="gauge"):
+        return self._register(Gauge(name, description, read_fn, label_names, kind))
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            try:
+                samples = metric.samples()
+            except Exception as error:
+                logger.warning("failed to collect metric %s: %s", metric.name, error)
+                continue
+            lines.append(f"# HELP {metric.name} {metric.description}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for sample_name, label_values, value in samples:
+                label_names = metric.sample_label_names(sample_name)
+                lines.append(f"{sample_name}{format_labels(label_names, label_values)} {float(value)!r}")
+        return "\n".join(lines) + "\n"
+
+
+# Logs are set up as soon as a module asks for its logger
+configure_logging()
+logger = get_logger(__name__)
+
+# Registry shared by the whole process
+metrics_registry = MetricsRegistry()
+
+# Duration of the stages of the scoring and feedback pipeline
+stage_duration = metrics_registry.histogram(
+    "rehabai_stage_duration_seconds",
+    "Duration of the stages of the scoring and feedback pipeline",
+    ("stage", "exercise_id"),
+)
+
+# Stage timings of the request being profiled, None when the request is not profiled
+current_profile = contextvars.ContextVar("current_profile", default=None)
+
+
+# Stage timings of one profiled request
+class RequestProfile:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.stages = []
+
+    def add(self, stage, seconds):
+        self.stages.append((stage, seconds))
+
+    def server_timing(self):
+        # Server-Timing header value, durations in milliseconds
+        entries = [f"{stage};dur={seconds * 1000:.2f}" for stage, seconds in self.stages]
+        entries.append(f"total;dur={(time.perf_counter() - self.start) * 1000:.2f}")
+        return ", ".join(entries)
+
+
+# Function to record the duration of a stage in the stage histogram and in the profile of the current request,
+# if it is profiled
+def record_stage(stage, seconds, exercise_id=""):
+    stage_duration.observe(seconds, stage=stage, exercise_id=exercise_id)
+    profile = current_profile.get()
+    if profile is not None:
+        profile.add(stage, seconds)
+
+
+# Context manager timing a stage of the pipeline
+@contextmanager
+def span(stage, exercise_id=""):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - start, exercise_id)
@@ -0,0 +1,103 @@
+# Importing necessary libraries
+from datetime import datetime
+
+from sqlalchemy import text
+
+from database import engine
+from metrics import get_logger
+import models
+from progress_rollups import rebuild_rollups
+
+logger = get_logger(__name__)
+
+
+# Migration 1: indexes for the assignment check and the latest progress entry of a user and exercise
+def add_assignment_and_progress_indexes(connection):
+    connection.execute(
+        text(
+            "CREATE INDEX IF NOT EXISTS ix_assigned_exercises_user_exercise "
+            "ON assigned_exercises (user_id, exercise_id)"
+        )
+    )
+    connection.execute(
+        text(
+            "CREATE INDEX IF NOT EXISTS ix_progress_tracker_user_exercise_date "
+            "ON progress_tracker (user_id, exercise_id, date DESC)"
+        )
+    )
+    # Refresh the query planner statistics so the new indexes are used
+    connection.execute(text("ANALYZE"))
+
+
+# Migration 2: progress summary of every user and exercise, filled from the existing progress history
+def add_progress_summary(connection):
+    models.ProgressSummary.__table__.create(connection, checkfirst=True)
+    connection.execute(text("DELETE FROM progress_summary"))
+    connection.execute(
+        text(
+            "INSERT INTO progress_summary "
+            "(user_id, exercise_id, performance_count, last_score, best_score, mean_score, last_date) "
+            "SELECT history.user_id, history.exercise_id, latest.performance_count, latest.score, "
+            "MAX(history.score), AVG(history.score), latest.date "
+            "FROM progress_tracker AS history "
+            "JOIN progress_tracker AS latest ON latest.id = ("
+            "  SELECT id FROM progress_tracker AS entry "
+            "  WHERE entry.user_id = history.user_id AND entry.exercise_id = history.exercise_id "
+            "  ORDER BY entry.date DESC LIMIT 1"
+            ") "
+            "GROUP BY history.user_id, history.exercise_id, latest.performance_count, latest.score, latest.date"
+        )
+    )
+
+
+# Migration 3: daily and weekly rollups of the scores, computed from the existing progress history
+def add_progress_rollups(connection):
+    models.ProgressRollup.__table__.create(connection, checkfirst=True)
+    rebuild_rollups(connection)
+
+
+# Schema migrations in the order they are applied: (version, description, function)
+# Migrations must be idempotent, they also run on databases whose tables were just created with the latest schema
+MIGRATIONS = [
+    (1, "Add assignment and progress indexes", add_assignment_and_progress_indexes),
+    (2, "Add progress summary", add_progress_summary),
+    (3, "Add progress rollups", add_progress_rollups),
+]
+
+
+# Function to get the schema version of the database (0 for databases created before migrations existed)
+def get_schema_version(connection):
+    connection.execute(
+        text(
+            "CREATE TABLE IF NOT EXISTS schema_version "
+            "(version INTEGER PRIMARY KEY, description VARCHAR, applied_at DATETIME)"
+        )
+    )
+    return connection.execute(text("SELECT MAX(version) FROM schema_version")).scalar() or 0
+
+
+# Function to apply the pending migrations, each one in its own transaction
+def run_migrations(bind=engine):
+    with bind.begin() as connection:
+        current_version = get_schema_version(connection)
+
+    applied = []
+    for version, description, migrate in MIGRATIONS:
+        if version <= current_version:
+            continue
+        with bind.begin() as connection:
+            migrate(connection)
+            connection.execute(
+                text(
+                    "INSERT INTO schema_version (version, description, applied_at) "
+                    "VALUES (:version, :description, :applied_at)"
+                ),
+                {"version": version, "description": description, "applied_at": datetime.now()},
+            )
+        logger.info("applied migration %s: %s", version, description)
+        applied.append(version)
+    return applied
+
+
+if __name__ == "__main__":
+    run_migrations()
@@ -1,7 +1,9 @@
 # Importing necessary libraries
 import pandas as pd
 import numpy as np
-from joint_features import get_es1_features
+from io import StringIO
+from joint_features import FEATURE_REGISTRY, get_joint_array
+from metrics import span
 
 
 # Function to get dataframe columns
@@ -37,90 +39,176 @@ def get_dataframe_cols():
     return df_cols
 
 
+# Preprocessing settings of each exercise, matching the training configuration of its model
+PREPROCESSING_CONFIG = {
+    "Es1": {
+        "use_joint_positions": False,
+        "use_joint_features": True,
+        "smooth_joint_features": True,
+        "smoothing_window": 10,
+        "max_length": 1515,
+    },
+    "Es2": {
+        "use_joint_positions": True,
+        "max_length": 1668,
+    },
+    "Es3": {
+        "use_joint_positions": True,
+        "smooth_joint_positions": True,
+        "smoothing_window": 10,
+        "max_length": 1518,
+    },
+    "Es4": {
+        "use_joint_positions": True,
+        "max_length": 1988,
+    },
+    "Es5": {
+        "use_joint_positions": True,
+        "smooth_joint_positions": True,
+        "smoothing_window": 5,
+        "max_length": 1022,
+    },
+}
+
+# Maximum sequence length (in frames) each exercise model was trained with
+MAX_LENGTH_MAPPING = {
+    exercise_id: config["max_length"] for exercise_id, config in PREPROCESSING_CONFIG.items()
+}
+
+# Only the first MAX_FRAMES frames of a session are used
+MAX_FRAMES = 600
+
 # Get all the columns from the dataframe
 all_cols = get_dataframe_cols()
 # Define the columns to be dropped
 cols_drop = all_cols[:15]
 
+
+# Function to compute the moving average over the last `window` rows of each column, like pandas rolling(window).mean()
+def moving_average(values, window, out):
+    # The first window - 1 rows and the windows containing NaN values have no average
+    num_rows = len(values)
+    out[: min(window - 1, num_rows)] = np.nan
+    if num_rows < window:
+        return out
+
+    missing = np.isnan(values)
+    # Running sums are accumulated in float64 so the averages match pandas
+    cumulative = np.zeros((num_rows + 1, values.shape[1]))
+    np.cumsum(np.where(missing, 0.0, values), axis=0, out=cumulative[1:])
+    out[window - 1 :] = (cumulative[window:] - cumulative[:-window]) / window
+
+    if missing.any():
+        missing_counts = np.zeros((num_rows + 1, values.shape[1]))
+        np.cumsum(missing, axis=0, out=missing_counts[1:])
+        out[window - 1 :][missing_counts[window:] - missing_counts[:-window] > 0] = np.nan
+    return out
+
+
+# Preprocessing pipeline of one exercise, compiled once from its configuration
+class PreprocessingPipeline:
+    def __init__(
+        self,
+        exercise_id,
+        max_length,
+        use_joint_positions=False,
+        use_joint_features=False,
+        smooth_joint_positions=False,
+        smooth_joint_features=False,
+        smoothing_window=10,
+    ):
+        self.exercise_id = exercise_id
+        self.max_length = max_length
+        self.smoothing_window = smoothing_window
+        # Joint positions are every column except the face keypoints
+        self.position_indices = (
+            np.array([all_cols.index(col) for col in all_cols if col not in cols_drop])
+            if use_joint_positions
+            else None
+        )
+        self.smooth_joint_positions = smooth_joint_positions
+        self.feature_set = FEATURE_REGISTRY[exercise_id] if use_joint_features else None
+        self.smooth_joint_features = smooth_joint_features
+
+        num_positions = 0 if self.position_indices is None else len(self.position_indices)
+        num_joint_features = 0 if self.feature_set is None else len(self.feature_set.names)
+        self.num_features = num_positions + num_joint_features
+        if self.num_features == 0:
+            raise ValueError(f"Exercise {exercise_id} uses neither joint positions nor joint features")
+
+    def _write(self, values, smooth, out):
+        if smooth:
+            moving_average(values, self.smoothing_window, out)
+        else:
+            out[:] = values
+
+    # Function to prepare rows [start, len(frames)) of the joint positions frames into out, an array of shape
+    # (len(frames) - start, num_features). Rows before start are only read for the smoothing window, so a
+    # growing session can be prepared a few frames at a time with the same result as a single run.
+    def prepare_rows(self, frames, start, out):
+        smooth = self.smooth_joint_positions or self.smooth_joint_features
+        history = max(0, start - self.smoothing_window + 1) if smooth else start
+        frames = frames[history:]
+        # Rows before start are prepared into a scratch buffer and dropped
+        prepared = out if history == start else np.empty((len(frames), self.num_features), dtype=out.dtype)
+
+        # Joint positions first then joint features
+        column = 0
+        if self.position_indices is not None:
+            positions = frames[:, self.position_indices]
+            self._write(positions, self.smooth_joint_positions, prepared[:, : positions.shape[1]])
+            column = positions.shape[1]
+        if self.feature_set is not None:
+            joint_features = self.feature_set.compute(get_joint_array(frames))
+            self._write(joint_features, self.smooth_joint_features, prepared[:, column:])
+
+        if prepared is not out:
+            out[:] = prepared[start - history :]
+        # Replace NaN values with numerical equivalents
+        np.nan_to_num(out, copy=False)
+        return out
+
+    # Function to prepare the joint positions frames, an array of shape (frames, 51) ordered like
+    # get_dataframe_cols. Returns data of shape (1, max_length, num_features) and the padding mask of shape
+    # (1, max_length), which can be written into preallocated buffers of those shapes.
+    def run(self, frames, max_length=None, out_data=None, out_padding_mask=None):
+        max_length = max_length or self.max_length
+        frames = frames[:MAX_FRAMES]
+        live_video_frames = len(frames)
+
+        if out_data is None:
+            out_data = np.zeros((1, max_length, self.num_features), dtype=np.float32)
+        else:
+            out_data[:, live_video_frames:] = 0
+        if out_padding_mask is None:
+            out_padding_mask = np.empty((1, max_length), dtype=np.float32)
+
+        # Write the data into the padded buffer
+        self.prepare_rows(frames, 0, out_data[0, :live_video_frames])
+
+        # Set padding elements to 1
+        out_padding_mask[:, :live_video_frames] = 0
+        out_padding_mask[:, live_video_frames:] = 1
+
+        return (out_data, out_padding_mask)
+
+
+# Pipelines of every exercise, compiled once
+PIPELINES = {
+    exercise_id: PreprocessingPipeline(exercise_id, **config)
+    for exercise_id, config in PREPROCESSING_CONFIG.items()
+}
+
+
+# Function to prepare joint positions frames (array of shape (frames, 51) ordered like get_dataframe_cols) for the model
+def prepare_array(frames, exercise_id, max_length=None):
+    return PIPELINES[exercise_id].run(frames, max_length)
+
+
 # Function to prepare the data for machine learning model
 def prepare_data(df, max_length, exercise_id):
-    df = df.head(600)
-    live_video_frames = df.shape[0]
-
-    # Settings for training configuration
-    smoothing_window=10
-    use_joint_positions=False
-    use_joint_features=False
-    smooth_joint_positions=False
-    smooth_joint_features=False
-    
-    if exercise_id == "Es1":
-        use_joint_features=True
-        smooth_joint_features=True
-        smoothing_window=10
-    
-    elif exercise_id == "Es2":
-        use_joint_positions=True
-
-    elif exercise_id == "Es3":
-        use_joint_positions=True
-        smooth_joint_positions=True
-        smoothing_window=10
-    
-    elif exercise_id == "Es4":
-        use_joint_positions=True
-
-    elif exercise_id == "Es5":
-        use_joint_positions=True
-        smooth_joint_positions=True
-        smoothing_window=5
-
-        
-    data = []
-    padding_masks = []
-    joint_positions_data = None
-    # Load joint positions data if needed
-    if use_joint_positions:
-        joint_positions_data = df
-        joint_positions_data = joint_positions_data.drop(cols_drop, axis=1)
-        if smooth_joint_positions:
-            for col in joint_positions_data.columns:
-                joint_positions_data[col] = joint_positions_data[col].rolling(smoothing_window).mean()
-        joint_positions_data = joint_positions_data.to_numpy()
-
-    joint_features_data = None
-    # Load joint features data if needed
-    if use_joint_features:
-        joint_features_data = get_es1_features(df)
-        if smooth_joint_features:
-            for col in joint_features_data.columns:
-                joint_features_data[col] = joint_features_data[col].rolling(smoothing_window).mean()
-        joint_features_data = joint_features_data.to_numpy()
-
-    data_to_use = None
-    # Combine data if both are needed
-    if use_joint_positions:
-        data_to_use = joint_positions_data
-    else:
-        data_to_use = joint_features_data
-
-    # Pad data to fixed length and create padding masks
-    padding_length = max_length - live_video_frames
-    padding_mask = np.zeros((live_video_frames + padding_length))
-    padding_mask[-padding_length:] = 1 # Set padding elements to 1
-
-    # Pad data with zeros
-    data_to_use_padded = np.pad(data_to_use, ((0, padding_length), (0, 0)), mode='constant', constant_values=0)
-
-    data.append(data_to_use_padded)
-    padding_masks.append(padding_mask)
-        
-    data = np.array(data)
-    padding_masks = np.array(padding_masks)
-
-    data = np.nan_to_num(data) # Replace NaN values with numerical equivalents
-
-    return (data, padding_masks)
+    frames = df.head(MAX_FRAMES).reindex(columns=all_cols).to_numpy(dtype=np.float32)
+    return prepare_array(frames, exercise_id, max_length)
 
 
 # Function to reorder the columns of the dataframe
@@ -130,3 +218,19 @@ def reorder_dataframe(df):
     # Reorder the columns of the dataframe
     df = df.reindex(columns=df_cols)
     return df
+
+
+# Function to read the frames used by the model (at most MAX_FRAMES) from the csv string sent by the client,
+# as a float32 array of shape (frames, 51) ordered like get_dataframe_cols
+def load_csv_frames(csv_string, exercise_id):
+    with span("csv_parse", exercise_id):
+        raw_data = pd.read_csv(StringIO(csv_string), sep=",")
+    with span("reorder_dataframe", exercise_id):
+        return reorder_dataframe(raw_data.head(MAX_FRAMES)).to_numpy(dtype=np.float32)
+
+
+# Function to prepare the data for the model from the csv string sent by the client
+def prepare_csv_data(csv_string, max_length, exercise_id):
+    frames = load_csv_frames(csv_string, exercise_id)
+    with span("prepare_data", exercise_id):
+        return prepare_array(frames, exercise_id, max_length)
@@ -0,0 +1,232 @@
+# Export of the clinical score models to TFLite, served by tflite_backend.py
+# Every exported model has a "full" signature running the whole input and one "bucket_<k>" signature per number of
+# active windows (see bucketed_inference.py), so short sessions only run the transformer encoder on their frames.
+# Usage (from the backend directory): python model_export.py [--exercises Es1 Es4] [--quantization dynamic] [--report]
+import argparse
+import gc
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from bucketed_inference import BucketedModel, UnsupportedModelError
+from metrics import get_logger
+from ml_wrapper import MAX_FRAMES, MAX_LENGTH_MAPPING, prepare_array
+from model_registry import MODEL_PATHS, MODELS_DIRECTORY, load_keras_model, warm_up_model
+from reference_cache import ReferenceCache
+from tflite_backend import BUCKET_SIGNATURE_PREFIX, FULL_SIGNATURE, TFLiteModel, get_tflite_path
+
+logger = get_logger(__name__)
+
+# Quantization of the exported weights:
+#   none: float32 weights and activations
+#   dynamic: int8 weights, float activations (dynamic range quantization)
+#   int8: int8 weights and activations calibrated on the reference sessions, float inputs and outputs
+QUANTIZATIONS = ["none", "dynamic", "int8"]
+
+# Session lengths (in frames) cut from the references for the int8 calibration and the parity report
+REPORT_LENGTHS = [60, 150, 300, 450, MAX_FRAMES]
+# Timed predictions per session length in the report
+REPORT_REPEATS = 20
+# Largest score difference with the Keras model accepted by the report
+PARITY_TOLERANCE = 1e-3
+
+
+# Function to build the serving signatures of a Keras model
+def get_serving_signatures(model, exercise_id):
+    max_length = MAX_LENGTH_MAPPING[exercise_id]
+    num_features = model.inputs[0].shape[-1]
+
+    @tf.function(
+        input_signature=[
+            tf.TensorSpec((None, max_length, num_features), tf.float32),
+            tf.TensorSpec((None, max_length), tf.float32),
+        ]
+    )
+    def full(data, padding_masks):
+        return model([data, padding_masks], training=False)
+
+    signatures = {FULL_SIGNATURE: full.get_concrete_function()}
+    try:
+        bucketed_model = BucketedModel(model, max_length)
+    except UnsupportedModelError as error:
+        logger.warning("exporting %s without bucketed signatures: %s", exercise_id, error)
+        return signatures
+    # The last bucket covers the whole input, which the full signature already runs
+    for active_windows in range(1, min(bucketed_model.max_active_windows, bucketed_model.num_windows - 1) + 1):
+        function = bucketed_model._get_function(active_windows)
+        signatures[f"{BUCKET_SIGNATURE_PREFIX}{active_windows}"] = function.get_concrete_function()
+    return signatures
+
+
+# Function to get the prepared reference sessions of an exercise, cut at each of the given lengths
+def get_reference_sessions(exercise_id, reference_cache, lengths=REPORT_LENGTHS):
+    frames = reference_cache.get(exercise_id)
+    max_length = MAX_LENGTH_MAPPING[exercise_id]
+    return [
+        (length, *prepare_array(frames[:length], exercise_id, max_length))
+        for length in sorted({min(length, len(frames)) for length in lengths})
+    ]
+
+
+# Function to build the int8 calibration data, every signature is calibrated on the sessions it serves
+def get_representative_dataset(signatures, sessions):
+    def representative_dataset():
+        for signature, function in signatures.items():
+            active_length = function.structured_input_signature[0][0].shape[1]
+            for _, data, padding_masks in sessions:
+                if signature != FULL_SIGNATURE and np.any(padding_masks[:, active_length:] == 0):
+                    continue
+                yield signature, {"data": data[:, :active_length], "padding_masks": padding_masks[:, :active_length]}
+
+    return representative_dataset
+
+
+# Function to convert the Keras model of an exercise to a TFLite flatbuffer
+def convert_model(model, exercise_id, quantization="none", reference_cache=None):
+    signatures = get_serving_signatures(model, exercise_id)
+    # Converting from a SavedModel keeps the name of every signature
+    module = tf.Module()
+    module.model = model
+    with tempfile.TemporaryDirectory() as saved_model_directory:
+        tf.saved_model.save(module, saved_model_directory, signatures=signatures)
+        converter = tf.lite.TFLiteConverter.from_saved_model(saved_model_directory, signature_keys=list(signatures))
+        if quantization != "none":
+            converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        if quantization == "int8":
+            sessions = get_reference_sessions(exercise_id, reference_cache or ReferenceCache())
+            converter.representative_dataset = get_representative_dataset(signatures, sessions)
+        return converter.convert()
+
+
+# Function to export the model of an exercise next to its Keras file, returns the TFLite file path
+def export_model(exercise_id, models_directory=MODELS_DIRECTORY, quantization="none", reference_cache=None):
+    path = os.path.join(models_directory, MODEL_PATHS[exercise_id])
+    model = load_keras_model(path)
+    start = time.perf_counter()
+    content = convert_model(model, exercise_id, quantization, reference_cache)
+    tflite_path = get_tflite_path(path)
+    # Write to a temporary file first so a running server never reloads a partially written model
+    temporary_path = f"{tflite_path}.tmp"
+    with open(temporary_path, "wb") as model_file:
+        model_file.write(content)
+    os.replace(temporary_path, tflite_path)
+    logger.info(
+        "exported %s to %s (%s quantization, %.1f MB) in %.1fs",
+        exercise_id,
+        tflite_path,
+        quantization,
+        len(content) / 1024 / 1024,
+        time.perf_counter() - start,
+    )
+    return tflite_path
+
+
+# Function to get the resident memory of the process in bytes (the peak resident memory outside Linux)
+def get_rss_bytes():
+    gc.collect()
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * resource.getpagesize()
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+# Function to get the median latency of a prediction in milliseconds
+def median_latency_ms(fn, repeats=REPORT_REPEATS):
+    fn()
+    latencies = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - start)
+    return float(np.median(latencies) * 1000)
+
+
+# Function to compare the exported model of an exercise with its Keras model on the reference sessions
+def parity_report(exercise_id, models_directory=MODELS_DIRECTORY, reference_cache=None, repeats=REPORT_REPEATS):
+    path = os.path.join(models_directory, MODEL_PATHS[exercise_id])
+    reference_cache = reference_cache or ReferenceCache()
+
+    # Memory taken by each model once loaded and run on an empty session
+    rss_before = get_rss_bytes()
+    tflite_model = TFLiteModel(get_tflite_path(path))
+    tflite_model.warm_up()
+    tflite_rss = get_rss_bytes() - rss_before
+    rss_before = get_rss_bytes()
+    model = load_keras_model(path)
+    warm_up_model(model, exercise_id)
+    keras_rss = get_rss_bytes() - rss_before
+
+    sessions = []
+    for length, data, padding_masks in get_reference_sessions(exercise_id, reference_cache):
+        keras_score = model.predict([data, padding_masks], verbose=0)
+        tflite_score = tflite_model.predict(data, padding_masks)
+        sessions.append(
+            {
+                "frames": length,
+                "keras_score": float(keras_score[0, 0]),
+                "tflite_score": float(tflite_score[0, 0]),
+                "abs_difference": float(np.max(np.abs(tflite_score - keras_score))),
+                "keras_p50_ms": median_latency_ms(lambda: model.predict([data, padding_masks], verbose=0), repeats),
+                "tflite_p50_ms": median_latency_ms(lambda: tflite_model.predict(data, padding_masks), repeats),
+            }
+        )
+
+    return {
+        "exercise_id": exercise_id,
+        "max_abs_difference": max(session["abs_difference"] for session in sessions),
+        "keras_weights_bytes": int(sum(np.prod(weight.shape) * weight.dtype.size for weight in model.weights)),
+        "keras_file_bytes": os.path.getsize(path),
+        "tflite_file_bytes": tflite_model.memory_bytes(),
+        "keras_rss_bytes": keras_rss,
+        "tflite_rss_bytes": tflite_rss,
+        "sessions": sessions,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the clinical score models to TFLite")
+    parser.add_argument("--exercises", nargs="+", default=list(MODEL_PATHS), help="Exercises to export")
+    parser.add_argument("--models-directory", default=MODELS_DIRECTORY, help="Directory of the Keras models")
+    parser.add_argument("--quantization", choices=QUANTIZATIONS, default="none", help="Quantization of the weights")
+    parser.add_argument("--report", action="store_true", help="Compare the exported models with the Keras models")
+    parser.add_argument("--tolerance", type=float, default=PARITY_TOLERANCE, help="Largest accepted score difference")
+    parser.add_argument("--report-output", help="Path of the json report file")
+    args = parser.parse_args()
+
+    reference_cache = ReferenceCache()
+    for exercise_id in args.exercises:
+        export_model(exercise_id, args.models_directory, args.quantization, reference_cache)
+
+    if args.report:
+        reports = [parity_report(exercise_id, args.models_directory, reference_cache) for exercise_id in args.exercises]
+        print(
+            f"{'exercise':>8} {'frames':>7} {'keras score':>12} {'tflite score':>13} {'abs diff':>9} "
+            f"{'keras p50 (ms)':>15} {'tflite p50 (ms)':>16}"
+        )
+        for report in reports:
+            for session in report["sessions"]:
+                print(
+                    f"{report['exercise_id']:>8} {session['frames']:>7} {session['keras_score']:>12.5f} "
+                    f"{session['tflite_score']:>13.5f} {session['abs_difference']:>9.2e} "
+                    f"{session['keras_p50_ms']:>15.2f} {session['tflite_p50_ms']:>16.2f}"
+                )
+        print(f"{'exercise':>8} {'keras weights (MB)':>19} {'tflite file (MB)':>17} {'keras rss (MB)':>15} {'tflite rss (MB)':>16}")
+        for report in reports:
+            print(
+                f"{report['exercise_id']:>8} {report['keras_weights_bytes'] / 2**20:>19.2f} "
+                f"{report['tflite_file_bytes'] / 2**20:>17.2f} {report['keras_rss_bytes'] / 2**20:>15.1f} "
+                f"{report['tflite_rss_bytes'] / 2**20:>16.1f}"
+            )
+        if args.report_output:
+            with open(args.report_output, "w") as report_file:
+                json.dump({"quantization": args.quantization, "exercises": reports}, report_file, indent=2)
+        failed = [report["exercise_id"] for report in reports if report["max_abs_difference"] > args.tolerance]
+        if failed:
+            sys.exit(f"exported scores of {', '.join(failed)} differ from the Keras model by more than {args.tolerance}")
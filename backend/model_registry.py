@@ -0,0 +1,331 @@
+# Importing necessary libraries
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from bucketed_inference import BUCKETED_INFERENCE, load_bucketed_model
+from lazy_imports import lazy_import
+from metrics import get_logger, span
+from ml_wrapper import MAX_LENGTH_MAPPING
+from tflite_backend import TFLiteModel, get_tflite_path
+
+logger = get_logger(__name__)
+
+# TensorFlow is only imported when the first Keras model is loaded
+tf = lazy_import("tensorflow")
+keras_nlp = lazy_import("keras_nlp")
+
+# Directory containing the trained clinical score models
+MODELS_DIRECTORY = os.environ.get("REHABAI_MODELS_DIR", "models/")
+
+# Model file for each exercise
+MODEL_PATHS = {
+    "Es1": "ml_model_Es1.h5",
+    "Es2": "ml_model_Es2.h5",
+    "Es3": "ml_model_Es3.h5",
+    "Es4": "ml_model_Es4.h5",
+    "Es5": "ml_model_Es5.h5",
+}
+
+# Registry settings
+# "background" loads every model in a thread while the API already serves requests, "eager" loads every model
+# before serving, "lazy" loads a model on its first request
+MODEL_LOADING = os.environ.get("REHABAI_MODEL_LOADING", "background")
+# Maximum number of models kept in memory (least recently used models are evicted first)
+MODEL_CACHE_SIZE = int(os.environ.get("REHABAI_MODEL_CACHE_SIZE", len(MODEL_PATHS)))
+# Memory budget for the loaded model weights in MB (0 means no budget)
+MODEL_MEMORY_BUDGET_MB = float(os.environ.get("REHABAI_MODEL_MEMORY_BUDGET_MB", 0))
+# Run a dummy prediction after loading so the first real request does not pay for graph tracing
+MODEL_WARMUP = os.environ.get("REHABAI_MODEL_WARMUP", "1") == "1"
+# Minimum number of seconds between two checks of a model file's modification time
+MODEL_RELOAD_CHECK_SECONDS = float(os.environ.get("REHABAI_MODEL_RELOAD_CHECK_SECONDS", 5))
+# Backend running the models: "keras" (the .h5 files) or "tflite" (the .tflite files written by model_export.py),
+# for every exercise, per exercise, or both with the later entries winning, e.g. "tflite,Es4=keras"
+MODEL_BACKEND = os.environ.get("REHABAI_MODEL_BACKEND", "keras")
+# Threads used by TensorFlow inside one operation and to run independent operations (0 lets TensorFlow decide)
+TF_INTRA_OP_THREADS = int(os.environ.get("REHABAI_TF_INTRA_OP_THREADS", 0))
+TF_INTER_OP_THREADS = int(os.environ.get("REHABAI_TF_INTER_OP_THREADS", 0))
+
+MODEL_BACKENDS = ["keras", "tflite"]
+
+
+# Function to parse the backend setting into the backend of each exercise
+def parse_model_backends(setting, exercise_ids):
+    backends = dict.fromkeys(exercise_ids, "keras")
+    for item in filter(None, (item.strip() for item in setting.split(","))):
+        exercise_id, _, backend = item.rpartition("=")
+        if backend not in MODEL_BACKENDS:
+            raise ValueError(f"Unknown model backend {backend}, expected one of {MODEL_BACKENDS}")
+        if not exercise_id:
+            backends = dict.fromkeys(exercise_ids, backend)
+        elif exercise_id in backends:
+            backends[exercise_id] = backend
+        else:
+            raise ValueError(f"No model registered for exercise {exercise_id}")
+    return backends
+
+
+# Function to set the TensorFlow thread pools, which can only be done before TensorFlow runs its first operation
+# (setting the same values again is allowed)
+def configure_tf_threads(intra_op_threads=TF_INTRA_OP_THREADS, inter_op_threads=TF_INTER_OP_THREADS):
+    try:
+        if intra_op_threads:
+            tf.config.threading.set_intra_op_parallelism_threads(intra_op_threads)
+        if inter_op_threads:
+            tf.config.threading.set_inter_op_parallelism_threads(inter_op_threads)
+    except RuntimeError as error:
+        logger.warning("TensorFlow thread settings ignored: %s", error)
+
+
+# Holds a loaded model together with its bookkeeping information
+class LoadedModel:
+    def __init__(
+        self, exercise_id, model, path, mtime, load_seconds, warmup_seconds, bucketed_model=None, backend="keras"
+    ):
+        self.exercise_id = exercise_id
+        self.model = model
+        self.backend = backend
+        # Bucketed variant of the model, None when bucketed inference is disabled or not supported by the model
+        self.bucketed_model = bucketed_model
+        self.path = path
+        self.mtime = mtime
+        self.load_seconds = load_seconds
+        self.warmup_seconds = warmup_seconds
+        self.memory_bytes = model.memory_bytes() if backend == "tflite" else get_model_memory_bytes(model)
+        self.loaded_at = time.time()
+        self.checked_at = time.monotonic()
+        self.hits = 0
+
+
+# Function to get the memory used by the weights of a model
+def get_model_memory_bytes(model):
+    return int(sum(np.prod(weight.shape) * weight.dtype.size for weight in model.weights))
+
+
+# Function to load a Keras model file (also used by model_export.py)
+def load_keras_model(path):
+    # Importing keras_nlp registers the TransformerEncoder layer so the saved models can be deserialized
+    keras_nlp.layers.TransformerEncoder
+    return tf.keras.models.load_model(path, compile=False)
+
+
+# Function to run a dummy prediction so the model graph is built before the first request
+def warm_up_model(model, exercise_id):
+    max_length = MAX_LENGTH_MAPPING[exercise_id]
+    num_features = model.inputs[0].shape[-1]
+    dummy_data = np.zeros((1, max_length, num_features), dtype=np.float32)
+    dummy_padding_mask = np.ones((1, max_length), dtype=np.float32)
+    model.predict([dummy_data, dummy_padding_mask], verbose=0)
+
+
+# Process-wide registry of the clinical score models
+class ModelRegistry:
+    def __init__(
+        self,
+        models_directory=MODELS_DIRECTORY,
+        model_paths=MODEL_PATHS,
+        cache_size=MODEL_CACHE_SIZE,
+        memory_budget_mb=MODEL_MEMORY_BUDGET_MB,
+        warmup=MODEL_WARMUP,
+        reload_check_seconds=MODEL_RELOAD_CHECK_SECONDS,
+        bucketed_inference=BUCKETED_INFERENCE,
+        backend=MODEL_BACKEND,
+    ):
+        self.models_directory = models_directory
+        self.model_paths = model_paths
+        self.cache_size = max(1, cache_size)
+        self.memory_budget_bytes = memory_budget_mb * 1024 * 1024
+        self.warmup = warmup
+        self.reload_check_seconds = reload_check_seconds
+        self.bucketed_inference = bucketed_inference
+        self.backends = parse_model_backends(backend, model_paths)
+        # Loaded models ordered from least to most recently used
+        self._models = OrderedDict()
+        self._lock = threading.Lock()
+        # One lock per exercise so a slow load does not block requests for other exercises
+        self._load_locks = {exercise_id: threading.Lock() for exercise_id in model_paths}
+        self.evictions = 0
+        self.reloads = 0
+
+    def get_model_path(self, exercise_id):
+        path = os.path.join(self.models_directory, self.model_paths[exercise_id])
+        return get_tflite_path(path) if self.backends[exercise_id] == "tflite" else path
+
+    def preload(self):
+        # Load every model whose file is available
+        for exercise_id in self.model_paths:
+            if not os.path.exists(self.get_model_path(exercise_id)):
+                logger.warning("model file for %s not found, skipping preload", exercise_id)
+                continue
+            self.get(exercise_id)
+
+    def get(self, exercise_id):
+        return self.get_entry(exercise_id).model
+
+    def get_entry(self, exercise_id):
+        if exercise_id not in self.model_paths:
+            raise KeyError(f"No model registered for exercise {exercise_id}")
+
+        entry = self._lookup(exercise_id)
+        if entry is not None and not self._is_stale(entry):
+            entry.hits += 1
+            return entry
+
+        # Only one thread loads a given model, the others wait and reuse its result
+        with self._load_locks[exercise_id]:
+            # Another thread may have loaded or reloaded the model while we were waiting
+            current = self._lookup(exercise_id)
+            if current is not None and current is not entry:
+                current.hits += 1
+                return current
+
+            new_entry = self._load(exercise_id)
+            with self._lock:
+                if current is not None:
+                    self.reloads += 1
+                self._models[exercise_id] = new_entry
+                self._models.move_to_end(exercise_id)
+                self._evict()
+            new_entry.hits += 1
+            return new_entry
+
+    # Function to get the version of the model scoring an exercise (backend and model file modification time)
+    def get_version(self, exercise_id):
+        with self._lock:
+            entry = self._models.get(exercise_id)
+        if entry is not None:
+            return f"{entry.backend}:{entry.mtime}"
+        # The model is not loaded yet, it will be loaded from the current file
+        try:
+            mtime = os.path.getmtime(self.get_model_path(exercise_id))
+        except OSError:
+            mtime = None
+        return f"{self.backends[exercise_id]}:{mtime}"
+
+    def _lookup(self, exercise_id):
+        with self._lock:
+            entry = self._models.get(exercise_id)
+            if entry is not None:
+                self._models.move_to_end(exercise_id)
+            return entry
+
+    def _is_stale(self, entry):
+        # Check the file's modification time at most once every reload_check_seconds
+        now = time.monotonic()
+        if now - entry.checked_at < self.reload_check_seconds:
+            return False
+        entry.checked_at = now
+        try:
+            mtime = os.path.getmtime(entry.path)
+        except OSError:
+            # Keep serving the loaded model if the file is being replaced
+            return False
+        return mtime != entry.mtime
+
+    def _load(self, exercise_id):
+        path = self.get_model_path(exercise_id)
+        mtime = os.path.getmtime(path)
+
+        backend = self.backends[exercise_id]
+        logger.info("starting %s model load for %s", backend, exercise_id)
+        start = time.perf_counter()
+        if backend == "tflite":
+            # The exported model has its own bucketed signatures, see model_export.py
+            with span("model_load", exercise_id):
+                model = TFLiteModel(path)
+            load_seconds = time.perf_counter() - start
+            warmup_seconds = 0.0
+            if self.warmup:
+                start = time.perf_counter()
+                with span("model_warmup", exercise_id):
+                    model.warm_up()
+                warmup_seconds = time.perf_counter() - start
+            logger.info("finished model load for %s in %.2fs", exercise_id, load_seconds)
+            return LoadedModel(exercise_id, model, path, mtime, load_seconds, warmup_seconds, backend=backend)
+
+        with span("model_load", exercise_id):
+            configure_tf_threads()
+            model = load_keras_model(path)
+        load_seconds = time.perf_counter() - start
+
+        warmup_seconds = 0.0
+        if self.warmup:
+            start = time.perf_counter()
+            with span("model_warmup", exercise_id):
+                warm_up_model(model, exercise_id)
+            warmup_seconds = time.perf_counter() - start
+        logger.info("finished model load for %s in %.2fs", exercise_id, load_seconds)
+
+        bucketed_model = None
+        if self.bucketed_inference:
+            # Also traces the graph of every bucket, so it counts as warm-up time
+            start = time.perf_counter()
+            with span("model_bucketing", exercise_id):
+                bucketed_model = load_bucketed_model(model, exercise_id, MAX_LENGTH_MAPPING[exercise_id])
+            warmup_seconds += time.perf_counter() - start
+
+        return LoadedModel(exercise_id, model, path, mtime, load_seconds, warmup_seconds, bucketed_model)
+
+    def _evict(self):
+        # Evict least recently used models until the cache size and memory budget are respected,
+        # always keeping the most recently used model
+        while len(self._models) > 1 and (
+            len(self._models) > self.cache_size
+            or (
+                self.memory_budget_bytes
+                and self.memory_bytes() > self.memory_budget_bytes
+            )
+        ):
+            exercise_id, _ = self._models.popitem(last=False)
+            self.evictions += 1
+            logger.info("evicted model for %s", exercise_id)
+
+    def memory_bytes(self):
+        return sum(entry.memory_bytes for entry in self._models.values())
+
+    def stats(self):
+        with self._lock:
+            loaded = {
+                exercise_id: {
+                    "path": entry.path,
+                    "load_seconds": entry.load_seconds,
+                    "warmup_seconds": entry.warmup_seconds,
+                    "memory_bytes": entry.memory_bytes,
+                    "loaded_at": entry.loaded_at,
+                    "hits": entry.hits,
+                    "backend": entry.backend,
+                    "bucketed": (
+                        entry.model.stats()
+                        if entry.backend == "tflite"
+                        else entry.bucketed_model.stats() if entry.bucketed_model else None
+                    ),
+                }
+                for exercise_id, entry in self._models.items()
+            }
+            return {
+                "loading": MODEL_LOADING,
+                "cache_size": self.cache_size,
+                "memory_budget_bytes": self.memory_budget_bytes,
+                "memory_bytes": self.memory_bytes(),
+                "evictions": self.evictions,
+                "reloads": self.reloads,
+                "models": loaded,
+            }
+
+
+# Registry shared by the whole process
+model_registry = ModelRegistry()
+
+
+# Function to run the exercise model on a batch of prepared inputs
+def predict_batch(exercise_id, data, padding_masks):
+    entry = model_registry.get_entry(exercise_id)
+    with span("model_predict", exercise_id):
+        if entry.backend == "tflite":
+            return entry.model.predict(data, padding_masks)
+        if entry.bucketed_model is not None:
+            return entry.bucketed_model.predict(data, padding_masks)
+        return entry.model.predict([data, padding_masks], batch_size=len(data), verbose=0)
@@ -10,6 +10,7 @@ from sqlalchemy import (
     ForeignKey,
     Float,
     DateTime,
+    Index,
 )
 from database import SessionLocal
 
@@ -59,6 +60,11 @@ class AssignedExercise(Base):
         DateTime, default=datetime.now()
     )  # Date when the exercise was assigned
 
+    __table_args__ = (
+        # Index for the assignment check of a user and exercise
+        Index("ix_assigned_exercises_user_exercise", "user_id", "exercise_id"),
+    )
+
 
 # Define the Progress Tracker table
 class ProgressTracker(Base):
@@ -78,3 +84,45 @@ class ProgressTracker(Base):
     performance_count = Column(
         Integer, default=0
     )  # Number of times the exercise has been performed
+
+    __table_args__ = (
+        # Index for the latest entries of a user and exercise
+        Index("ix_progress_tracker_user_exercise_date", "user_id", "exercise_id", date.desc()),
+    )
+
+
+# Define the Progress Summary table, kept up to date with every new Progress Tracker entry
+class ProgressSummary(Base):
+    __tablename__ = "progress_summary"  # Name of the table in the database
+
+    user_id = Column(
+        String, ForeignKey("users.user_id"), primary_key=True
+    )  # Foreign key referencing the 'user_id' column of the 'users' table
+    exercise_id = Column(String, primary_key=True)  # ID of the exercise
+    performance_count = Column(
+        Integer, default=0
+    )  # Number of times the exercise has been performed
+    last_score = Column(Float)  # Score of the latest performance
+    best_score = Column(Float)  # Highest score of all performances
+    mean_score = Column(Float)  # Mean score of all performances
+    last_date = Column(DateTime)  # Date of the latest performance
+
+
+# Define the Progress Rollup table, daily and weekly statistics of the scores of every user and exercise
+class ProgressRollup(Base):
+    __tablename__ = "progress_rollups"  # Name of the table in the database
+
+    user_id = Column(
+        String, ForeignKey("users.user_id"), primary_key=True
+    )  # Foreign key referencing the 'user_id' column of the 'users' table
+    exercise_id = Column(String, primary_key=True)  # ID of the exercise
+    period = Column(String, primary_key=True)  # "day" or "week"
+    period_start = Column(DateTime, primary_key=True)  # Start of the day or week (Monday)
+    count = Column(Integer, default=0)  # Number of scores in the period
+    sum_score = Column(Float, default=0.0)  # Sum of the scores
+    min_score = Column(Float)  # Lowest score
+    max_score = Column(Float)  # Highest score
+    # Sums used for the least squares trend of the score against the time in days since the period start
+    sum_days = Column(Float, default=0.0)
+    sum_days_squared = Column(Float, default=0.0)
+    sum_days_score = Column(Float, default=0.0)
@@ -0,0 +1,96 @@
+# Importing necessary libraries
+from datetime import datetime
+
+from sqlalchemy import and_, or_, select
+
+import models
+from progress_rollups import rollup_to_dict
+
+# Maximum number of entries returned per page
+MAX_PAGE_SIZE = 500
+
+
+# Raised when a pagination cursor cannot be read
+class InvalidCursor(ValueError):
+    pass
+
+
+# Function to encode the position after the last entry of a page ("<date>,<id>")
+def encode_cursor(date, entry_id=None):
+    cursor = date.isoformat()
+    return cursor if entry_id is None else f"{cursor},{entry_id}"
+
+
+# Function to decode a cursor into its date and id (history cursors have an id, rollup cursors do not)
+def decode_cursor(cursor, with_id=False):
+    date, separator, entry_id = cursor.partition(",")
+    # A partial cursor would compare the ids with NULL and silently return an empty page
+    if bool(separator) != with_id:
+        raise InvalidCursor(f"Invalid cursor: {cursor}")
+    try:
+        return datetime.fromisoformat(date), int(entry_id) if with_id else None
+    except ValueError:
+        raise InvalidCursor(f"Invalid cursor: {cursor}")
+
+
+# Function to get a page of the scores of a user and exercise, newest first
+# Pages are read with a keyset on (date, id) through the (user_id, exercise_id, date) index,
+# so every page costs the same however long the history is
+async def get_progress_history(db, user_id, exercise_id, limit, cursor=None):
+    tracker = models.ProgressTracker
+    query = select(tracker.id, tracker.date, tracker.score, tracker.performance_count).where(
+        tracker.user_id == user_id, tracker.exercise_id == exercise_id
+    )
+    if cursor is not None:
+        before_date, before_id = decode_cursor(cursor, with_id=True)
+        query = query.where(
+            or_(tracker.date < before_date, and_(tracker.date == before_date, tracker.id < before_id))
+        )
+    rows = (await db.execute(query.order_by(tracker.date.desc(), tracker.id.desc()).limit(limit))).all()
+
+    entries = [
+        {
+            "date": date.isoformat(),
+            "score": score,
+            "performance_count": performance_count,
+        }
+        for _, date, score, performance_count in rows
+    ]
+    next_cursor = encode_cursor(rows[-1].date, rows[-1].id) if len(rows) == limit else None
+    return {"entries": entries, "next_cursor": next_cursor}
+
+
+# Function to get a page of the daily or weekly rollups of a user and exercise, newest first
+async def get_progress_rollups(db, user_id, exercise_id, period, limit, cursor=None):
+    rollup = models.ProgressRollup
+    query = select(rollup).where(
+        rollup.user_id == user_id,
+        rollup.exercise_id == exercise_id,
+        rollup.period == period,
+    )
+    if cursor is not None:
+        before_start, _ = decode_cursor(cursor)
+        query = query.where(rollup.period_start < before_start)
+    rows = (await db.scalars(query.order_by(rollup.period_start.desc()).limit(limit))).all()
+
+    next_cursor = encode_cursor(rows[-1].period_start) if len(rows) == limit else None
+    return {"rollups": [rollup_to_dict(row) for row in rows], "next_cursor": next_cursor}
+
+
+# Function to get the progress summary of every exercise of a user
+async def get_progress_summaries(db, user_id):
+    summary = models.ProgressSummary
+    rows = (
+        await db.scalars(select(summary).where(summary.user_id == user_id).order_by(summary.exercise_id))
+    ).all()
+    return [
+        {
+            "exercise_id": row.exercise_id,
+            "performance_count": row.performance_count,
+            "last_score": row.last_score,
+            "best_score": row.best_score,
+            "mean_score": row.mean_score,
+            "last_date": row.last_date.isoformat() if row.last_date else None,
+        }
+        for row in rows
+    ]
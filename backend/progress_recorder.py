@@ -0,0 +1,213 @@
+# Importing necessary libraries
+import asyncio
+import os
+import time
+from collections import namedtuple
+from datetime import datetime
+
+from sqlalchemy import case, update
+
+import models
+from database import AsyncSessionLocal
+from metrics import get_logger, span
+from progress_rollups import apply_rollups
+
+logger = get_logger(__name__)
+
+# Recorder settings
+# With write-behind, clinical scores are answered before they are stored and written in batches in the background.
+# Set to 0 to wait until the score is stored before answering (the write is still batched with concurrent scores).
+PROGRESS_WRITE_BEHIND = os.environ.get("REHABAI_PROGRESS_WRITE_BEHIND", "1") != "0"
+# Maximum number of scores written in one transaction
+PROGRESS_BATCH_SIZE = int(os.environ.get("REHABAI_PROGRESS_BATCH_SIZE", 100))
+# Maximum time a score waits before its batch is written
+PROGRESS_FLUSH_MS = float(os.environ.get("REHABAI_PROGRESS_FLUSH_MS", 200))
+# Number of times a batch is retried when writing it fails
+PROGRESS_MAX_ATTEMPTS = int(os.environ.get("REHABAI_PROGRESS_MAX_ATTEMPTS", 3))
+
+# Score waiting to be stored
+ProgressRecord = namedtuple("ProgressRecord", ["user_id", "exercise_id", "score", "date"])
+
+
+# Function to store one score: update the summary and rollups of the user and exercise and add the progress tracker entry
+async def apply_record(db, record):
+    summary = models.ProgressSummary
+    # The summary row is updated in place, so the performance count is incremented atomically in the database
+    performance_count = await db.scalar(
+        update(summary)
+        .where(summary.user_id == record.user_id, summary.exercise_id == record.exercise_id)
+        .values(
+            performance_count=summary.performance_count + 1,
+            last_score=record.score,
+            best_score=case((summary.best_score >= record.score, summary.best_score), else_=record.score),
+            mean_score=summary.mean_score
+            + (record.score - summary.mean_score) / (summary.performance_count + 1),
+            last_date=record.date,
+        )
+        .returning(summary.performance_count)
+        .execution_options(synchronize_session=False)
+    )
+    # First performance of the exercise
+    if performance_count is None:
+        performance_count = 1
+        db.add(
+            summary(
+                user_id=record.user_id,
+                exercise_id=record.exercise_id,
+                performance_count=performance_count,
+                last_score=record.score,
+                best_score=record.score,
+                mean_score=record.score,
+                last_date=record.date,
+            )
+        )
+        await db.flush()
+
+    await apply_rollups(db, record)
+
+    db.add(
+        models.ProgressTracker(
+            user_id=record.user_id,
+            exercise_id=record.exercise_id,
+            date=record.date,
+            score=record.score,
+            performance_count=performance_count,
+        )
+    )
+    return performance_count
+
+
+# Queue of scores written to the database in batched transactions by a background task
+class ProgressRecorder:
+    def __init__(
+        self,
+        session_factory=AsyncSessionLocal,
+        write_behind=PROGRESS_WRITE_BEHIND,
+        batch_size=PROGRESS_BATCH_SIZE,
+        flush_ms=PROGRESS_FLUSH_MS,
+        max_attempts=PROGRESS_MAX_ATTEMPTS,
+    ):
+        self.session_factory = session_factory
+        self.write_behind = write_behind
+        self.batch_size = max(1, batch_size)
+        self.flush_seconds = flush_ms / 1000
+        self.max_attempts = max(1, max_attempts)
+        # (record, future or None, attempts) of every score waiting to be written
+        self._pending = []
+        self._wake = None
+        self._task = None
+        self._flush_lock = None
+        self.recorded = 0
+        self.written = 0
+        self.batches = 0
+        self.failures = 0
+        self.dropped = 0
+        self.last_batch_seconds = 0.0
+
+    def start(self):
+        # Start the background writer, must be called from the event loop
+        self._wake = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        # Write the remaining scores and stop the background writer
+        if self._task is None:
+            return
+        task, self._task = self._task, None
+        self._wake.set()
+        await task
+
+    # Function to queue a score to be stored. Without write-behind, waits until it is stored and returns its
+    # performance count.
+    async def record(self, user_id, exercise_id, score, date=None):
+        record = ProgressRecord(user_id, exercise_id, float(score), date or datetime.now())
+        future = None if self.write_behind else asyncio.get_running_loop().create_future()
+        self._pending.append((record, future, 0))
+        self.recorded += 1
+
+        if self._task is None:
+            # No background writer (e.g. in scripts), write right away
+            await self.flush()
+        elif len(self._pending) >= self.batch_size or future is not None:
+            self._wake.set()
+
+        if future is not None:
+            return await future
+        return None
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.flush_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            while self._pending:
+                try:
+                    if not await self.flush():
+                        break
+                except Exception:
+                    # The writer keeps running, the next scores are written by the next batches
+                    logger.exception("progress writer failed to flush a batch")
+                    break
+            if self._task is None and not self._pending:
+                return
+
+    # Function to write the next batch of queued scores in one transaction, returns False if the write failed
+    async def flush(self):
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        async with self._flush_lock:
+            batch = self._pending[: self.batch_size]
+            del self._pending[: self.batch_size]
+            if not batch:
+                return True
+
+            start = time.perf_counter()
+            try:
+                with span("progress_write"):
+                    async with self.session_factory() as db:
+                        async with db.begin():
+                            counts = [await apply_record(db, record) for record, _, _ in batch]
+            except Exception as error:
+                self.failures += 1
+                logger.error("failed to write %d progress records: %s", len(batch), error)
+                retry = []
+                for record, future, attempts in batch:
+                    if future is not None:
+                        # The waiter may be gone (cancelled request), the score is then dropped with its batch
+                        if not future.done():
+                            future.set_exception(error)
+                    elif attempts + 1 < self.max_attempts:
+                        retry.append((record, future, attempts + 1))
+                    else:
+                        self.dropped += 1
+                # Retried scores keep their place at the front of the queue
+                self._pending[:0] = retry
+                return False
+
+            self.last_batch_seconds = time.perf_counter() - start
+            self.batches += 1
+            self.written += len(batch)
+            for (_, future, _), performance_count in zip(batch, counts):
+                if future is not None and not future.done():
+                    future.set_result(performance_count)
+            return True
+
+    def stats(self):
+        return {
+            "write_behind": self.write_behind,
+            "pending": len(self._pending),
+            "recorded": self.recorded,
+            "written": self.written,
+            "batches": self.batches,
+            "mean_batch_size": self.written / self.batches if self.batches else 0.0,
+            "last_batch_seconds": self.last_batch_seconds,
+            "failures": self.failures,
+            "dropped": self.dropped,
+        }
+
+
+# Recorder used by the clinical score endpoints
+progress_recorder = ProgressRecorder()
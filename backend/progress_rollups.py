@@ -0,0 +1,135 @@
+# Importing necessary libraries
+from datetime import datetime, timedelta
+
+from sqlalchemy import case, insert, select, update
+
+import models
+
+
+# Function to get the start of the day of a date
+def get_day_start(date):
+    return datetime(date.year, date.month, date.day)
+
+
+# Function to get the start of the week (Monday) of a date
+def get_week_start(date):
+    return get_day_start(date) - timedelta(days=date.weekday())
+
+
+# Rollup periods and the function giving the start of the period of a date
+ROLLUP_PERIODS = {
+    "day": get_day_start,
+    "week": get_week_start,
+}
+
+
+# Function to get the time of a date in days since the start of its period
+def get_period_days(date, period_start):
+    return (date - period_start).total_seconds() / 86400
+
+
+# Function to add a score to the rollup of every period, in the transaction that stores the score
+async def apply_rollups(db, record):
+    rollup = models.ProgressRollup
+    for period, get_period_start in ROLLUP_PERIODS.items():
+        period_start = get_period_start(record.date)
+        days = get_period_days(record.date, period_start)
+        # The rollup row is updated in place, so concurrent writers cannot lose a score
+        count = await db.scalar(
+            update(rollup)
+            .where(
+                rollup.user_id == record.user_id,
+                rollup.exercise_id == record.exercise_id,
+                rollup.period == period,
+                rollup.period_start == period_start,
+            )
+            .values(
+                count=rollup.count + 1,
+                sum_score=rollup.sum_score + record.score,
+                min_score=case((rollup.min_score <= record.score, rollup.min_score), else_=record.score),
+                max_score=case((rollup.max_score >= record.score, rollup.max_score), else_=record.score),
+                sum_days=rollup.sum_days + days,
+                sum_days_squared=rollup.sum_days_squared + days * days,
+                sum_days_score=rollup.sum_days_score + days * record.score,
+            )
+            .returning(rollup.count)
+            .execution_options(synchronize_session=False)
+        )
+        # First score of the period
+        if count is None:
+            await db.execute(
+                insert(rollup).values(
+                    user_id=record.user_id,
+                    exercise_id=record.exercise_id,
+                    period=period,
+                    period_start=period_start,
+                    count=1,
+                    sum_score=record.score,
+                    min_score=record.score,
+                    max_score=record.score,
+                    sum_days=days,
+                    sum_days_squared=days * days,
+                    sum_days_score=days * record.score,
+                )
+            )
+
+
+# Function to get the statistics of a rollup row
+def rollup_to_dict(rollup):
+    # Least squares slope of the score against time, in score per day (0 with less than two distinct times)
+    denominator = rollup.count * rollup.sum_days_squared - rollup.sum_days**2
+    trend_slope = 0.0
+    if rollup.count > 1 and denominator > 1e-12:
+        trend_slope = (rollup.count * rollup.sum_days_score - rollup.sum_days * rollup.sum_score) / denominator
+    return {
+        "period": rollup.period,
+        "period_start": rollup.period_start.isoformat(),
+        "count": rollup.count,
+        "mean_score": rollup.sum_score / rollup.count,
+        "min_score": rollup.min_score,
+        "max_score": rollup.max_score,
+        "trend_slope": trend_slope,
+    }
+
+
+# Function to rebuild the rollups from the progress history, used by the migration that adds them
+def rebuild_rollups(connection):
+    tracker = models.ProgressTracker
+    rollups = {}
+    rows = connection.execution_options(yield_per=10000).execute(
+        select(tracker.user_id, tracker.exercise_id, tracker.date, tracker.score).where(
+            tracker.date.is_not(None), tracker.score.is_not(None)
+        )
+    )
+    for user_id, exercise_id, date, score in rows:
+        for period, get_period_start in ROLLUP_PERIODS.items():
+            period_start = get_period_start(date)
+            days = get_period_days(date, period_start)
+            key = (user_id, exercise_id, period, period_start)
+            rollup = rollups.get(key)
+            if rollup is None:
+                rollup = rollups[key] = {
+                    "user_id": user_id,
+                    "exercise_id": exercise_id,
+                    "period": period,
+                    "period_start": period_start,
+                    "count": 0,
+                    "sum_score": 0.0,
+                    "min_score": score,
+                    "max_score": score,
+                    "sum_days": 0.0,
+                    "sum_days_squared": 0.0,
+                    "sum_days_score": 0.0,
+                }
+            rollup["count"] += 1
+            rollup["sum_score"] += score
+            rollup["min_score"] = min(rollup["min_score"], score)
+            rollup["max_score"] = max(rollup["max_score"], score)
+            rollup["sum_days"] += days
+            rollup["sum_days_squared"] += days * days
+            rollup["sum_days_score"] += days * score
+
+    connection.execute(models.ProgressRollup.__table__.delete())
+    if rollups:
+        connection.execute(insert(models.ProgressRollup), list(rollups.values()))
+    return len(rollups)
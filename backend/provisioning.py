@@ -0,0 +1,149 @@
+# Importing necessary libraries
+import argparse
+import csv
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from io import StringIO
+
+from sqlalchemy import String, cast, insert, literal, select, true, update
+from sqlalchemy.exc import IntegrityError
+
+import models
+from database import engine
+from hashing import get_hashed_password
+
+# Provisioning settings
+# Number of threads hashing the roster passwords (bcrypt releases the GIL, so threads run in parallel)
+PROVISIONING_WORKERS = int(os.environ.get("REHABAI_PROVISIONING_WORKERS", os.cpu_count() or 2))
+# Number of users inserted per transaction
+PROVISIONING_CHUNK_SIZE = int(os.environ.get("REHABAI_PROVISIONING_CHUNK_SIZE", 500))
+# Token required by the provisioning endpoint (the endpoint is disabled when it is not set)
+ADMIN_TOKEN = os.environ.get("REHABAI_ADMIN_TOKEN") or None
+
+
+# Function to get the statement giving new users (user_id still NULL) their user ID, derived from the
+# autoincrement primary key so concurrent signups can never get the same ID
+def get_assign_user_ids_statement(ids):
+    return (
+        update(models.User)
+        .where(models.User.id.in_(ids), models.User.user_id.is_(None))
+        .values(user_id=literal("U") + cast(models.User.id, String))
+        .execution_options(synchronize_session=False)
+    )
+
+
+# Function to get the statement assigning every exercise to the given users with a single INSERT ... SELECT
+def get_assign_exercises_statement(ids, date):
+    return insert(models.AssignedExercise).from_select(
+        ["user_id", "exercise_id", "date"],
+        select(models.User.user_id, models.Exercise.exercise_id, literal(date))
+        .join(models.Exercise, true())
+        .where(models.User.id.in_(ids)),
+    )
+
+
+# Function to read a roster csv file with a header containing the username and password columns
+def read_roster(roster_text):
+    reader = csv.DictReader(StringIO(roster_text))
+    if reader.fieldnames is None or not {"username", "password"} <= set(reader.fieldnames):
+        raise ValueError("The roster must have username and password columns")
+    roster = []
+    for line, row in enumerate(reader, start=2):
+        username = (row["username"] or "").strip()
+        if not username or not row["password"]:
+            raise ValueError(f"Missing username or password on line {line}")
+        roster.append((username, row["password"]))
+    return roster
+
+
+# Function to get the usernames of the roster that are already registered
+def get_existing_usernames(connection, usernames, chunk_size):
+    existing = set()
+    for start in range(0, len(usernames), chunk_size):
+        chunk = usernames[start : start + chunk_size]
+        existing.update(
+            connection.execute(
+                select(models.User.username).where(models.User.username.in_(chunk))
+            ).scalars()
+        )
+    return existing
+
+
+# Function to insert a chunk of users with their hashed passwords and assign them every exercise in one transaction
+def insert_users(connection, users, date):
+    ids = connection.execute(
+        insert(models.User).returning(models.User.id),
+        [{"username": username, "password": hashed_password} for username, hashed_password in users],
+    ).scalars().all()
+    connection.execute(get_assign_user_ids_statement(ids))
+    connection.execute(get_assign_exercises_statement(ids, date))
+    return ids
+
+
+# Function to create the users of a roster [(username, password), ...]
+def provision_roster(roster, chunk_size=PROVISIONING_CHUNK_SIZE, workers=PROVISIONING_WORKERS, bind=engine):
+    start = time.perf_counter()
+    chunk_size = max(1, chunk_size)
+
+    # Keep the first entry of every username
+    unique_roster = []
+    seen_usernames = set()
+    for username, password in roster:
+        if username not in seen_usernames:
+            seen_usernames.add(username)
+            unique_roster.append((username, password))
+    with bind.connect() as connection:
+        existing = get_existing_usernames(connection, [username for username, _ in unique_roster], chunk_size)
+    new_users = [(username, password) for username, password in unique_roster if username not in existing]
+
+    created = []
+    skipped_existing = len(existing)
+    date = datetime.now()
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="provisioning") as executor:
+        # Every password is queued for hashing up front, so the next chunks are hashed while a chunk is inserted
+        hashed_passwords = executor.map(get_hashed_password, [password for _, password in new_users])
+        for chunk_start in range(0, len(new_users), chunk_size):
+            usernames = [username for username, _ in new_users[chunk_start : chunk_start + chunk_size]]
+            users = [(username, next(hashed_passwords)) for username in usernames]
+            try:
+                with bind.begin() as connection:
+                    ids = insert_users(connection, users, date)
+            except IntegrityError:
+                # A username of the chunk was registered in the meantime, insert the others
+                with bind.begin() as connection:
+                    taken = get_existing_usernames(connection, usernames, chunk_size)
+                    users = [user for user in users if user[0] not in taken]
+                    ids = insert_users(connection, users, date) if users else []
+                skipped_existing += len(taken)
+            created.extend(ids)
+
+    seconds = time.perf_counter() - start
+    return {
+        "requested": len(roster),
+        "created": len(created),
+        "skipped_existing": skipped_existing,
+        "skipped_duplicates": len(roster) - len(unique_roster),
+        "seconds": seconds,
+        "users_per_second": len(created) / seconds if seconds > 0 else 0.0,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create the users of a roster csv file (username,password columns)")
+    parser.add_argument("roster", help="Path of the roster csv file")
+    parser.add_argument("--chunk-size", type=int, default=PROVISIONING_CHUNK_SIZE, help="Users inserted per transaction")
+    parser.add_argument("--workers", type=int, default=PROVISIONING_WORKERS, help="Threads hashing passwords")
+    args = parser.parse_args()
+
+    from data_wrapper import initialize_db
+
+    initialize_db()
+    with open(args.roster, newline="") as roster_file:
+        report = provision_roster(read_roster(roster_file.read()), args.chunk_size, args.workers)
+    print(
+        f"created {report['created']} users ({report['skipped_existing']} already registered, "
+        f"{report['skipped_duplicates']} duplicates) in {report['seconds']:.1f}s "
+        f"({report['users_per_second']:.1f} users/s)"
+    )
@@ -0,0 +1,88 @@
+# Importing necessary libraries
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+from data_wrapper import get_exercises_data
+from metrics import get_logger
+from ml_wrapper import get_dataframe_cols
+
+logger = get_logger(__name__)
+
+# Directory containing the reference joint position csv files (the frontend's public directory)
+REFERENCE_DIRECTORY = os.environ.get("REHABAI_REFERENCE_DIR", "../frontend/public")
+
+
+# Function to swap the "left_" and "right_" prefixes of a column name
+def swap_left_right(column):
+    # Original references have left and right swapped, so we swap them back here
+    if column.startswith("left_"):
+        return column.replace("left_", "right_", 1)
+    if column.startswith("right_"):
+        return column.replace("right_", "left_", 1)
+    return column
+
+
+# Function to load a reference csv file into a float32 array of shape (frames, 51) ordered like get_dataframe_cols
+def load_reference_frames(path):
+    reference = pd.read_csv(path, sep=",")
+    reference.columns = [swap_left_right(column.strip()) for column in reference.columns]
+    reference = reference.reindex(columns=get_dataframe_cols())
+    return np.ascontiguousarray(reference.to_numpy(dtype=np.float32))
+
+
+# Cache of the reference joint positions of every exercise, loaded once per process
+class ReferenceCache:
+    def __init__(self, reference_directory=REFERENCE_DIRECTORY):
+        self.reference_directory = reference_directory
+        # Reference csv file of each exercise, as seeded in the exercises table
+        self.reference_paths = {
+            exercise["exercise_id"]: exercise["csv"].lstrip("/") for exercise in get_exercises_data()
+        }
+        self.column_indices = {column: index for index, column in enumerate(get_dataframe_cols())}
+        self._frames = {}
+        self._lock = threading.Lock()
+
+    def get_reference_path(self, exercise_id):
+        return os.path.join(self.reference_directory, self.reference_paths[exercise_id])
+
+    def preload(self):
+        # Load every reference whose file is available
+        for exercise_id in self.reference_paths:
+            if not os.path.exists(self.get_reference_path(exercise_id)):
+                logger.warning("reference file for %s not found, skipping preload", exercise_id)
+                continue
+            self.get(exercise_id)
+
+    # Function to get the reference frames of an exercise as a float32 array of shape (frames, 51)
+    def get(self, exercise_id):
+        frames = self._frames.get(exercise_id)
+        if frames is None:
+            if exercise_id not in self.reference_paths:
+                raise KeyError(f"No reference registered for exercise {exercise_id}")
+            with self._lock:
+                frames = self._frames.get(exercise_id)
+                if frames is None:
+                    frames = load_reference_frames(self.get_reference_path(exercise_id))
+                    # Reference frames are shared by every request, so they must not be modified
+                    frames.flags.writeable = False
+                    self._frames[exercise_id] = frames
+        return frames
+
+    # Function to get frames [start, end) of the given columns as an array of shape (frames, len(columns))
+    def get_columns(self, exercise_id, columns, start=0, end=None):
+        frames = self.get(exercise_id)
+        indices = [self.column_indices[column] for column in columns]
+        return frames[start:end, indices]
+
+    def stats(self):
+        return {
+            exercise_id: {"frames": frames.shape[0], "memory_bytes": frames.nbytes}
+            for exercise_id, frames in self._frames.items()
+        }
+
+
+# Cache shared by the feedback endpoints
+reference_cache = ReferenceCache()
@@ -0,0 +1,251 @@
+# Importing necessary libraries
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+
+import numpy as np
+
+# Score cache settings
+# Maximum number of clinical scores kept in memory, keyed by exercise, model version and frames
+# (the least recently used score is evicted first, 0 disables the cache)
+SCORE_CACHE_SIZE = int(os.environ.get("REHABAI_SCORE_CACHE_SIZE", 4096))
+# Optional SQLite file keeping the scores and idempotency keys across restarts, shared by the workers of a machine
+SCORE_CACHE_PATH = os.environ.get("REHABAI_SCORE_CACHE_PATH") or None
+# Maximum number of idempotency keys kept in memory, and number of seconds their response is replayed
+IDEMPOTENCY_CACHE_SIZE = int(os.environ.get("REHABAI_IDEMPOTENCY_CACHE_SIZE", 10000))
+IDEMPOTENCY_TTL_SECONDS = float(os.environ.get("REHABAI_IDEMPOTENCY_TTL_SECONDS", 24 * 60 * 60))
+# Maximum length of an Idempotency-Key header
+MAX_IDEMPOTENCY_KEY_LENGTH = 255
+
+# Number of writes between two prunings of the on-disk store
+DISK_PRUNE_INTERVAL = 100
+
+
+# Raised when an idempotency key is reused for a different submission
+class IdempotencyKeyReused(Exception):
+    pass
+
+
+# Function to get the cache key of a submission, a hash of the exercise, the model version and the frames used by
+# the model (float32 array of shape (frames, 51) ordered like get_dataframe_cols, at most MAX_FRAMES)
+def get_content_key(exercise_id, model_version, frames):
+    frames = np.ascontiguousarray(frames, dtype=np.float32)
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f"{exercise_id}\0{model_version}\0{frames.shape}\0".encode())
+    digest.update(frames.data)
+    return digest.hexdigest()
+
+
+# Score and idempotency store kept in a SQLite file
+class DiskScoreStore:
+    def __init__(self, path, max_size):
+        self.path = path
+        self.max_size = max_size
+        self._local = threading.local()
+        self._writes = 0
+        with self._connect() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS scores (key TEXT PRIMARY KEY, score TEXT, used_at REAL)"
+            )
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS idempotency_keys ("
+                "user_id TEXT, key TEXT, content_key TEXT, response TEXT, expires_at REAL, "
+                "PRIMARY KEY (user_id, key))"
+            )
+
+    def _connect(self):
+        # One connection per thread, SQLite connections cannot be shared between threads
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            self._local.connection = connection
+        return connection
+
+    def get_score(self, key):
+        row = self._connect().execute("SELECT score FROM scores WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def put_score(self, key, score):
+        self._connect().execute(
+            "INSERT OR REPLACE INTO scores (key, score, used_at) VALUES (?, ?, ?)",
+            (key, json.dumps(score), time.time()),
+        )
+        self._count_write()
+
+    def get_response(self, user_id, key, now):
+        row = self._connect().execute(
+            "SELECT content_key, response, expires_at FROM idempotency_keys WHERE user_id = ? AND key = ?",
+            (user_id, key),
+        ).fetchone()
+        if row is None or row[2] <= now:
+            return None
+        return row[0], json.loads(row[1])
+
+    def put_response(self, user_id, key, content_key, response, expires_at):
+        self._connect().execute(
+            "INSERT OR REPLACE INTO idempotency_keys (user_id, key, content_key, response, expires_at) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (user_id, key, content_key, json.dumps(response), expires_at),
+        )
+        self._count_write()
+
+    def _count_write(self):
+        self._writes += 1
+        if self._writes % DISK_PRUNE_INTERVAL == 0:
+            self.prune(time.time())
+
+    def prune(self, now):
+        # Keep the most recently written scores and the idempotency keys that have not expired
+        connection = self._connect()
+        connection.execute(
+            "DELETE FROM scores WHERE key NOT IN (SELECT key FROM scores ORDER BY used_at DESC LIMIT ?)",
+            (self.max_size,),
+        )
+        connection.execute("DELETE FROM idempotency_keys WHERE expires_at <= ?", (now,))
+
+
+# LRU cache of the clinical scores of submitted sessions, and of the responses sent for each idempotency key
+# Retries and double submissions of the same session reuse the score instead of preparing the frames and running
+# the model again, and a repeated Idempotency-Key gets the stored response without a second progress entry
+class ScoreCache:
+    def __init__(
+        self,
+        max_size=SCORE_CACHE_SIZE,
+        path=SCORE_CACHE_PATH,
+        idempotency_cache_size=IDEMPOTENCY_CACHE_SIZE,
+        idempotency_ttl_seconds=IDEMPOTENCY_TTL_SECONDS,
+    ):
+        self.max_size = max(0, max_size)
+        self.idempotency_cache_size = max(1, idempotency_cache_size)
+        self.idempotency_ttl_seconds = idempotency_ttl_seconds
+        self.disk_store = DiskScoreStore(path, self.max_size) if path else None
+        # content key -> score
+        self._scores = OrderedDict()
+        # (user_id, idempotency key) -> (content key, response, expiry time)
+        self._responses = OrderedDict()
+        self._lock = threading.Lock()
+        # One lock per idempotency key being processed, so concurrent retries wait for the first submission
+        self._key_locks = {}
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.replays = 0
+
+    @property
+    def enabled(self):
+        return self.max_size > 0
+
+    # Function to get the cached score of a submission, or None
+    async def get(self, content_key):
+        if not self.enabled:
+            return None
+        with self._lock:
+            score = self._scores.get(content_key)
+            if score is not None:
+                self._scores.move_to_end(content_key)
+                self.hits += 1
+                return score
+
+        if self.disk_store is not None:
+            # SQLite may wait for the lock of another worker, so the disk store is only used from a thread
+            score = await asyncio.to_thread(self.disk_store.get_score, content_key)
+            if score is not None:
+                with self._lock:
+                    self._store(self._scores, content_key, score, self.max_size)
+                    self.disk_hits += 1
+                return score
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    async def put(self, content_key, score):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._store(self._scores, content_key, score, self.max_size)
+        if self.disk_store is not None:
+            await asyncio.to_thread(self.disk_store.put_score, content_key, score)
+
+    def _store(self, entries, key, value, max_size):
+        entries[key] = value
+        entries.move_to_end(key)
+        while len(entries) > max_size:
+            entries.popitem(last=False)
+
+    # Function to hold the lock of an idempotency key while its submission is processed
+    @asynccontextmanager
+    async def idempotency_guard(self, user_id, idempotency_key):
+        key = (user_id, idempotency_key)
+        entry = self._key_locks.get(key)
+        if entry is None:
+            # [lock, number of requests using it]
+            entry = self._key_locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._key_locks[key]
+
+    # Function to get the response stored for an idempotency key, or None. Raises IdempotencyKeyReused if the
+    # key was used for a different submission.
+    async def get_response(self, user_id, idempotency_key, content_key):
+        now = time.time()
+        with self._lock:
+            entry = self._responses.get((user_id, idempotency_key))
+            if entry is not None and entry[2] <= now:
+                del self._responses[(user_id, idempotency_key)]
+                entry = None
+        if entry is None and self.disk_store is not None:
+            stored = await asyncio.to_thread(self.disk_store.get_response, user_id, idempotency_key, now)
+            if stored is not None:
+                entry = (*stored, now + self.idempotency_ttl_seconds)
+        if entry is None:
+            return None
+
+        stored_content_key, response, _ = entry
+        if stored_content_key != content_key:
+            raise IdempotencyKeyReused(f"Idempotency key {idempotency_key} was already used for a different session")
+        with self._lock:
+            self.replays += 1
+        return response
+
+    async def put_response(self, user_id, idempotency_key, content_key, response):
+        expires_at = time.time() + self.idempotency_ttl_seconds
+        with self._lock:
+            self._store(
+                self._responses, (user_id, idempotency_key), (content_key, response, expires_at), self.idempotency_cache_size
+            )
+        if self.disk_store is not None:
+            await asyncio.to_thread(
+                self.disk_store.put_response, user_id, idempotency_key, content_key, response, expires_at
+            )
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "size": len(self._scores),
+                "max_size": self.max_size,
+                "disk_store": self.disk_store is not None,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+                "idempotency_keys": len(self._responses),
+                "replays": self.replays,
+            }
+
+
+# Cache used by the clinical score endpoints
+score_cache = ScoreCache()
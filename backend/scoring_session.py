@@ -0,0 +1,72 @@
+# Importing necessary libraries
+import os
+import threading
+import time
+from uuid import uuid4
+
+import numpy as np
+
+from frame_codec import decode_frames
+from metrics import span
+from ml_wrapper import MAX_FRAMES, PIPELINES, all_cols
+from session_store import SessionStore
+
+# Session settings
+# Sessions that receive no frames for this many seconds are evicted
+SCORING_SESSION_IDLE_SECONDS = float(os.environ.get("REHABAI_SCORING_SESSION_IDLE_SECONDS", 600))
+# Maximum number of open sessions (the least recently used session is evicted first)
+SCORING_SESSION_MAX = int(os.environ.get("REHABAI_SCORING_SESSION_MAX", 200))
+# Maximum decompressed size of one chunk of frames (a whole session of MAX_FRAMES frames is about 120 kB)
+SCORING_CHUNK_MAX_BYTES = int(os.environ.get("REHABAI_SCORING_CHUNK_MAX_BYTES", 1024 * 1024))
+
+
+# Function to decode an uploaded chunk of frames (same formats as decode_frames), module-level so it can be sent to
+# the worker processes of the scoring pool
+def load_chunk_frames(body, content_encoding, exercise_id):
+    with span("decode_frames", exercise_id):
+        return decode_frames(body, content_encoding, SCORING_CHUNK_MAX_BYTES)
+
+
+# Exercise session whose frames are uploaded in chunks while the user is exercising.
+# Every chunk is preprocessed as soon as it arrives, so the model input is ready when the session closes.
+class ScoringSession:
+    def __init__(self, user_id, exercise_id, max_length):
+        self.session_id = str(uuid4())
+        self.user_id = user_id
+        self.exercise_id = exercise_id
+        self.pipeline = PIPELINES[exercise_id]
+        # Arena holding the raw frames, only the first MAX_FRAMES frames are used by the model
+        self.frames = np.empty((MAX_FRAMES, len(all_cols)), dtype=np.float32)
+        self.num_frames = 0
+        self.received_frames = 0
+        # Model input, filled in as frames arrive
+        self.data = np.zeros((1, max_length, self.pipeline.num_features), dtype=np.float32)
+        self.padding_mask = np.ones((1, max_length), dtype=np.float32)
+        self.last_access = time.monotonic()
+        # Chunks of one session are appended one at a time
+        self._lock = threading.Lock()
+
+    # Function to append a chunk of frames, an array of shape (frames, 51) ordered like get_dataframe_cols.
+    # Returns the number of frames that will be used by the model so far.
+    def append(self, frames):
+        with self._lock:
+            self.received_frames += len(frames)
+            frames = frames[: MAX_FRAMES - self.num_frames]
+            start = self.num_frames
+            end = start + len(frames)
+            if end > start:
+                self.frames[start:end] = frames
+                # Only the new rows are prepared, the previous rows are read for the smoothing window
+                self.pipeline.prepare_rows(self.frames[:end], start, self.data[0, start:end])
+                self.padding_mask[0, start:end] = 0
+                self.num_frames = end
+            return self.num_frames
+
+    # Function to get the model input of the frames received so far, like prepare_array
+    def prepared_data(self):
+        with self._lock:
+            return (self.data, self.padding_mask)
+
+
+# Store shared by the scoring session endpoints
+scoring_sessions = SessionStore(ScoringSession, SCORING_SESSION_IDLE_SECONDS, SCORING_SESSION_MAX)
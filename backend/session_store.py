@@ -0,0 +1,68 @@
+# Importing necessary libraries
+import threading
+import time
+from collections import OrderedDict
+
+
+# Store of the open sessions of one kind (e.g. live feedback or scoring sessions).
+# Sessions are created by session_factory and must have session_id, user_id and last_access attributes.
+class SessionStore:
+    def __init__(self, session_factory, idle_seconds, max_sessions):
+        self.session_factory = session_factory
+        self.idle_seconds = idle_seconds
+        self.max_sessions = max(1, max_sessions)
+        # Sessions ordered from least to most recently used
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def create(self, *args, **kwargs):
+        session = self.session_factory(*args, **kwargs)
+        with self._lock:
+            self._evict_idle()
+            while len(self._sessions) >= self.max_sessions:
+                self._sessions.popitem(last=False)
+                self.evictions += 1
+            self._sessions[session.session_id] = session
+        return session
+
+    def get(self, session_id, user_id):
+        # Return the session only to the user who opened it
+        with self._lock:
+            self._evict_idle()
+            session = self._sessions.get(session_id)
+            if session is None or session.user_id != user_id:
+                return None
+            session.last_access = time.monotonic()
+            self._sessions.move_to_end(session_id)
+            return session
+
+    def pop(self, session_id, user_id):
+        # Remove the session and return it, only for the user who opened it
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None or session.user_id != user_id:
+                return None
+            del self._sessions[session_id]
+            return session
+
+    def close(self, session_id, user_id):
+        return self.pop(session_id, user_id) is not None
+
+    def _evict_idle(self):
+        now = time.monotonic()
+        while self._sessions:
+            oldest = next(iter(self._sessions.values()))
+            if now - oldest.last_access < self.idle_seconds:
+                break
+            self._sessions.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "open_sessions": len(self._sessions),
+                "max_sessions": self.max_sessions,
+                "idle_seconds": self.idle_seconds,
+                "evictions": self.evictions,
+            }
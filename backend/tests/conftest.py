@@ -0,0 +1,67 @@
+# Shared setup of the backend tests, run from the backend directory with "python -m pytest tests"
+import os
+import sys
+import tempfile
+import uuid
+
+import pandas as pd
+import pytest
+
+# The backend modules are imported by their bare name, like main.py does
+BACKEND_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIRECTORY)
+
+# Settings are read when the modules are imported, so the tests point them at a temporary directory
+# (never the development database) before any backend module is imported
+TEST_DIRECTORY = tempfile.mkdtemp(prefix="rehabai-tests-")
+os.environ["REHABAI_DATABASE_URL"] = f"sqlite:///{TEST_DIRECTORY}/RehabAI.db"
+os.environ["REHABAI_MODELS_DIR"] = os.path.join(TEST_DIRECTORY, "models")
+os.environ["REHABAI_MODEL_LOADING"] = "lazy"
+# Scores are stored before the response, so the tests can read them right away
+os.environ["REHABAI_PROGRESS_WRITE_BEHIND"] = "0"
+
+# Reference sessions of every exercise, shipped with the frontend
+REFERENCE_DIRECTORY = os.path.join(BACKEND_DIRECTORY, "..", "frontend", "public")
+os.environ["REHABAI_REFERENCE_DIR"] = REFERENCE_DIRECTORY
+REFERENCE_FILES = {
+    "Es1": "E_ID15_Es1.csv",
+    "Es2": "E_ID12_Es2.csv",
+    "Es3": "E_ID12_Es3.csv",
+    "Es4": "E_ID1_Es4.csv",
+    "Es5": "E_ID1_Es5.csv",
+}
+
+
+# Function to read the reference session of an exercise as a dataframe with the columns of get_dataframe_cols
+def read_reference_session(exercise_id):
+    from ml_wrapper import reorder_dataframe
+
+    return reorder_dataframe(pd.read_csv(os.path.join(REFERENCE_DIRECTORY, REFERENCE_FILES[exercise_id])))
+
+
+@pytest.fixture(params=sorted(REFERENCE_FILES))
+def exercise_id(request):
+    return request.param
+
+
+# Test client of the API, started once for the whole test run
+@pytest.fixture(scope="session")
+def client():
+    from fastapi.testclient import TestClient
+
+    import main
+
+    with TestClient(main.app) as test_client:
+        yield test_client
+
+
+# Test client logged in as a new patient (every exercise is assigned at signup)
+@pytest.fixture
+def user_client(client):
+    username = f"patient-{uuid.uuid4().hex}"
+    client.cookies.clear()
+    client.post("/api/signup/", json={"username": username, "password": "password"}).raise_for_status()
+    response = client.post("/api/login/", json={"username": username, "password": "password"})
+    response.raise_for_status()
+    client.cookies.set("session_token", response.json()["session_id"])
+    return client
@@ -0,0 +1,88 @@
+import asyncio
+import time
+import uuid
+
+import pytest
+
+import auth_cache as auth_cache_module
+from auth_cache import AuthCache, CachedUser
+
+USER = CachedUser(1, "user-1", "patient")
+
+
+# Function to shift the clock seen by the cache
+@pytest.fixture
+def clock(monkeypatch):
+    now = [time.time()]
+    monkeypatch.setattr(auth_cache_module.time, "time", lambda: now[0])
+    return now
+
+
+def test_cached_token_expires_after_the_ttl(clock):
+    cache = AuthCache(ttl_seconds=60)
+    assert asyncio.run(cache.get("token")) is None
+    asyncio.run(cache.put("token", USER))
+    assert asyncio.run(cache.get("token")) == USER
+    clock[0] += 61
+    assert asyncio.run(cache.get("token")) is None
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 2
+
+
+def test_least_recently_used_token_is_evicted():
+    cache = AuthCache(max_size=2)
+
+    async def scenario():
+        await cache.put("a", USER)
+        await cache.put("b", USER)
+        await cache.get("a")
+        await cache.put("c", USER)
+        return [await cache.get(token) is not None for token in ("a", "b", "c")]
+
+    assert asyncio.run(scenario()) == [True, False, True]
+
+
+def test_invalidated_token_is_looked_up_again():
+    cache = AuthCache()
+    asyncio.run(cache.put("token", USER))
+    asyncio.run(cache.invalidate("token"))
+    asyncio.run(cache.invalidate(None))
+    assert asyncio.run(cache.get("token")) is None
+    assert cache.stats()["invalidations"] == 1
+
+
+def test_shared_store_is_seen_by_every_worker(tmp_path, clock):
+    path = str(tmp_path / "auth.db")
+    # Two caches stand for two uvicorn workers of the same machine
+    first = AuthCache(ttl_seconds=60, shared_path=path, shared_refresh_seconds=1)
+    second = AuthCache(ttl_seconds=60, shared_path=path, shared_refresh_seconds=1)
+
+    asyncio.run(first.put("token", USER))
+    assert asyncio.run(second.get("token")) == USER
+    assert second.stats()["shared_hits"] == 1
+
+    # A logout on the first worker is seen by the second one after the refresh interval
+    asyncio.run(first.invalidate("token"))
+    assert asyncio.run(second.get("token")) == USER
+    clock[0] += 2
+    assert asyncio.run(second.get("token")) is None
+
+    # Tokens expire in the shared store too
+    asyncio.run(first.put("other", USER))
+    clock[0] += 61
+    assert asyncio.run(second.get("other")) is None
+
+
+def test_old_token_is_rejected_after_a_new_login(client):
+    username = f"patient-{uuid.uuid4().hex}"
+    client.cookies.clear()
+    client.post("/api/signup/", json={"username": username, "password": "password"}).raise_for_status()
+    tokens = []
+    for _ in range(2):
+        response = client.post("/api/login/", json={"username": username, "password": "password"})
+        tokens.append(response.json()["session_id"])
+        client.cookies.set("session_token", tokens[-1])
+        # The second request is answered from the cache
+        assert client.get("/api/exercises/").status_code == 200
+        assert client.get("/api/exercises/").status_code == 200
+    client.cookies.set("session_token", tokens[0])
+    assert client.get("/api/exercises/").status_code == 401
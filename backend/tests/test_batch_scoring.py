@@ -0,0 +1,152 @@
+import csv
+import io
+import os
+import shutil
+import tarfile
+
+import numpy as np
+import pytest
+from conftest import REFERENCE_DIRECTORY, REFERENCE_FILES
+
+import batch_scoring
+from batch_scoring import CsvResultWriter, get_exercise_id, get_row, iter_session_files, run_batch_scoring, score_batch
+
+
+# Function to add a file to a tar archive from its content
+def add_member(archive, name, content):
+    member = tarfile.TarInfo(name)
+    member.size = len(content)
+    archive.addfile(member, io.BytesIO(content))
+
+
+@pytest.fixture
+def sessions_directory(tmp_path):
+    directory = tmp_path / "sessions"
+    for exercise_id in ("Es1", "Es3"):
+        (directory / exercise_id).mkdir(parents=True)
+        shutil.copy(os.path.join(REFERENCE_DIRECTORY, REFERENCE_FILES[exercise_id]), directory / exercise_id / "a.csv")
+    (directory / "notes.txt").write_text("not a session")
+    return directory
+
+
+@pytest.mark.parametrize(
+    "source, expected",
+    [
+        ("E_ID12_Es3.csv", "Es3"),
+        ("Es2/session_12.csv", "Es2"),
+        ("Es1/E_ID4_Es5.csv", "Es5"),
+        ("Es12/session.csv", None),
+        ("Tes1/session.csv", None),
+        ("session.csv", None),
+    ],
+)
+def test_get_exercise_id(source, expected):
+    assert get_exercise_id(source) == expected
+
+
+def test_iter_session_files_of_a_directory(sessions_directory):
+    files = list(iter_session_files(str(sessions_directory)))
+    assert [(session_file.source, session_file.exercise_id, error) for session_file, error in files] == [
+        (os.path.join("Es1", "a.csv"), "Es1", None),
+        (os.path.join("Es3", "a.csv"), "Es3", None),
+    ]
+    assert all(os.path.exists(session_file.path) for session_file, _ in files)
+    # The exercise given on the command line is used for every file
+    assert {session_file.exercise_id for session_file, _ in iter_session_files(str(sessions_directory), "Es2")} == {
+        "Es2"
+    }
+
+
+def test_iter_session_files_of_a_tar_archive_reports_unreadable_members(tmp_path):
+    archive_path = tmp_path / "sessions.tar.gz"
+    with tarfile.open(archive_path, "w:gz") as archive:
+        add_member(archive, "Es1/a.csv", b"a,b\n1,2\n")
+        add_member(archive, "Es2/b.csv", b"a,b\n\xff\xfe,2\n")
+        add_member(archive, "readme.md", b"# sessions")
+    files = list(iter_session_files(str(archive_path)))
+    assert len(files) == 2
+    (first, first_error), (second, second_error) = files
+    assert (first.source, first.text, first_error) == ("Es1/a.csv", "a,b\n1,2\n", None)
+    assert (second.source, second.exercise_id, second.text) == ("Es2/b.csv", "Es2", None)
+    assert second_error.startswith("UnicodeDecodeError")
+
+
+def test_iter_session_files_rejects_other_inputs(tmp_path):
+    path = tmp_path / "scores.csv"
+    path.write_text("source\n")
+    with pytest.raises(ValueError):
+        list(iter_session_files(str(path)))
+
+
+def test_csv_writer_drops_a_partial_last_line(tmp_path):
+    path = str(tmp_path / "scores.csv")
+    session_file = batch_scoring.SessionFile("Es1/a.csv", "Es1", None, None)
+    writer = CsvResultWriter(path)
+    writer.write([get_row(session_file, "Es1", 100, 0.5, "keras:1")])
+    writer.close()
+    # A run killed in the middle of a row
+    with open(path, "a") as output_file:
+        output_file.write("Es1/b.csv,Es1,12")
+
+    writer = CsvResultWriter(path)
+    writer.write([get_row(session_file._replace(source="Es1/c.csv"), "Es1", error="ValueError: bad")])
+    writer.close()
+    rows = CsvResultWriter.read_rows(path)
+    assert [(row["source"], row["status"]) for row in rows] == [("Es1/a.csv", "ok"), ("Es1/c.csv", "error")]
+    with open(path, newline="") as output_file:
+        assert next(csv.reader(output_file)) == batch_scoring.OUTPUT_COLUMNS
+
+
+def test_score_batch_scores_the_valid_files_in_one_call(tmp_path, monkeypatch):
+    calls = []
+
+    def predict_batch(exercise_id, data, padding_mask):
+        calls.append((exercise_id, data.shape, padding_mask.shape))
+        return np.full((len(data), 1), 0.75, dtype=np.float32)
+
+    monkeypatch.setattr(batch_scoring, "predict_batch", predict_batch)
+    path = os.path.join(REFERENCE_DIRECTORY, REFERENCE_FILES["Es1"])
+    session_files = [
+        batch_scoring.SessionFile("a.csv", "Es1", path, None),
+        batch_scoring.SessionFile("b.csv", "Es1", None, "a,b\n1,2\n"),
+        batch_scoring.SessionFile("c.csv", "Es1", path, None),
+    ]
+    rows = score_batch("Es1", session_files)
+    assert len(calls) == 1 and calls[0][1][0] == 2
+    by_source = {row["source"]: row for row in rows}
+    assert by_source["b.csv"]["status"] == "error"
+    assert "joint columns missing" in by_source["b.csv"]["error"]
+    assert by_source["a.csv"]["status"] == by_source["c.csv"]["status"] == "ok"
+    assert by_source["a.csv"]["clinical_score"] == pytest.approx(0.75)
+
+
+def test_score_batch_reports_model_errors_on_every_file(monkeypatch):
+    def predict_batch(exercise_id, data, padding_mask):
+        raise RuntimeError("model file missing")
+
+    monkeypatch.setattr(batch_scoring, "predict_batch", predict_batch)
+    path = os.path.join(REFERENCE_DIRECTORY, REFERENCE_FILES["Es1"])
+    rows = score_batch("Es1", [batch_scoring.SessionFile(name, "Es1", path, None) for name in ("a.csv", "b.csv")])
+    assert [row["status"] for row in rows] == ["error", "error"]
+    assert rows[0]["error"] == "RuntimeError: model file missing"
+    assert rows[0]["frames"] > 0
+
+
+def test_run_batch_scoring_records_unscorable_files_and_resumes(tmp_path):
+    archive_path = tmp_path / "sessions.tar"
+    with tarfile.open(archive_path, "w") as archive:
+        add_member(archive, "unknown/a.csv", b"a,b\n1,2\n")
+        add_member(archive, "Es2/b.csv", b"\xff\xfe")
+    output_path = str(tmp_path / "scores.csv")
+
+    # No file reaches the worker processes, so no model is loaded
+    stats = run_batch_scoring(str(archive_path), output_path, workers=1)
+    assert (stats["errors"], stats["skipped"]) == (2, 0)
+    rows = CsvResultWriter.read_rows(output_path)
+    assert [(row["source"], row["status"]) for row in rows] == [("unknown/a.csv", "error"), ("Es2/b.csv", "error")]
+    assert rows[0]["error"].startswith("No exercise id")
+
+    stats = run_batch_scoring(str(archive_path), output_path, workers=1)
+    assert (stats["errors"], stats["skipped"]) == (0, 2)
+    stats = run_batch_scoring(str(archive_path), output_path, workers=1, retry_errors=True)
+    assert (stats["errors"], stats["skipped"]) == (2, 0)
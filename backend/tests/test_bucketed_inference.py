@@ -0,0 +1,88 @@
+import numpy as np
+import pytest
+
+from bucketed_inference import BucketedModel, UnsupportedModelError, get_active_windows, keras_nlp, tf
+
+MAX_LENGTH = 40
+NUM_WINDOWS = 4
+NUM_FEATURES = 6
+MAX_FRAMES = 25
+
+
+# Function to build a small model with the architecture of the clinical score models: the input is split into
+# windows embedded by shared dense layers and encoded by one shared transformer encoder, then a dense head
+def build_windowed_model(num_windows=NUM_WINDOWS):
+    tf.keras.utils.set_random_seed(0)
+    inputs = tf.keras.Input(shape=(MAX_LENGTH, NUM_FEATURES), name="orignal_data")
+    padding_masks = tf.keras.Input(shape=(MAX_LENGTH,), name="padding_masks")
+    embedding = tf.keras.layers.Dense(8, activation="relu")
+    encoder = keras_nlp.layers.TransformerEncoder(intermediate_dim=8, num_heads=2)
+    encoded = [
+        encoder(embedding(window), window_mask)
+        for window, window_mask in zip(
+            tf.split(inputs, num_windows, axis=1), tf.split(padding_masks, num_windows, axis=1)
+        )
+    ]
+    outputs = tf.keras.layers.Flatten()(tf.concat(encoded, axis=1))
+    outputs = tf.keras.layers.Dense(4, activation="relu")(outputs)
+    outputs = tf.keras.layers.Dense(1)(outputs)
+    return tf.keras.Model(inputs=[inputs, padding_masks], outputs=outputs)
+
+
+# Function to build prepared inputs holding the given numbers of frames, padded with zero frames
+def get_inputs(frame_counts, seed=0):
+    rng = np.random.default_rng(seed)
+    data = np.zeros((len(frame_counts), MAX_LENGTH, NUM_FEATURES), dtype=np.float32)
+    padding_masks = np.ones((len(frame_counts), MAX_LENGTH), dtype=np.float32)
+    for row, frames in enumerate(frame_counts):
+        data[row, :frames] = rng.normal(size=(frames, NUM_FEATURES))
+        padding_masks[row, :frames] = 0
+    return data, padding_masks
+
+
+@pytest.fixture(scope="module")
+def bucketed_model():
+    return BucketedModel(build_windowed_model(), MAX_LENGTH, max_frames=MAX_FRAMES)
+
+
+@pytest.mark.parametrize("frame_counts, expected", [([1], 1), ([10], 1), ([11], 2), ([3, 25], 3), ([40], 4)])
+def test_get_active_windows(frame_counts, expected):
+    assert get_active_windows(*get_inputs(frame_counts), window_size=10) == expected
+
+
+def test_get_active_windows_needs_zero_padding_at_the_end():
+    data, padding_masks = get_inputs([5])
+    data[0, 30] = 1.0
+    assert get_active_windows(data, padding_masks, window_size=10) is None
+    data, padding_masks = get_inputs([5])
+    padding_masks[0, 0] = 1
+    padding_masks[0, 35] = 0
+    assert get_active_windows(data, padding_masks, window_size=10) is None
+
+
+def test_bucketed_model_matches_the_full_model(bucketed_model):
+    assert (bucketed_model.num_windows, bucketed_model.window_size, bucketed_model.max_active_windows) == (4, 10, 3)
+    assert bucketed_model.check_parity() < 1e-4
+    data, padding_masks = get_inputs([4, 17, 25], seed=1)
+    expected = bucketed_model.model([data, padding_masks], training=False).numpy()
+    np.testing.assert_allclose(bucketed_model.predict(data, padding_masks), expected, atol=1e-4)
+    assert bucketed_model.stats()["bucket_calls"][3] >= 1
+
+
+def test_inputs_without_trailing_padding_use_the_full_model(bucketed_model):
+    full_calls = bucketed_model.full_calls
+    data, padding_masks = get_inputs([40])
+    expected = bucketed_model.model([data, padding_masks], training=False).numpy()
+    np.testing.assert_allclose(bucketed_model.predict(data, padding_masks), expected, atol=1e-5)
+    assert bucketed_model.full_calls == full_calls + 1
+
+
+def test_unsupported_models_are_rejected():
+    inputs = tf.keras.Input(shape=(MAX_LENGTH, NUM_FEATURES))
+    padding_masks = tf.keras.Input(shape=(MAX_LENGTH,))
+    outputs = tf.keras.layers.Dense(1)(tf.keras.layers.Flatten()(inputs))
+    with pytest.raises(UnsupportedModelError):
+        BucketedModel(tf.keras.Model(inputs=[inputs, padding_masks], outputs=outputs), MAX_LENGTH)
+    # The input length must be split into whole windows
+    with pytest.raises(UnsupportedModelError):
+        BucketedModel(build_windowed_model(), MAX_LENGTH + 2)
@@ -0,0 +1,40 @@
+import os
+import subprocess
+import sys
+
+from conftest import BACKEND_DIRECTORY
+
+
+# Function to start a server process bootstrapping a database, like a worker of a deployment at startup
+def start_bootstrap(database_url):
+    return subprocess.Popen(
+        [sys.executable, "-c", "import data_wrapper; print(data_wrapper.bootstrap_db())"],
+        cwd=BACKEND_DIRECTORY,
+        env={**os.environ, "REHABAI_DATABASE_URL": database_url},
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+
+
+# Function to wait for bootstrap processes, returns what bootstrap_db returned in each of them
+def wait_for_bootstraps(processes):
+    results = []
+    for process in processes:
+        stdout, stderr = process.communicate(timeout=120)
+        assert process.returncode == 0, stderr
+        results.append(stdout.strip())
+    return results
+
+
+def test_bootstrap_runs_once(tmp_path):
+    database_url = f"sqlite:///{tmp_path}/RehabAI.db"
+    assert wait_for_bootstraps([start_bootstrap(database_url)]) == ["True"]
+    # The database is up to date, the next start skips the bootstrap
+    assert wait_for_bootstraps([start_bootstrap(database_url)]) == ["False"]
+
+
+def test_concurrent_workers_bootstrap_once(tmp_path):
+    database_url = f"sqlite:///{tmp_path}/RehabAI.db"
+    results = wait_for_bootstraps([start_bootstrap(database_url) for _ in range(4)])
+    assert sorted(results) == ["False", "False", "False", "True"]
@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+from tslearn.metrics import dtw
+
+from dtw_wrapper import IncrementalDTW, batch_dtw
+
+
+# Costs of every channel computed by tslearn, the reference implementation used by the legacy feedback endpoint
+def tslearn_costs(queries, references, sakoe_chiba_radius=None):
+    options = {} if sakoe_chiba_radius is None else {
+        "global_constraint": "sakoe_chiba",
+        "sakoe_chiba_radius": sakoe_chiba_radius,
+    }
+    return np.array(
+        [dtw(queries[:, channel], references[:, channel], **options) for channel in range(queries.shape[1])]
+    )
+
+
+@pytest.fixture
+def random_series():
+    generator = np.random.default_rng(0)
+    # Random walks look more like joint angles than white noise
+    return lambda length, channels=4: np.cumsum(generator.normal(size=(length, channels)), axis=0)
+
+
+@pytest.mark.parametrize("query_length, reference_length", [(1, 1), (20, 20), (37, 25), (12, 50)])
+def test_batch_dtw_matches_tslearn(random_series, query_length, reference_length):
+    queries, references = random_series(query_length), random_series(reference_length)
+    np.testing.assert_allclose(batch_dtw(queries, references), tslearn_costs(queries, references), rtol=1e-10)
+
+
+@pytest.mark.parametrize("radius", [0, 3, 10])
+def test_batch_dtw_matches_tslearn_with_sakoe_chiba_band(random_series, radius):
+    queries, references = random_series(30), random_series(30)
+    np.testing.assert_allclose(
+        batch_dtw(queries, references, radius), tslearn_costs(queries, references, radius), rtol=1e-10
+    )
+
+
+def test_batch_dtw_without_frames_has_no_alignment(random_series):
+    assert np.all(np.isinf(batch_dtw(np.empty((0, 4)), random_series(5))))
+
+
+@pytest.mark.parametrize("radius", [None, 5])
+def test_incremental_dtw_matches_tslearn_after_every_chunk(random_series, radius):
+    queries, references = random_series(60), random_series(60)
+    # Small initial capacity so the buffers grow during the test
+    incremental = IncrementalDTW(num_channels=4, sakoe_chiba_radius=radius, capacity=8)
+    generator = np.random.default_rng(1)
+    end = 0
+    while end < len(queries):
+        start, end = end, min(len(queries), end + int(generator.integers(1, 9)))
+        costs = incremental.extend(queries[start:end].T, references[start:end].T)
+        np.testing.assert_allclose(
+            costs, tslearn_costs(queries[:end], references[:end], radius), rtol=1e-10
+        )
+
+
+def test_incremental_dtw_with_different_query_and_reference_lengths(random_series):
+    queries, references = random_series(40), random_series(25)
+    incremental = IncrementalDTW(num_channels=4)
+    incremental.extend(queries[:10].T, references[:5].T)
+    costs = incremental.extend(queries[10:].T, references[5:].T)
+    np.testing.assert_allclose(costs, tslearn_costs(queries, references), rtol=1e-10)
+
+
+def test_incremental_dtw_outside_the_band_has_no_alignment(random_series):
+    incremental = IncrementalDTW(num_channels=4, sakoe_chiba_radius=2)
+    costs = incremental.extend(random_series(10).T, random_series(3).T)
+    assert np.all(np.isinf(costs))
@@ -0,0 +1,163 @@
+import gzip
+import io
+import zlib
+
+import numpy as np
+import pytest
+
+from frame_codec import (
+    FRAME_BUFFER_HEADER,
+    MAX_UPLOAD_BYTES,
+    FrameDecodeError,
+    UnsupportedEncodingError,
+    decode_frames,
+    decompress,
+    encode_frames,
+)
+
+
+@pytest.fixture
+def frames():
+    return np.random.default_rng(0).normal(size=(30, 51)).astype(np.float32)
+
+
+# Function to save frames as a .npy file
+def to_npy(frames):
+    stream = io.BytesIO()
+    np.save(stream, frames)
+    return stream.getvalue()
+
+
+def test_frame_buffer_round_trip(frames):
+    np.testing.assert_array_equal(decode_frames(encode_frames(frames)), frames)
+
+
+@pytest.mark.parametrize("order", ["C", "F"])
+@pytest.mark.parametrize("dtype", [np.float32, np.float64])
+def test_npy_upload(frames, order, dtype):
+    decoded = decode_frames(to_npy(np.asarray(frames, dtype=dtype, order=order)))
+    assert decoded.dtype == np.float32
+    np.testing.assert_array_equal(decoded, frames)
+
+
+def test_gzip_upload(frames):
+    np.testing.assert_array_equal(decode_frames(gzip.compress(encode_frames(frames)), "gzip"), frames)
+
+
+def test_zstd_upload(frames):
+    zstandard = pytest.importorskip("zstandard")
+    body = zstandard.ZstdCompressor().compress(encode_frames(frames))
+    np.testing.assert_array_equal(decode_frames(body, "zstd"), frames)
+
+
+def test_corrupt_zstd_body_is_a_decode_error():
+    pytest.importorskip("zstandard")
+    with pytest.raises(FrameDecodeError):
+        decompress(b"\x28\xb5\x2f\xfd garbage", "zstd")
+
+
+@pytest.mark.parametrize(
+    "body",
+    [
+        b"\x1f\x8b not gzip",
+        # Valid gzip header followed by a corrupt deflate stream
+        gzip.compress(b"x" * 100)[:10] + b"\xff" * 20,
+    ],
+)
+def test_corrupt_gzip_body_is_a_decode_error(body):
+    with pytest.raises(FrameDecodeError):
+        decompress(body, "gzip")
+
+
+def test_truncated_gzip_body_is_a_decode_error(frames):
+    body = gzip.compress(encode_frames(frames))
+    with pytest.raises(FrameDecodeError, match="Truncated"):
+        decompress(body[: len(body) // 2], "gzip")
+
+
+def test_oversized_upload_is_rejected():
+    body = zlib.compress(b"\0" * (MAX_UPLOAD_BYTES + 1), wbits=16 + zlib.MAX_WBITS)
+    with pytest.raises(FrameDecodeError, match="too large"):
+        decompress(body, "gzip")
+    with pytest.raises(FrameDecodeError, match="too large"):
+        decompress(b"\0" * 101, "identity", max_bytes=100)
+
+
+def test_unsupported_encoding(frames):
+    with pytest.raises(UnsupportedEncodingError):
+        decode_frames(encode_frames(frames), "br")
+
+
+@pytest.mark.parametrize(
+    "mutate",
+    [
+        lambda body: body[: FRAME_BUFFER_HEADER.size - 1],
+        lambda body: b"XXXX" + body[4:],
+        lambda body: body[:-4],
+        lambda body: body[:5] + b"\x02" + body[6:],
+    ],
+    ids=["short header", "bad magic", "size mismatch", "not float32"],
+)
+def test_invalid_frame_buffer(frames, mutate):
+    with pytest.raises(FrameDecodeError):
+        decode_frames(mutate(encode_frames(frames)))
+
+
+def test_wrong_number_of_columns(frames):
+    with pytest.raises(FrameDecodeError, match="51 columns"):
+        decode_frames(encode_frames(frames[:, :50]))
+    with pytest.raises(FrameDecodeError):
+        decode_frames(to_npy(frames[:, :50]))
+
+
+def test_npy_upload_must_be_a_2d_float_array(frames):
+    with pytest.raises(FrameDecodeError):
+        decode_frames(to_npy(frames.astype(np.int32)))
+    with pytest.raises(FrameDecodeError):
+        decode_frames(to_npy(frames[0]))
+
+
+@pytest.mark.parametrize(
+    "body, content_encoding, status_code",
+    [
+        (b"\x1f\x8b not gzip", "gzip", 400),
+        (b"RHAI", None, 400),
+        (b"anything", "br", 415),
+    ],
+)
+def test_invalid_uploads_are_client_errors(user_client, frames, body, content_encoding, status_code):
+    headers = {"Content-Encoding": content_encoding} if content_encoding else {}
+    response = user_client.post("/api/clinical_score/Es1/frames", content=body, headers=headers)
+    assert response.status_code == status_code
+
+    session_id = user_client.post("/api/scoring_sessions/Es1").json()["session_id"]
+    response = user_client.post(f"/api/scoring_sessions/{session_id}/frames", content=body, headers=headers)
+    assert response.status_code == status_code
+    # The session is still open and accepts valid chunks
+    response = user_client.post(f"/api/scoring_sessions/{session_id}/frames", content=encode_frames(frames))
+    assert response.json()["frames"] == len(frames)
+
+
+@pytest.mark.parametrize("chunked", [False, True])
+def test_oversized_request_bodies_are_rejected_while_streaming(user_client, monkeypatch, frames, chunked):
+    import main
+
+    monkeypatch.setattr(main, "MAX_UPLOAD_BYTES", 1000)
+    monkeypatch.setattr(main, "SCORING_CHUNK_MAX_BYTES", 1000)
+    body = encode_frames(frames)
+    assert len(body) > 1000
+
+    # Function to send the body with a Content-Length header, or in chunks without it
+    def get_content():
+        if not chunked:
+            return body
+        return (body[start : start + 256] for start in range(0, len(body), 256))
+
+    response = user_client.post("/api/clinical_score/Es1/frames", content=get_content())
+    assert response.status_code == 413
+    session_id = user_client.post("/api/scoring_sessions/Es1").json()["session_id"]
+    response = user_client.post(f"/api/scoring_sessions/{session_id}/frames", content=get_content())
+    assert response.status_code == 413
+    # Bodies within the limit are still accepted
+    response = user_client.post(f"/api/scoring_sessions/{session_id}/frames", content=encode_frames(frames[:2]))
+    assert response.json()["frames"] == 2
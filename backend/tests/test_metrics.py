@@ -0,0 +1,40 @@
+import main
+from ml_wrapper import get_dataframe_cols
+
+
+# Function to read the metrics with the status token
+def get_metrics(client, monkeypatch):
+    monkeypatch.setattr(main, "STATUS_TOKEN", "status-token")
+    response = client.get("/metrics", headers={"X-Status-Token": "status-token"})
+    assert response.status_code == 200
+    return response.text
+
+
+def test_metrics_require_the_status_token(client, monkeypatch):
+    monkeypatch.setattr(main, "STATUS_TOKEN", "status-token")
+    assert client.get("/metrics").status_code == 403
+    assert client.get("/metrics", headers={"Authorization": "Bearer wrong"}).status_code == 403
+    assert client.get("/metrics", headers={"Authorization": "Bearer status-token"}).status_code == 200
+
+
+def test_unknown_exercises_do_not_create_metric_series(user_client, monkeypatch):
+    response = user_client.post(
+        "/api/feedback/Es1-made-up",
+        json={"referenceJointValues": [0.0, 1.0, 2.0], "currentJointValues": [0.0, 1.5]},
+    )
+    assert response.status_code == 200
+    column = get_dataframe_cols()[0]
+    response = user_client.post(
+        "/api/feedback/Es2-made-up/batch",
+        json={"columns": [column], "currentFrames": [[0.0], [1.0]], "referenceFrames": [[0.0], [2.0]]},
+    )
+    assert response.status_code == 200
+    assert user_client.post(
+        "/api/feedback/Es3/batch",
+        json={"columns": [column], "currentFrames": [[0.0], [1.0]], "referenceFrames": [[0.0], [2.0]]},
+    ).status_code == 200
+
+    metrics = get_metrics(user_client, monkeypatch)
+    assert "made-up" not in metrics
+    assert 'rehabai_stage_duration_seconds_count{stage="feedback_dtw",exercise_id="Es3"}' in metrics
+    assert 'rehabai_stage_duration_seconds_count{stage="feedback_dtw",exercise_id=""}' in metrics
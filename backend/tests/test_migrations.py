@@ -0,0 +1,54 @@
+from datetime import datetime
+
+import pytest
+from sqlalchemy import create_engine, inspect, select, text
+
+import models
+from migrations import MIGRATIONS, get_schema_version, run_migrations
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path}/RehabAI.db")
+    yield engine
+    engine.dispose()
+
+
+def test_new_database_is_migrated_once(engine):
+    models.Base.metadata.create_all(bind=engine)
+    assert run_migrations(engine) == [version for version, _, _ in MIGRATIONS]
+    assert run_migrations(engine) == []
+    with engine.connect() as connection:
+        assert get_schema_version(connection) == MIGRATIONS[-1][0]
+
+
+def test_database_created_before_the_migrations_is_upgraded(engine):
+    # Tables of the first release, with a progress history but no summary or rollups
+    tables = [models.User.__table__, models.Exercise.__table__, models.AssignedExercise.__table__]
+    models.Base.metadata.create_all(bind=engine, tables=tables + [models.ProgressTracker.__table__])
+    with engine.begin() as connection:
+        connection.execute(text("INSERT INTO users (user_id, username, password) VALUES ('u1', 'patient', 'x')"))
+        for day, score in enumerate([0.2, 0.8, 0.5], start=1):
+            connection.execute(
+                models.ProgressTracker.__table__.insert().values(
+                    user_id="u1", exercise_id="Es1", date=datetime(2024, 1, day), score=score, performance_count=day
+                )
+            )
+
+    run_migrations(engine)
+
+    table_names = inspect(engine).get_table_names()
+    assert {"progress_summary", "progress_rollups", "schema_version"} <= set(table_names)
+    index_names = {index["name"] for index in inspect(engine).get_indexes("progress_tracker")}
+    assert "ix_progress_tracker_user_exercise_date" in index_names
+    with engine.connect() as connection:
+        summary = connection.execute(select(models.ProgressSummary.__table__)).one()
+        daily_rollups = connection.execute(
+            select(models.ProgressRollup.__table__).where(models.ProgressRollup.period == "day")
+        ).all()
+    assert summary.performance_count == 3
+    assert summary.last_score == 0.5
+    assert summary.best_score == 0.8
+    assert summary.mean_score == pytest.approx(0.5)
+    assert summary.last_date == datetime(2024, 1, 3)
+    assert len(daily_rollups) == 3
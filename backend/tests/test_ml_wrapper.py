@@ -0,0 +1,92 @@
+import numpy as np
+import pandas as pd
+import pytest
+from conftest import read_reference_session
+
+from joint_features import get_es1_features
+from ml_wrapper import (
+    MAX_FRAMES,
+    MAX_LENGTH_MAPPING,
+    PIPELINES,
+    PREPROCESSING_CONFIG,
+    cols_drop,
+    moving_average,
+    prepare_csv_data,
+    prepare_data,
+)
+
+
+# Data preparation of the original pandas implementation, the compiled pipelines must give the same model input
+def prepare_with_pandas(df, max_length, exercise_id):
+    config = PREPROCESSING_CONFIG[exercise_id]
+    df = df.head(MAX_FRAMES)
+    window = config.get("smoothing_window", 10)
+    if config.get("use_joint_positions"):
+        values = df.drop(cols_drop, axis=1)
+        if config.get("smooth_joint_positions"):
+            values = values.rolling(window).mean()
+    else:
+        values = get_es1_features(df)
+        if config.get("smooth_joint_features"):
+            values = values.rolling(window).mean()
+    padding_length = max_length - len(df)
+    data = np.pad(values.to_numpy(), ((0, padding_length), (0, 0)))[np.newaxis]
+    padding_mask = np.concatenate([np.zeros(len(df)), np.ones(padding_length)])[np.newaxis]
+    return np.nan_to_num(data), padding_mask
+
+
+@pytest.mark.parametrize("window", [1, 5, 10])
+@pytest.mark.parametrize("num_rows", [3, 10, 50])
+def test_moving_average_matches_pandas_rolling_mean(window, num_rows):
+    values = np.random.default_rng(0).normal(size=(num_rows, 6))
+    # Missing keypoints are NaN in the uploaded sessions
+    values[num_rows // 2, 1] = np.nan
+    values[0, 4] = np.nan
+    out = np.empty_like(values)
+    moving_average(values, window, out)
+    expected = pd.DataFrame(values).rolling(window).mean().to_numpy()
+    np.testing.assert_allclose(out, expected, rtol=1e-12, equal_nan=True)
+
+
+def test_pipeline_matches_pandas_preparation(exercise_id):
+    df = read_reference_session(exercise_id)
+    max_length = MAX_LENGTH_MAPPING[exercise_id]
+    data, padding_mask = prepare_data(df, max_length, exercise_id)
+    expected_data, expected_padding_mask = prepare_with_pandas(df, max_length, exercise_id)
+    assert data.shape == (1, max_length, PIPELINES[exercise_id].num_features)
+    np.testing.assert_allclose(data, expected_data, rtol=1e-5, atol=1e-6)
+    np.testing.assert_array_equal(padding_mask, expected_padding_mask)
+
+
+def test_pipeline_handles_short_sessions_with_missing_values(exercise_id):
+    df = read_reference_session(exercise_id).head(7).copy()
+    df.iloc[3, 20] = np.nan
+    max_length = MAX_LENGTH_MAPPING[exercise_id]
+    data, padding_mask = prepare_data(df, max_length, exercise_id)
+    expected_data, expected_padding_mask = prepare_with_pandas(df, max_length, exercise_id)
+    np.testing.assert_allclose(data, expected_data, rtol=1e-5, atol=1e-6)
+    np.testing.assert_array_equal(padding_mask, expected_padding_mask)
+
+
+def test_pipeline_writes_into_reused_buffers(exercise_id):
+    pipeline = PIPELINES[exercise_id]
+    frames = read_reference_session(exercise_id).to_numpy(dtype=np.float32)
+    out_data = np.full((1, pipeline.max_length, pipeline.num_features), 7, dtype=np.float32)
+    out_padding_mask = np.empty((1, pipeline.max_length), dtype=np.float32)
+    # A longer session prepared into the buffers before must not leave values behind
+    pipeline.run(frames, out_data=out_data, out_padding_mask=out_padding_mask)
+    pipeline.run(frames[:100], out_data=out_data, out_padding_mask=out_padding_mask)
+    expected_data, expected_padding_mask = pipeline.run(frames[:100])
+    np.testing.assert_array_equal(out_data, expected_data)
+    np.testing.assert_array_equal(out_padding_mask, expected_padding_mask)
+
+
+def test_csv_preparation_matches_dataframe_preparation(exercise_id):
+    df = read_reference_session(exercise_id)
+    max_length = MAX_LENGTH_MAPPING[exercise_id]
+    # Columns in another order than get_dataframe_cols, as sent by some clients
+    csv_string = df[df.columns[::-1]].to_csv(index=False)
+    data, padding_mask = prepare_csv_data(csv_string, max_length, exercise_id)
+    expected_data, expected_padding_mask = prepare_data(df, max_length, exercise_id)
+    np.testing.assert_allclose(data, expected_data, rtol=1e-6, atol=1e-6)
+    np.testing.assert_array_equal(padding_mask, expected_padding_mask)
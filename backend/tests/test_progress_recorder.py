@@ -0,0 +1,133 @@
+import asyncio
+
+import pytest
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import NullPool
+
+import models
+from data_wrapper import initialize_db
+from database import URL_DATABASE, get_async_url
+from progress_recorder import ProgressRecorder
+
+
+# Session factory of a database that is down, or of a real database after a number of failed writes
+class FailingSessionFactory:
+    def __init__(self, failures, session_factory=None):
+        self.failures = failures
+        self.session_factory = session_factory
+        self.attempts = 0
+
+    def __call__(self):
+        self.attempts += 1
+        if self.attempts <= self.failures:
+            raise ConnectionError("database is down")
+        return self.session_factory()
+
+
+# Session factory of the test database, with a new engine since every test runs its own event loop
+@pytest.fixture
+def session_factory():
+    # Tables of the test database (also created by the API startup)
+    initialize_db()
+    engine = create_async_engine(get_async_url(URL_DATABASE), poolclass=NullPool)
+    yield async_sessionmaker(engine, expire_on_commit=False)
+    asyncio.run(engine.dispose())
+
+
+# Function to count the stored scores of a user
+async def count_scores(session_factory, user_id):
+    async with session_factory() as db:
+        return await db.scalar(
+            select(func.count()).select_from(models.ProgressTracker).where(models.ProgressTracker.user_id == user_id)
+        )
+
+
+def test_scores_are_written_in_batches(session_factory):
+    recorder = ProgressRecorder(session_factory=session_factory, write_behind=True, batch_size=10, flush_ms=10)
+
+    async def scenario():
+        recorder.start()
+        for score in range(25):
+            await recorder.record("batch-user", "Es1", score / 25)
+        await recorder.stop()
+        return await count_scores(session_factory, "batch-user")
+
+    assert asyncio.run(scenario()) == 25
+    assert recorder.stats()["batches"] == 3
+
+
+def test_waiting_request_gets_its_performance_count(session_factory):
+    recorder = ProgressRecorder(session_factory=session_factory, write_behind=False, flush_ms=10)
+
+    async def scenario():
+        recorder.start()
+        counts = [await recorder.record("count-user", "Es2", 0.5) for _ in range(3)]
+        await recorder.stop()
+        return counts
+
+    assert asyncio.run(scenario()) == [1, 2, 3]
+
+
+def test_failed_write_is_raised_to_the_waiting_request():
+    recorder = ProgressRecorder(session_factory=FailingSessionFactory(failures=1), write_behind=False)
+
+    async def scenario():
+        with pytest.raises(ConnectionError):
+            await recorder.record("user", "Es1", 0.5)
+
+    asyncio.run(scenario())
+    assert recorder.stats()["failures"] == 1
+
+
+def test_failed_write_of_a_cancelled_request_keeps_the_writer_running(session_factory):
+    factory = FailingSessionFactory(failures=1, session_factory=session_factory)
+    recorder = ProgressRecorder(session_factory=factory, write_behind=False, flush_ms=10)
+
+    async def scenario():
+        recorder.start()
+        # The client disconnects while its score is being written, then the write fails
+        request = asyncio.create_task(recorder.record("cancelled-user", "Es1", 0.5))
+        await asyncio.sleep(0)
+        request.cancel()
+        await asyncio.sleep(0.1)
+        assert not recorder._task.done()
+        # The next scores are still written
+        count = await recorder.record("cancelled-user", "Es1", 0.7)
+        await recorder.stop()
+        return count
+
+    assert asyncio.run(scenario()) == 1
+    assert recorder.stats()["failures"] == 1
+
+
+def test_write_behind_scores_are_retried_then_dropped(session_factory):
+    factory = FailingSessionFactory(failures=2, session_factory=session_factory)
+    recorder = ProgressRecorder(session_factory=factory, write_behind=True, flush_ms=10, max_attempts=3)
+
+    async def scenario():
+        recorder.start()
+        await recorder.record("retried-user", "Es3", 0.5)
+        # Two failed attempts, the third one succeeds
+        for _ in range(50):
+            if recorder.stats()["written"]:
+                break
+            await asyncio.sleep(0.02)
+        await recorder.stop()
+        return await count_scores(session_factory, "retried-user")
+
+    assert asyncio.run(scenario()) == 1
+    assert recorder.stats()["failures"] == 2
+
+    failing_recorder = ProgressRecorder(
+        session_factory=FailingSessionFactory(failures=10), write_behind=True, max_attempts=2
+    )
+
+    async def failing_scenario():
+        # Without a background writer every record is written right away
+        await failing_recorder.record("dropped-user", "Es3", 0.5)
+        await failing_recorder.flush()
+
+    asyncio.run(failing_scenario())
+    assert failing_recorder.stats()["dropped"] == 1
+    assert failing_recorder.stats()["pending"] == 0
@@ -0,0 +1,198 @@
+import asyncio
+from collections import OrderedDict
+
+import numpy as np
+import pytest
+from conftest import read_reference_session
+
+import main
+from frame_codec import encode_frames
+from score_cache import IdempotencyKeyReused, ScoreCache, get_content_key
+
+
+@pytest.fixture
+def frames():
+    return read_reference_session("Es4").head(120).to_numpy(dtype=np.float32)
+
+
+# Model predictions replaced by a counter, so the tests see when a score is computed rather than replayed
+@pytest.fixture
+def predictions(monkeypatch):
+    calls = []
+
+    async def predict(exercise_id, data, padding_mask):
+        calls.append(exercise_id)
+        return np.array([[float(np.abs(data).sum()) % 1]], dtype=np.float32)
+
+    monkeypatch.setattr(main.inference_batcher, "predict", predict)
+    # Scores cached by the previous tests would hide the predictions
+    monkeypatch.setattr(main.score_cache, "_scores", OrderedDict())
+    return calls
+
+
+# Function to get the number of stored scores of an exercise of the logged in user
+def get_performance_count(client, exercise_id):
+    exercises = client.get("/api/progress/").json()["exercises"]
+    return next((entry["performance_count"] for entry in exercises if entry["exercise_id"] == exercise_id), 0)
+
+
+def test_content_key_depends_on_exercise_model_version_and_frames(frames):
+    key = get_content_key("Es4", "keras:1", frames)
+    assert key == get_content_key("Es4", "keras:1", frames.copy())
+    assert key != get_content_key("Es3", "keras:1", frames)
+    assert key != get_content_key("Es4", "keras:2", frames)
+    assert key != get_content_key("Es4", "keras:1", frames[:-1])
+
+
+def test_scores_are_evicted_least_recently_used_first():
+    cache = ScoreCache(max_size=2, path=None)
+
+    async def scenario():
+        await cache.put("a", [[1.0]])
+        await cache.put("b", [[2.0]])
+        await cache.get("a")
+        await cache.put("c", [[3.0]])
+        return [await cache.get(key) for key in ("a", "b", "c")]
+
+    assert asyncio.run(scenario()) == [[[1.0]], None, [[3.0]]]
+    assert cache.stats()["hits"] == 3
+
+
+def test_disabled_cache_stores_nothing():
+    cache = ScoreCache(max_size=0, path=None)
+
+    async def scenario():
+        await cache.put("a", [[1.0]])
+        return await cache.get("a")
+
+    assert asyncio.run(scenario()) is None
+
+
+def test_disk_store_is_shared_across_instances(tmp_path):
+    path = str(tmp_path / "scores.db")
+
+    async def write():
+        cache = ScoreCache(path=path)
+        await cache.put("a", [[1.0]])
+        await cache.put_response("user", "key", "a", {"clinical_score": [[1.0]]})
+
+    async def read():
+        cache = ScoreCache(path=path)
+        return await cache.get("a"), await cache.get_response("user", "key", "a"), cache.stats()["disk_hits"]
+
+    asyncio.run(write())
+    assert asyncio.run(read()) == ([[1.0]], {"clinical_score": [[1.0]]}, 1)
+
+
+def test_idempotency_key_reused_for_another_submission():
+    cache = ScoreCache(path=None)
+
+    async def scenario():
+        await cache.put_response("user", "key", "content", {"clinical_score": [[1.0]]})
+        assert await cache.get_response("user", "key", "content") == {"clinical_score": [[1.0]]}
+        # Keys belong to a user
+        assert await cache.get_response("other user", "key", "other content") is None
+        with pytest.raises(IdempotencyKeyReused):
+            await cache.get_response("user", "key", "other content")
+
+    asyncio.run(scenario())
+
+
+def test_idempotency_keys_expire():
+    cache = ScoreCache(path=None, idempotency_ttl_seconds=0)
+
+    async def scenario():
+        await cache.put_response("user", "key", "content", {"clinical_score": [[1.0]]})
+        return await cache.get_response("user", "key", "other content")
+
+    assert asyncio.run(scenario()) is None
+
+
+def test_idempotency_guard_runs_one_submission_per_key_at_a_time():
+    cache = ScoreCache(path=None)
+    events = []
+
+    async def submission(name, key):
+        async with cache.idempotency_guard("user", key):
+            events.append(f"{name} start")
+            await asyncio.sleep(0.01)
+            events.append(f"{name} end")
+
+    async def scenario():
+        await asyncio.gather(submission("first", "key"), submission("retry", "key"), submission("other", "other key"))
+
+    asyncio.run(scenario())
+    assert events.index("first end") < events.index("retry start")
+    assert events.index("other start") < events.index("first end")
+    # The locks of finished submissions are released
+    assert cache._key_locks == {}
+
+
+def test_repeated_submission_is_scored_once(user_client, predictions, frames):
+    headers = {"Idempotency-Key": "submission-1"}
+    first = user_client.post("/api/clinical_score/Es4/frames", content=encode_frames(frames), headers=headers)
+    retry = user_client.post("/api/clinical_score/Es4/frames", content=encode_frames(frames), headers=headers)
+    assert first.status_code == retry.status_code == 200
+    assert "idempotent-replayed" not in first.headers
+    assert retry.headers["idempotent-replayed"] == "true"
+    assert retry.json() == first.json()
+    assert len(predictions) == 1
+    assert get_performance_count(user_client, "Es4") == 1
+
+
+def test_same_session_without_key_reuses_the_score_but_is_stored_again(user_client, predictions, frames):
+    csv_string = read_reference_session("Es4").head(120).to_csv(index=False)
+    first = user_client.post("/api/clinical_score/Es4", json={"csvString": csv_string})
+    # The same frames as a binary upload share the cached score
+    second = user_client.post("/api/clinical_score/Es4/frames", content=encode_frames(frames))
+    assert second.json() == first.json()
+    assert len(predictions) == 1
+    assert get_performance_count(user_client, "Es4") == 2
+
+
+def test_key_reused_for_another_session_is_rejected(user_client, predictions, frames):
+    headers = {"Idempotency-Key": "submission-2"}
+    user_client.post("/api/clinical_score/Es4/frames", content=encode_frames(frames), headers=headers)
+    response = user_client.post("/api/clinical_score/Es4/frames", content=encode_frames(frames[:60]), headers=headers)
+    assert response.status_code == 422
+    assert get_performance_count(user_client, "Es4") == 1
+
+
+@pytest.mark.parametrize("key", ["", "k" * 256])
+def test_invalid_idempotency_key(user_client, predictions, frames, key):
+    response = user_client.post(
+        "/api/clinical_score/Es4/frames", content=encode_frames(frames), headers={"Idempotency-Key": key}
+    )
+    assert response.status_code == 400
+
+
+# Function to open a scoring session and upload frames to it, returns its id
+def open_scoring_session(client, frames):
+    session_id = client.post("/api/scoring_sessions/Es4").json()["session_id"]
+    client.post(f"/api/scoring_sessions/{session_id}/frames", content=encode_frames(frames)).raise_for_status()
+    return session_id
+
+
+def test_scoring_session_close_is_replayed(user_client, predictions, frames):
+    session_id = open_scoring_session(user_client, frames)
+    headers = {"Idempotency-Key": "close-1"}
+    first = user_client.post(f"/api/scoring_sessions/{session_id}/close", headers=headers)
+    # The session is closed, the retry gets the stored response
+    retry = user_client.post(f"/api/scoring_sessions/{session_id}/close", headers=headers)
+    assert retry.status_code == 200
+    assert retry.headers["idempotent-replayed"] == "true"
+    assert retry.json() == first.json()
+    assert user_client.post(f"/api/scoring_sessions/{session_id}/close").status_code == 404
+    assert get_performance_count(user_client, "Es4") == 1
+
+
+def test_scoring_session_close_rejects_a_key_of_another_submission(user_client, predictions, frames):
+    first_session_id = open_scoring_session(user_client, frames)
+    user_client.post(f"/api/scoring_sessions/{first_session_id}/close", headers={"Idempotency-Key": "close-2"})
+    # Same frames, but another session
+    session_id = open_scoring_session(user_client, frames)
+    response = user_client.post(f"/api/scoring_sessions/{session_id}/close", headers={"Idempotency-Key": "close-2"})
+    assert response.status_code == 422
+    # The rejected close leaves the session open
+    assert user_client.post(f"/api/scoring_sessions/{session_id}/close").status_code == 200
+    assert get_performance_count(user_client, "Es4") == 2
@@ -0,0 +1,87 @@
+import gzip
+
+import numpy as np
+import pytest
+from conftest import read_reference_session
+
+import main
+from frame_codec import FrameDecodeError, encode_frames
+from ml_wrapper import MAX_FRAMES, MAX_LENGTH_MAPPING, PIPELINES
+from scoring_session import SCORING_CHUNK_MAX_BYTES, ScoringSession, load_chunk_frames
+from worker_pool import WorkerPool
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 64])
+def test_prepare_rows_in_chunks_matches_a_single_run(exercise_id, chunk_size):
+    pipeline = PIPELINES[exercise_id]
+    frames = read_reference_session(exercise_id).head(200).to_numpy(dtype=np.float32)
+    out = np.empty((len(frames), pipeline.num_features), dtype=np.float32)
+    # Chunks shorter than the smoothing window read the rows prepared by the previous chunks
+    for start in range(0, len(frames), chunk_size):
+        end = min(len(frames), start + chunk_size)
+        pipeline.prepare_rows(frames[:end], start, out[start:end])
+    expected_data, _ = pipeline.run(frames)
+    np.testing.assert_allclose(out, expected_data[0, : len(frames)], rtol=1e-6, atol=1e-6)
+
+
+def test_session_prepared_in_chunks_matches_prepare_array(exercise_id):
+    frames = read_reference_session(exercise_id).to_numpy(dtype=np.float32)
+    session = ScoringSession("user", exercise_id, MAX_LENGTH_MAPPING[exercise_id])
+    generator = np.random.default_rng(0)
+    start = 0
+    while start < len(frames):
+        end = start + int(generator.integers(1, 40))
+        frames_used = session.append(frames[start:end])
+        start = end
+    # Only the first MAX_FRAMES frames are used by the model
+    assert frames_used == session.num_frames == min(len(frames), MAX_FRAMES)
+    assert session.received_frames == len(frames)
+
+    data, padding_mask = session.prepared_data()
+    expected_data, expected_padding_mask = PIPELINES[exercise_id].run(frames)
+    np.testing.assert_allclose(data, expected_data, rtol=1e-6, atol=1e-6)
+    np.testing.assert_array_equal(padding_mask, expected_padding_mask)
+
+
+def test_session_appends_compressed_chunks():
+    frames = read_reference_session("Es3").head(90).to_numpy(dtype=np.float32)
+    session = ScoringSession("user", "Es3", MAX_LENGTH_MAPPING["Es3"])
+    session.append(load_chunk_frames(gzip.compress(encode_frames(frames[:50])), "gzip", "Es3"))
+    assert session.append(load_chunk_frames(encode_frames(frames[50:]), None, "Es3")) == 90
+    np.testing.assert_array_equal(session.frames[:90], frames)
+
+
+def test_oversized_chunks_are_rejected():
+    num_frames = SCORING_CHUNK_MAX_BYTES // (51 * 4) + 1
+    # Zeros compress well, the limit applies to the decompressed chunk
+    body = gzip.compress(encode_frames(np.zeros((num_frames, 51), dtype=np.float32)))
+    with pytest.raises(FrameDecodeError):
+        load_chunk_frames(body, "gzip", "Es4")
+
+
+def test_chunks_uploaded_with_a_process_pool_reach_the_session(user_client, monkeypatch):
+    # The chunks are decoded in a worker process, the session of the server process is filled
+    pool = WorkerPool("scoring", "process", 1, 4)
+    monkeypatch.setattr(main, "scoring_pool", pool)
+    frames = read_reference_session("Es2").head(120).to_numpy(dtype=np.float32)
+    try:
+        session_id = user_client.post("/api/scoring_sessions/Es2").json()["session_id"]
+        for start in (0, 70):
+            response = user_client.post(
+                f"/api/scoring_sessions/{session_id}/frames",
+                content=gzip.compress(encode_frames(frames[start : start + 70])),
+                headers={"Content-Encoding": "gzip"},
+            )
+            assert response.status_code == 200
+        assert response.json() == {"frames": 120, "frames_used": 120}
+        response = user_client.post(
+            f"/api/scoring_sessions/{session_id}/frames", content=b"not gzip", headers={"Content-Encoding": "gzip"}
+        )
+        assert response.status_code == 400
+    finally:
+        pool.shutdown()
+    session = main.scoring_sessions._sessions[session_id]
+    data, padding_mask = session.prepared_data()
+    expected_data, expected_padding_mask = PIPELINES["Es2"].run(frames)
+    np.testing.assert_allclose(data, expected_data, rtol=1e-6, atol=1e-6)
+    np.testing.assert_array_equal(padding_mask, expected_padding_mask)
@@ -0,0 +1,108 @@
+# Importing necessary libraries
+import os
+import threading
+
+import numpy as np
+
+from bucketed_inference import get_active_windows
+from lazy_imports import lazy_import
+
+# The standalone TFLite runtime is enough to serve the exported models, TensorFlow is only imported without it
+try:
+    from tflite_runtime.interpreter import Interpreter
+except ImportError:
+    Interpreter = None
+tf = lazy_import("tensorflow")
+
+# TFLite serving settings
+# Number of threads used by the TFLite interpreter of each model (the scoring pool already runs requests in parallel)
+TFLITE_THREADS = int(os.environ.get("REHABAI_TFLITE_THREADS", 1))
+
+# Signature of the exported models running the whole input, and prefix of the bucketed signatures
+# (bucket_<k> only runs the first k windows of the input, see bucketed_inference.py)
+FULL_SIGNATURE = "full"
+BUCKET_SIGNATURE_PREFIX = "bucket_"
+
+
+# Function to get the TFLite file of a Keras model file
+def get_tflite_path(path):
+    return os.path.splitext(path)[0] + ".tflite"
+
+
+# Clinical score model exported by model_export.py, run by the TFLite interpreter
+class TFLiteModel:
+    def __init__(self, path, num_threads=TFLITE_THREADS):
+        self.path = path
+        with open(path, "rb") as model_file:
+            self.model_content = model_file.read()
+        interpreter_class = Interpreter or tf.lite.Interpreter
+        self.interpreter = interpreter_class(model_content=self.model_content, num_threads=max(1, num_threads))
+        signatures = self.interpreter.get_signature_list()
+        if FULL_SIGNATURE not in signatures:
+            raise ValueError(f"{path} has no {FULL_SIGNATURE} signature, export it with model_export.py")
+        self._runners = {name: self.interpreter.get_signature_runner(name) for name in signatures}
+
+        full_shape = self._get_input_shape(FULL_SIGNATURE)
+        self.max_length, self.num_features = int(full_shape[1]), int(full_shape[2])
+        # Number of active windows of each bucketed signature
+        self.buckets = sorted(
+            int(name[len(BUCKET_SIGNATURE_PREFIX) :]) for name in signatures if name.startswith(BUCKET_SIGNATURE_PREFIX)
+        )
+        self.window_size = int(self._get_input_shape(f"{BUCKET_SIGNATURE_PREFIX}1")[1]) if self.buckets else None
+        # The interpreter's tensors are shared by its signature runners, so one prediction runs at a time
+        self._lock = threading.Lock()
+        self.bucket_calls = {}
+        self.full_calls = 0
+
+    def _get_input_shape(self, signature):
+        return self._runners[signature].get_input_details()["data"]["shape_signature"]
+
+    def get_active_windows(self, data, padding_masks):
+        if self.window_size is None:
+            return None
+        active_windows = get_active_windows(data, padding_masks, self.window_size)
+        return active_windows if active_windows in self.buckets else None
+
+    def _run(self, signature, data, padding_masks):
+        with self._lock:
+            outputs = self._runners[signature](
+                data=np.ascontiguousarray(data, dtype=np.float32),
+                padding_masks=np.ascontiguousarray(padding_masks, dtype=np.float32),
+            )
+        return next(iter(outputs.values()))
+
+    # Function to predict the scores of a batch of prepared inputs of shape (batch, max_length, features)
+    def predict(self, data, padding_masks):
+        active_windows = self.get_active_windows(data, padding_masks)
+        if active_windows is None:
+            self.full_calls += 1
+            return self._run(FULL_SIGNATURE, data, padding_masks)
+
+        self.bucket_calls[active_windows] = self.bucket_calls.get(active_windows, 0) + 1
+        active_length = active_windows * self.window_size
+        return self._run(
+            f"{BUCKET_SIGNATURE_PREFIX}{active_windows}", data[:, :active_length], padding_masks[:, :active_length]
+        )
+
+    def warm_up(self):
+        # Run every signature once so the interpreter allocates its tensors before the first request
+        data = np.zeros((1, self.max_length, self.num_features), dtype=np.float32)
+        padding_masks = np.ones((1, self.max_length), dtype=np.float32)
+        self._run(FULL_SIGNATURE, data, padding_masks)
+        for active_windows in self.buckets:
+            active_length = active_windows * self.window_size
+            self._run(
+                f"{BUCKET_SIGNATURE_PREFIX}{active_windows}", data[:, :active_length], padding_masks[:, :active_length]
+            )
+
+    def memory_bytes(self):
+        # The flatbuffer holds the (possibly quantized) weights
+        return len(self.model_content)
+
+    def stats(self):
+        return {
+            "num_windows": self.max_length // self.window_size if self.window_size else None,
+            "window_size": self.window_size,
+            "bucket_calls": dict(self.bucket_calls),
+            "full_calls": self.full_calls,
+        }
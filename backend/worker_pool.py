@@ -0,0 +1,191 @@
+# Importing necessary libraries
+import asyncio
+import contextvars
+import multiprocessing
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from metrics import record_stage
+from model_registry import model_registry
+
+# Scoring pool settings (csv parsing, data preparation and model predictions)
+# "thread" runs the work in threads of the server process, "process" runs it in worker processes
+# that each preload their own set of models
+SCORING_POOL_MODE = os.environ.get("REHABAI_SCORING_POOL_MODE", "thread")
+SCORING_POOL_WORKERS = int(os.environ.get("REHABAI_SCORING_POOL_WORKERS", 2))
+SCORING_POOL_QUEUE = int(os.environ.get("REHABAI_SCORING_POOL_QUEUE", 16))
+
+# Feedback pool settings (live DTW computations), kept separate so slow scoring jobs do not delay live feedback
+FEEDBACK_POOL_WORKERS = int(os.environ.get("REHABAI_FEEDBACK_POOL_WORKERS", 4))
+FEEDBACK_POOL_QUEUE = int(os.environ.get("REHABAI_FEEDBACK_POOL_QUEUE", 64))
+
+# Hashing pool settings (bcrypt password hashing and verification at signup and login)
+HASHING_POOL_WORKERS = int(os.environ.get("REHABAI_HASHING_POOL_WORKERS", 2))
+HASHING_POOL_QUEUE = int(os.environ.get("REHABAI_HASHING_POOL_QUEUE", 32))
+
+# Number of recent tasks of each kind used for the latency percentiles
+TIMING_SAMPLES = 1000
+
+# Number of seconds clients are asked to wait before retrying when a pool is full
+RETRY_AFTER_SECONDS = int(os.environ.get("REHABAI_RETRY_AFTER_SECONDS", 1))
+
+
+# Raised when a pool already has its maximum number of queued and running tasks
+class PoolSaturated(Exception):
+    def __init__(self, pool_name, retry_after):
+        super().__init__(f"The {pool_name} pool is saturated")
+        self.pool_name = pool_name
+        self.retry_after = retry_after
+
+
+# Function to run a task and measure how long it ran (module-level so it can be sent to worker processes)
+def timed_call(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+# Function to load the models once in each worker process
+def preload_worker_models():
+    model_registry.preload()
+
+
+# Timing statistics for one kind of task
+class TaskTimings:
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total_wait_seconds = 0.0
+        self.total_run_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.max_run_seconds = 0.0
+        # Recent wait and run times, for the percentiles
+        self.recent_wait_seconds = deque(maxlen=TIMING_SAMPLES)
+        self.recent_run_seconds = deque(maxlen=TIMING_SAMPLES)
+
+    def record(self, wait_seconds, run_seconds):
+        self.count += 1
+        self.recent_wait_seconds.append(wait_seconds)
+        self.recent_run_seconds.append(run_seconds)
+        self.total_wait_seconds += wait_seconds
+        self.total_run_seconds += run_seconds
+        self.max_wait_seconds = max(self.max_wait_seconds, wait_seconds)
+        self.max_run_seconds = max(self.max_run_seconds, run_seconds)
+
+    @staticmethod
+    def percentiles(samples):
+        samples = sorted(samples)
+        if not samples:
+            return {"p50": 0.0, "p95": 0.0, "p99": 0.0}
+        return {
+            f"p{percentile}": samples[min(len(samples) - 1, len(samples) * percentile // 100)]
+            for percentile in (50, 95, 99)
+        }
+
+    def to_dict(self):
+        count = max(self.count, 1)
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "mean_wait_seconds": self.total_wait_seconds / count,
+            "mean_run_seconds": self.total_run_seconds / count,
+            "max_wait_seconds": self.max_wait_seconds,
+            "max_run_seconds": self.max_run_seconds,
+            "wait_seconds_percentiles": self.percentiles(self.recent_wait_seconds),
+            "run_seconds_percentiles": self.percentiles(self.recent_run_seconds),
+        }
+
+
+# Bounded pool that runs CPU-bound work off the event loop
+class WorkerPool:
+    def __init__(self, name, mode, max_workers, max_queue, initializer=None, retry_after=RETRY_AFTER_SECONDS):
+        self.name = name
+        self.mode = mode
+        self.max_workers = max(1, max_workers)
+        self.max_queue = max(0, max_queue)
+        self.initializer = initializer
+        self.retry_after = retry_after
+        self.in_flight = 0
+        self.rejected = 0
+        self.timings = {}
+        self._executor = None
+
+    def _get_executor(self):
+        if self._executor is None:
+            if self.mode == "process":
+                # Worker processes are spawned because forking a process that already imported TensorFlow is unsafe
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=self.initializer,
+                )
+            else:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix=f"{self.name}-pool"
+                )
+        return self._executor
+
+    async def run(self, fn, *args):
+        # Reject the task if the pool already holds max_workers running and max_queue waiting tasks
+        if self.in_flight >= self.max_workers + self.max_queue:
+            self.rejected += 1
+            raise PoolSaturated(self.name, self.retry_after)
+
+        timings = self.timings.setdefault(fn.__name__, TaskTimings())
+        loop = asyncio.get_running_loop()
+        self.in_flight += 1
+        submitted = time.perf_counter()
+        try:
+            if self.mode == "process":
+                call = (timed_call, fn, *args)
+            else:
+                # Threads run the task in a copy of the caller's context, so its spans reach the request profile
+                call = (contextvars.copy_context().run, timed_call, fn, *args)
+            result, run_seconds = await loop.run_in_executor(self._get_executor(), *call)
+        except Exception:
+            timings.errors += 1
+            raise
+        finally:
+            self.in_flight -= 1
+
+        wait_seconds = max(time.perf_counter() - submitted - run_seconds, 0.0)
+        timings.record(wait_seconds, run_seconds)
+        record_stage(f"{self.name}_pool_wait", wait_seconds)
+        return result
+
+    def start(self):
+        # Start the worker processes up front so they preload their models before the first request
+        if self.mode == "process":
+            executor = self._get_executor()
+            for _ in range(self.max_workers):
+                executor.submit(time.sleep, 0)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def stats(self):
+        return {
+            "mode": self.mode,
+            "max_workers": self.max_workers,
+            "max_queue": self.max_queue,
+            "in_flight": self.in_flight,
+            "rejected": self.rejected,
+            "tasks": {name: timings.to_dict() for name, timings in self.timings.items()},
+        }
+
+
+# Pools shared by the endpoints
+scoring_pool = WorkerPool(
+    "scoring",
+    SCORING_POOL_MODE,
+    SCORING_POOL_WORKERS,
+    SCORING_POOL_QUEUE,
+    initializer=preload_worker_models if SCORING_POOL_MODE == "process" else None,
+)
+feedback_pool = WorkerPool("feedback", "thread", FEEDBACK_POOL_WORKERS, FEEDBACK_POOL_QUEUE)
+# bcrypt releases the GIL, so password hashing threads do not block the event loop
+hashing_pool = WorkerPool("hashing", "thread", HASHING_POOL_WORKERS, HASHING_POOL_QUEUE)
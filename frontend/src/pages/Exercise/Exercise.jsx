@@ -14,9 +14,8 @@ import TimeDisplay from '../../components/TimeDisplay';
 import TopBar from '../../components/TopBar.jsx'
 import VideoDisplay from '../../components/VideoDisplay';
 
-// Renderer and utility functions
+// Renderer
 import {RendererCanvas2d} from './renderer_canvas2d'
-import { csvToJSON } from './utils'
 
 // Higher order component for routing
 import {withRouter} from './withRouter.jsx'
@@ -69,7 +68,6 @@ class Exercise extends Component {
       },
       referenceVideo: null,
       referenceVideoPlaying: false,
-      referenceDF: null, // DataFrame to store reference data
       feedbackMessages: [], // Array to store all feedback messages
       currentFeedbackMessages: [], // Array to store current feedback messages
       videoLoaded: false,
@@ -123,7 +121,6 @@ class Exercise extends Component {
 
     this.detectPose()
     this.loadReferenceVideo()
-    this.loadReferenceJointPositions()
   }
 
   // Method to setup the camera
@@ -175,22 +172,6 @@ class Exercise extends Component {
     this.setState({ referenceVideoLoaded: true })
   }
 
-  // Method to load the reference joint positions from the CSV file
-  loadReferenceJointPositions = async () => {
-    try {
-      const exerciseInfo = this.props.router.location.state.exercise
-      console.log(exerciseInfo)
-      const response = await fetch(exerciseInfo.csv)
-      const csvText = await response.text()
-      const referenceJointPositions = csvToJSON(csvText)
-      const referenceDF = new DataFrame(referenceJointPositions)
-      this.setState({ referenceDF })
-      console.log(referenceDF.to_json({orient: 'columns'}))
-    } catch (error) {
-      console.error('Error loading reference joint positions:', error)
-    }
-  }
-
   detectPose() {
     const {videoWidth, videoHeight} = this.props
     const canvas = this.canvas
@@ -277,26 +258,28 @@ class Exercise extends Component {
       if(this.state.exerciseDf.length >= 30 && this.state.exerciseDf.length % 30 === 0) {
         // Compare the current joint positions with the reference
         this.compareJointsWithReference()
+        // Upload the new frames so they are prepared for scoring while the exercise goes on
+        this.uploadExerciseFrames()
       }
     });
   }
 
-  // Method to get the DTW value between the current and reference joint values
-  getDTWCost = async (currentJointValues, referenceJointValues) => {
+  // Method to get the DTW values of all compared columns between the current frames and the
+  // server-side reference frames in a single request (used when no feedback session is open)
+  getDTWCosts = async (columns, currentFrames) => {
     // Get the exercise information from the router state
     const exerciseInfo = this.props.router.location.state.exercise
     
     try {
-      const response = await api.post(`/api/feedback/${exerciseInfo.exercise_id}/`, {
-        referenceJointValues: referenceJointValues,
-        currentJointValues: currentJointValues
+      const response = await api.post(`/api/feedback/${exerciseInfo.exercise_id}/batch`, {
+        columns: columns,
+        currentFrames: currentFrames
       })
 
       console.log(response.data)
 
       if (response.data) {
-        console.log(response.data.feedback_dtw[0])
-        return response.data.feedback_dtw[0]
+        return response.data.feedback_dtw
       } else {
         console.error('No data returned from DTW API')
       }
@@ -304,41 +287,108 @@ class Exercise extends Component {
       console.error('Failed to fetch dtw:', error)
     }
    }
+
+  // Method to open a feedback session, which keeps the DTW state on the server so every comparison only sends
+  // the frames recorded since the previous one
+  startFeedbackSession = async () => {
+    const exerciseId = this.props.router.location.state.exercise.exercise_id
+    this.feedbackSessionId = null
+    this.comparedFrames = 0
+    try {
+      const response = await api.post(`/api/feedback_sessions/${exerciseId}`, { columns: this.getComparedColumns() })
+      this.feedbackSessionId = response.data.session_id
+    } catch (error) {
+      console.error('Failed to open feedback session:', error)
+    }
+  }
+
+  // Method to close the feedback session when the exercise is finished
+  closeFeedbackSession = () => {
+    this.feedbackUpdates = (this.feedbackUpdates || Promise.resolve()).then(async () => {
+      if (!this.feedbackSessionId) {
+        return
+      }
+      const sessionId = this.feedbackSessionId
+      this.feedbackSessionId = null
+      try {
+        await api.delete(`/api/feedback_sessions/${sessionId}`)
+      } catch (error) {
+        console.error('Failed to close feedback session:', error)
+      }
+    })
+    return this.feedbackUpdates
+  }
+
+  // Method to get the DTW values of all compared columns for the frames recorded so far, sending only the
+  // new frames to the feedback session (falls back to sending every frame when no session is open)
+  getSessionDTWCosts = async (df, columns) => {
+    const end = df.length
+    if (this.feedbackSessionId) {
+      try {
+        const chunk = df.iloc({ rows: [`${this.comparedFrames}:${end}`] })
+        const currentJointValues = Object.fromEntries(columns.map(col => [col, chunk.get(col).values.toArray()]))
+        const response = await api.post(`/api/feedback_sessions/${this.feedbackSessionId}/frames`, { currentJointValues })
+        this.comparedFrames = end
+        return response.data.feedback_dtw
+      } catch (error) {
+        // The session no longer matches the recorded frames, the next comparisons send every frame
+        console.error('Failed to update feedback session:', error)
+        this.feedbackSessionId = null
+      }
+    }
+    return this.getDTWCosts(columns, this.getFrameMatrix(df, columns))
+  }
+
+  // Method to convert the given columns of a DataFrame into a frame matrix (one row per frame)
+  getFrameMatrix = (df, columns) => {
+    const columnValues = columns.map(col => df.get(col).values.toArray())
+    return columnValues[0].map((_, frameIndex) => columnValues.map(values => values[frameIndex]))
+  }
   
-  // Method to compare the current joint positions with the reference
-  compareJointsWithReference =  async () => {
-    const currentJointPositions = this.state.exerciseDf; 
-    const currentFrameIndex = currentJointPositions.length - 1; // Index of the current frame
-    const referenceFrames = this.state.referenceDF.iloc([0, currentFrameIndex + 1]);
+  // Method to get the joints compared with the reference (important joints only)
+  getComparedJoints = () => {
+    return Object.keys(this.state.keypoint_dict).filter(jointName => {
+      const jointIndex = this.state.keypoint_dict[jointName]
+      return jointIndex > 4 && jointIndex <= 12
+    })
+  }
+
+  // Method to get the compared columns, the x and y coordinates of the compared joints
+  getComparedColumns = () => {
+    return this.getComparedJoints().flatMap(jointName => [jointName + '_x', jointName + '_y'])
+  }
+
+  // Method to compare the current joint positions with the reference (comparisons are sent one after the other,
+  // so the feedback session receives the frames in order)
+  compareJointsWithReference = () => {
+    this.feedbackUpdates = (this.feedbackUpdates || Promise.resolve()).then(() => this.compareJoints(this.state.exerciseDf))
+    return this.feedbackUpdates
+  }
+
+  // Method to compare the given joint positions with the same number of reference frames
+  compareJoints = async (currentJointPositions) => {
+    const comparedJoints = this.getComparedJoints()
+    const columns = this.getComparedColumns()
+
+    // Compare the x and y coordinates of all the joints in a single request
+    const costs = await this.getSessionDTWCosts(currentJointPositions, columns);
+    if (!costs) {
+      return;
+    }
 
     let currentFeedbackMessages = [];
     console.log("frame", currentJointPositions.length, ":")
-    for (const [jointName, jointIndex] of Object.entries(this.state.keypoint_dict)) {
-      // Comparing important joints only
-      if (jointIndex <= 4 || jointIndex > 12) {
-        continue;
-      }
-
+    for (const jointName of comparedJoints) {
       const jointNameWithSpaces = jointName.replace(/_/g, ' ');
 
-      // Compare the x-coordinates of the current joint and the reference joint
-      const col_x = jointName + '_x'
-      const currentJointXValues = currentJointPositions.get(col_x).values.toArray();
-      const referenceJointXValues = referenceFrames.get(col_x).values.toArray();
-
-      const costX = await this.getDTWCost(currentJointXValues, referenceJointXValues);
+      const costX = costs[jointName + '_x'];
       console.log(`cost ${jointName}_x = ${costX}`)
       // If the cost (dissimilarity) is greater than 2.5, add feedback message
       if (costX > 2.5) {
         currentFeedbackMessages.push({message: `Adjust your ${jointNameWithSpaces} horizontally`, index: this.state.feedbackMessages.length})
       }
 
-      // Compare the y-coordinates of the current joint and the reference joint
-      const col_y = jointName + '_y'
-      const currentJointYValues = currentJointPositions.get(col_y).values.toArray();
-      const referenceJointYValues = referenceFrames.get(col_y).values.toArray();
-
-      const costY = await this.getDTWCost(currentJointYValues, referenceJointYValues);
+      const costY = costs[jointName + '_y'];
       console.log(`cost ${jointName}_y = ${costY}`)
       // If the cost (dissimilarity) is greater than 2.5, add feedback message
       if (costY > 2.5) {
@@ -352,6 +402,60 @@ class Exercise extends Component {
     console.log(" ")
   }
 
+  // Method to encode the exercise frames as a binary frame buffer (16 byte "RHAI" header followed by
+  // little-endian float32 values, one frame after the other, with the y, x and confidence columns of every keypoint)
+  encodeExerciseFrames = (df) => {
+    const columns = Object.keys(this.state.keypoint_dict).flatMap(jointName => [jointName + '_y', jointName + '_x', jointName + '_confidence'])
+    const frames = this.getFrameMatrix(df, columns)
+    const buffer = new ArrayBuffer(16 + frames.length * columns.length * 4)
+    const view = new DataView(buffer)
+    'RHAI'.split('').forEach((char, index) => view.setUint8(index, char.charCodeAt(0)))
+    view.setUint8(4, 1) // Format version
+    view.setUint8(5, 1) // float32 values
+    view.setUint32(8, frames.length, true)
+    view.setUint16(12, columns.length, true)
+    frames.forEach((frame, frameIndex) => {
+      frame.forEach((value, columnIndex) => view.setFloat32(16 + (frameIndex * columns.length + columnIndex) * 4, value, true))
+    })
+    return buffer
+  }
+
+  // Method to open a scoring session so the exercise frames can be uploaded while the user is exercising
+  startScoringSession = async () => {
+    const exerciseId = this.props.router.location.state.exercise.exercise_id
+    this.scoringSessionId = null
+    this.uploadedFrames = 0
+    try {
+      const response = await api.post(`/api/scoring_sessions/${exerciseId}`)
+      this.scoringSessionId = response.data.session_id
+    } catch (error) {
+      console.error('Failed to open scoring session:', error)
+    }
+  }
+
+  // Method to upload the frames recorded since the last upload to the scoring session (uploads are sent one after the other)
+  uploadExerciseFrames = () => {
+    this.frameUploads = (this.frameUploads || Promise.resolve()).then(async () => {
+      const df = this.state.exerciseDf
+      const end = df.length
+      if (!this.scoringSessionId || end <= this.uploadedFrames) {
+        return
+      }
+      try {
+        const chunk = df.iloc({ rows: [`${this.uploadedFrames}:${end}`] })
+        await api.post(`/api/scoring_sessions/${this.scoringSessionId}/frames`, this.encodeExerciseFrames(chunk), {
+          headers: { 'Content-Type': 'application/octet-stream' }
+        })
+        this.uploadedFrames = end
+      } catch (error) {
+        // Fall back to sending all the frames when the exercise is finished
+        console.error('Failed to upload exercise frames:', error)
+        this.scoringSessionId = null
+      }
+    })
+    return this.frameUploads
+  }
+
   // Method to fetch the clinical score for the exercise
   fetchClinicalScore = async () => {
     const feedbackThreshold = 75
@@ -363,9 +467,19 @@ class Exercise extends Component {
       const exerciseId = exerciseInfo.exercise_id
       console.log("Sending exercise id", exerciseId)
       try {
-        const response = await api.post(`/api/clinical_score/${exerciseId}`, {
-          csvString: this.state.exerciseDf.to_csv(),
-        })
+        // Upload the last frames, the earlier ones were uploaded during the exercise
+        await this.uploadExerciseFrames()
+        let response
+        if (this.scoringSessionId) {
+          // The uploaded frames are already prepared, so closing the session only runs the model
+          response = await api.post(`/api/scoring_sessions/${this.scoringSessionId}/close`)
+          this.scoringSessionId = null
+        } else {
+          // Frames are sent as a binary frame buffer, which is smaller and faster to parse than a csv string
+          response = await api.post(`/api/clinical_score/${exerciseId}/frames`, this.encodeExerciseFrames(this.state.exerciseDf), {
+            headers: { 'Content-Type': 'application/octet-stream' }
+          })
+        }
         if (response.data) {
           this.setState({ clinicalScore: response.data.clinical_score[0][0] })
           console.log(response.data.clinical_score[0][0])
@@ -392,6 +506,9 @@ class Exercise extends Component {
       if (countdown < 0) {
         clearInterval(countdownInterval);
         this.setState({ isSaving: true, isExerciseFinished: false, exerciseDf: new DataFrame(), currentFeedbackMessages: [], feedbackMessages: [], clinicalScore: null })
+        // Frame uploads and comparisons wait for their session to be opened
+        this.frameUploads = this.startScoringSession()
+        this.feedbackUpdates = this.startFeedbackSession()
         
         // If a reference video exists, start playing it
         if (this.referenceVideo) {
@@ -432,6 +549,7 @@ class Exercise extends Component {
       this.referenceVideo.currentTime = 0
     }
     this.setState({ isExerciseFinished: true });
+    this.closeFeedbackSession();
     this.fetchClinicalScore();
   }
 